@@ -0,0 +1,235 @@
+"""
+Controllo di ammissione per le richieste costose (backtest e frontiera efficiente).
+
+Il costo di una richiesta è stimato in "celle" di lavoro, prima di scaricare
+qualsiasi dato:
+- backtest: ticker (portafoglio + benchmark) x giorni di borsa del periodo;
+- frontiera: ticker x giorni di borsa (pannello dei prezzi) più
+  num_portfolios x ticker (matrice dei pesi campionati);
+- stress test: ticker x giorni di borsa più portafogli x scenari x giorni
+  (un percorso per portafoglio e scenario).
+
+Con il costo la richiesta viene instradata:
+- percorso veloce (costo <= FAST_PATH_COST): eseguita subito, senza attesa, nel
+  threadpool di Starlette (mai sull'event loop) e contata nel costo in esecuzione;
+- percorso in coda: eseguita in un pool di ADMISSION_WORKERS thread quando il
+  costo in esecuzione lascia spazio (ADMISSION_CAPACITY), senza bloccare
+  l'event loop. Se la coda è già piena, o l'attesa supera QUEUE_TIMEOUT_SECONDS,
+  la richiesta viene scartata con 429 e Retry-After.
+Una richiesta che da sola supera la capacità non potrebbe mai essere eseguita
+e riceve 400.
+
+Le risposte in streaming (backtest progressivo, export) passano dagli stessi
+percorsi con acquire() e tengono il budget per tutta la durata dello stream
+(stream()), finché l'ultimo blocco è inviato o il client si disconnette.
+"""
+import asyncio
+import contextvars
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Optional, Sequence, Set
+
+import numpy as np
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+import stage_metrics
+
+
+# Celle in esecuzione contemporaneamente sul percorso in coda (~8 byte per cella per copia)
+ADMISSION_CAPACITY = int(os.environ.get('ADMISSION_CAPACITY', 50_000_000))
+# Fino a questo costo la richiesta è eseguita subito (es. frontiera 50k portafogli x 20 ETF)
+FAST_PATH_COST = 1_000_000
+# Celle che possono attendere in coda oltre a quelle in esecuzione
+QUEUE_CAPACITY = ADMISSION_CAPACITY
+QUEUE_TIMEOUT_SECONDS = 30
+ADMISSION_WORKERS = 2
+# Stima iniziale del tempo per cella (frontiera: ~20M celle in 2-4 s), poi media mobile delle misure
+SECONDS_PER_CELL_HINT = 2e-7
+TIMING_SMOOTHING = 0.2
+
+
+def trading_days(start_date: str, end_date: str) -> int:
+    """Giorni lavorativi tra due date 'YYYY-MM-DD' (stima dei giorni di borsa)."""
+    try:
+        start = datetime.strptime(start_date, '%Y-%m-%d').date()
+        end = datetime.strptime(end_date, '%Y-%m-%d').date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Date non valide: {start_date} - {end_date} (formato YYYY-MM-DD)")
+    return max(int(np.busday_count(start, end)), 1) if end > start else 1
+
+
+def backtest_cost(tickers: Sequence[str], start_date: str, end_date: str) -> int:
+    return len(set(tickers)) * trading_days(start_date, end_date)
+
+
+def frontier_cost(tickers: Sequence[str], start_date: str, end_date: str, num_portfolios: int) -> int:
+    n_tickers = len(set(tickers))
+    return n_tickers * trading_days(start_date, end_date) + num_portfolios * n_tickers
+
+
+def stress_cost(tickers: Sequence[str], start_date: str, end_date: str, n_portfolios: int, n_scenarios: int) -> int:
+    days = trading_days(start_date, end_date)
+    return len(set(tickers)) * days + n_portfolios * n_scenarios * days
+
+
+class AdmissionController:
+    """Budget di celle in esecuzione e in coda, con stima del tempo per cella."""
+
+    def __init__(self, capacity: int = ADMISSION_CAPACITY, fast_path_cost: int = FAST_PATH_COST,
+                 queue_capacity: int = QUEUE_CAPACITY, workers: int = ADMISSION_WORKERS):
+        self.capacity = capacity
+        self.fast_path_cost = fast_path_cost
+        self.queue_capacity = queue_capacity
+        self.workers = workers
+        self.in_flight = 0
+        self.queued = 0
+        self.shed = 0
+        self.fast_path = 0
+        self.queued_path = 0
+        self.seconds_per_cell = SECONDS_PER_CELL_HINT
+        self._lock = threading.Lock()
+        self._condition: Optional[asyncio.Condition] = None
+        self._condition_loop = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._notify_tasks: Set[asyncio.Task] = set()
+
+    def _get_condition(self) -> asyncio.Condition:
+        # Una Condition vale per un solo event loop (rilevante con più loop, es. nei client di test)
+        loop = asyncio.get_running_loop()
+        if self._condition is None or self._condition_loop is not loop:
+            self._condition, self._condition_loop = asyncio.Condition(), loop
+        return self._condition
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='admission')
+            return self._executor
+
+    def retry_after(self, cost: int) -> int:
+        """Secondi stimati prima che ci sia spazio per una richiesta di questo costo."""
+        backlog = self.in_flight + self.queued + cost - self.capacity
+        return max(1, math.ceil(max(backlog, cost) * self.seconds_per_cell / self.workers))
+
+    def _shed(self, cost: int, reason: str):
+        self.shed += 1
+        raise HTTPException(
+            status_code=429,
+            detail=f"Server occupato ({reason}): riprovare più tardi",
+            headers={"Retry-After": str(self.retry_after(cost))}
+        )
+
+    def check(self, cost: int):
+        """400 per le richieste che da sole superano la capacità."""
+        if cost > self.capacity:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Richiesta troppo costosa (stima {cost:,} celle, massimo {self.capacity:,}): "
+                       f"ridurre ticker, periodo o num_portfolios"
+            )
+
+    def _record(self, cost: int, seconds: float):
+        if cost > 0:
+            with self._lock:
+                self.seconds_per_cell = (1 - TIMING_SMOOTHING) * self.seconds_per_cell + TIMING_SMOOTHING * seconds / cost
+
+    async def acquire(self, cost: int) -> bool:
+        """
+        Riserva cost celle: subito sul percorso veloce, altrimenti attendendo spazio in coda
+        (429 se la coda è piena o l'attesa scade). Restituisce True per il percorso in coda.
+        Il budget va restituito con release().
+        """
+        self.check(cost)
+        condition = self._get_condition()
+        if cost <= self.fast_path_cost:
+            self.fast_path += 1
+            self.in_flight += cost
+            return False
+
+        async with condition:
+            if self.in_flight + self.queued + cost > self.capacity + self.queue_capacity:
+                self._shed(cost, "coda piena")
+            self.queued += cost
+            try:
+                await asyncio.wait_for(condition.wait_for(lambda: self.in_flight + cost <= self.capacity),
+                                       QUEUE_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                self._shed(cost, "attesa in coda scaduta")
+            finally:
+                self.queued -= cost
+            self.in_flight += cost
+            self.queued_path += 1
+        return True
+
+    def release(self, cost: int):
+        """Restituisce il budget di acquire(); senza attese, quindi valido anche durante una cancellazione."""
+        self.in_flight -= cost
+        if self._condition is not None and self._condition_loop is asyncio.get_running_loop():
+            task = asyncio.get_running_loop().create_task(self._notify(self._condition))
+            self._notify_tasks.add(task)
+            task.add_done_callback(self._notify_tasks.discard)
+
+    @staticmethod
+    async def _notify(condition: asyncio.Condition):
+        async with condition:
+            condition.notify_all()
+
+    async def run(self, cost: int, fn: Callable):
+        """Esegue fn() sul percorso veloce o, rispettando il budget, sul percorso in coda."""
+        queued = await self.acquire(cost)
+        try:
+            if not queued:
+                # Nessuna attesa, ma il lavoro (download compresi) resta fuori dall'event loop
+                return await run_in_threadpool(contextvars.copy_context().run, fn)
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            try:
+                # Il contesto (stadi per Server-Timing, profiling) segue la richiesta nel thread
+                return await loop.run_in_executor(self._get_executor(), contextvars.copy_context().run, fn)
+            finally:
+                self._record(cost, loop.time() - start)
+        finally:
+            self.release(cost)
+
+    def stream(self, cost: int, content, **kwargs) -> StreamingResponse:
+        """StreamingResponse che restituisce il budget (già preso con acquire) a fine stream."""
+        return _AdmittedStreamingResponse(self, cost, content, **kwargs)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+class _AdmittedStreamingResponse(StreamingResponse):
+    def __init__(self, controller: AdmissionController, cost: int, content, **kwargs):
+        super().__init__(content, **kwargs)
+        self.controller = controller
+        self.cost = cost
+
+    async def __call__(self, scope, receive, send):
+        # Fine dello stream, errore o disconnessione del client: il budget torna sempre disponibile
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.controller.release(self.cost)
+
+
+admission = AdmissionController()
+
+stage_metrics.register_metric('portfolio_admission_in_flight_cells', 'gauge',
+                              'Celle in esecuzione (percorso veloce e in coda).', lambda: admission.in_flight)
+stage_metrics.register_metric('portfolio_admission_queued_cells', 'gauge',
+                              'Celle in attesa di capacità.', lambda: admission.queued)
+stage_metrics.register_metric('portfolio_admission_shed_total', 'counter',
+                              'Richieste scartate con 429.', lambda: admission.shed)
+stage_metrics.register_metric('portfolio_admission_fast_path_total', 'counter',
+                              'Richieste eseguite sul percorso veloce.', lambda: admission.fast_path)
+stage_metrics.register_metric('portfolio_admission_queued_path_total', 'counter',
+                              'Richieste eseguite sul percorso in coda.', lambda: admission.queued_path)
@@ -0,0 +1,232 @@
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional
+from pydantic import BaseModel
+from fastapi import HTTPException
+
+from constraints import WeightBounds, GroupConstraint, ConstraintSet, build_constraint_set
+from efficient_frontier import EtfInput, load_etf_returns
+
+
+TRADING_DAYS = 252
+
+
+class AllocationConfig(BaseModel):
+    start_date: str = "2010-01-01"
+    end_date: str = "2024-12-31"
+    risk_free_rate: float = 0.02
+    risk_budgets: Dict[str, float] = {}  # Risk parity: budget di rischio per ticker (default uguale)
+    cvar_confidence: float = 0.95  # Min-CVaR: livello di confidenza
+    min_weight: float = 0.0
+    max_weight: float = 1.0
+    asset_bounds: Dict[str, WeightBounds] = {}
+    group_constraints: List[GroupConstraint] = []
+
+
+class AllocationPayload(BaseModel):
+    etfs: List[EtfInput]
+    config: AllocationConfig = AllocationConfig()
+
+
+def risk_parity_weights(cov: np.ndarray, budgets: Optional[np.ndarray] = None,
+                        tol: float = 1e-10, max_sweeps: int = 1000) -> np.ndarray:
+    """
+    Equal-risk-contribution weights by cyclical coordinate descent.
+
+    Minimizes 0.5 * y'Σy - Σ b_i log(y_i) one coordinate at a time; each
+    coordinate has a closed-form positive root, and the product Σy is
+    updated incrementally, so a sweep costs O(N²). The normalized solution
+    w = y / sum(y) has risk contributions w_i (Σw)_i proportional to b_i.
+    """
+    n_assets = cov.shape[0]
+    budgets = np.full(n_assets, 1.0 / n_assets) if budgets is None else budgets / budgets.sum()
+
+    diag = np.diag(cov).copy()
+    if (diag <= 0).any():
+        raise HTTPException(status_code=400, detail="Risk parity requires every asset to have positive variance")
+
+    y = budgets / np.sqrt(diag)
+    cov_y = cov @ y
+    for _ in range(max_sweeps):
+        y_prev = y.copy()
+        for i in range(n_assets):
+            b = cov_y[i] - diag[i] * y[i]
+            y_new = (-b + np.sqrt(b * b + 4.0 * diag[i] * budgets[i])) / (2.0 * diag[i])
+            cov_y += cov[:, i] * (y_new - y[i])
+            y[i] = y_new
+        if np.max(np.abs(y - y_prev)) <= tol * np.max(np.abs(y)):
+            break
+    return y / y.sum()
+
+
+def _solve_cvar_lp(scenarios: np.ndarray, n_obs: int, constraints: ConstraintSet, confidence: float):
+    """Solve the Rockafellar-Uryasev LP restricted to a subset of scenarios."""
+    from scipy import sparse
+    from scipy.optimize import linprog
+
+    n_scenarios, n_assets = scenarios.shape
+    cost = np.concatenate([np.zeros(n_assets), [1.0], np.full(n_scenarios, 1.0 / ((1.0 - confidence) * n_obs))])
+
+    # -r_t'w - alpha - u_t <= 0
+    scenario_rows = sparse.hstack([
+        sparse.csr_matrix(-scenarios),
+        sparse.csr_matrix(-np.ones((n_scenarios, 1))),
+        -sparse.identity(n_scenarios, format='csr'),
+    ])
+    ub_rows = [scenario_rows]
+    ub_rhs = [np.zeros(n_scenarios)]
+
+    # L_g <= sum(w[g]) <= U_g
+    if len(constraints.groups) > 1:
+        membership = np.zeros((len(constraints.groups), n_assets + 1 + n_scenarios))
+        for g, idx in enumerate(constraints.groups):
+            membership[g, idx] = 1.0
+        membership = sparse.csr_matrix(membership)
+        ub_rows += [membership, -membership]
+        ub_rhs += [constraints.group_hi, -constraints.group_lo]
+
+    budget_row = sparse.csr_matrix(np.concatenate([np.ones(n_assets), np.zeros(1 + n_scenarios)]).reshape(1, -1))
+    bounds = np.vstack([
+        np.column_stack([constraints.lo, constraints.hi]),
+        [[-np.inf, np.inf]],
+        np.column_stack([np.zeros(n_scenarios), np.full(n_scenarios, np.inf)]),
+    ])
+
+    result = linprog(
+        cost,
+        A_ub=sparse.vstack(ub_rows, format='csr'),
+        b_ub=np.concatenate(ub_rhs),
+        A_eq=budget_row,
+        b_eq=[1.0],
+        bounds=bounds,
+        method='highs',
+    )
+    if not result.success:
+        raise HTTPException(status_code=400, detail=f"Min-CVaR optimization failed: {result.message}")
+    return result.x[:n_assets], result.x[n_assets]
+
+
+def min_cvar_weights(returns: np.ndarray, constraints: ConstraintSet, confidence: float = 0.95,
+                     tol: float = 1e-10, max_rounds: int = 50) -> np.ndarray:
+    """
+    Minimum-CVaR weights from the Rockafellar-Uryasev scenario LP.
+
+    Every historical return vector is a scenario. Variables are
+    [w (N), alpha (1), u (T)] and the problem is
+
+        min  alpha + 1 / ((1 - beta) T) * sum(u)
+        s.t. u_t >= -r_t'w - alpha,  u_t >= 0,  sum(w) = 1,
+             lo <= w <= hi,  L_g <= sum(w[g]) <= U_g
+
+    Only the (1 - beta) tail of scenarios is active at the optimum, so the
+    LP is solved by constraint generation: start from the worst days of
+    the equal-weight portfolio, then add any scenario whose loss exceeds
+    alpha until none is violated. Each round is a small HiGHS solve and
+    the final answer is optimal for the full scenario set.
+    """
+    n_obs, n_assets = returns.shape
+    if not 0.0 < confidence < 1.0:
+        raise HTTPException(status_code=400, detail="cvar_confidence must be between 0 and 1")
+
+    tail_size = max(int(np.ceil((1.0 - confidence) * n_obs)), 1)
+    losses = -returns.mean(axis=1)
+    active = np.zeros(n_obs, dtype=bool)
+    active[np.argsort(losses)[-min(2 * tail_size, n_obs):]] = True
+
+    for _ in range(max_rounds):
+        weights, alpha = _solve_cvar_lp(returns[active], n_obs, constraints, confidence)
+        violated = (-returns @ weights - alpha > tol) & ~active
+        if not violated.any():
+            break
+        active |= violated
+
+    weights = np.clip(weights, 0.0, None)
+    return weights / weights.sum()
+
+
+def _net_returns(etfs: List[EtfInput], config: AllocationConfig) -> pd.DataFrame:
+    returns = load_etf_returns(etfs, config.start_date, config.end_date)
+    if returns.empty:
+        raise HTTPException(status_code=400, detail="No data available for the specified period")
+    if returns.shape[1] < 2:
+        raise HTTPException(status_code=400, detail="At least 2 assets are required for allocation")
+
+    # Applica TER giornaliero come nel backtest
+    daily_ter = pd.Series({etf.name: etf.ter / 100 / TRADING_DAYS for etf in etfs})
+    return returns - daily_ter.reindex(returns.columns).fillna(0.0)
+
+
+def _allocation_result(method: str, weights: np.ndarray, returns: pd.DataFrame,
+                       etfs: List[EtfInput], config: AllocationConfig, confidence: float) -> Dict:
+    symbols = list(returns.columns)
+    values = returns.to_numpy()
+    cov = np.cov(values, rowvar=False) * TRADING_DAYS
+
+    portfolio_returns = values @ weights
+    annual_return = (1 + portfolio_returns).prod() ** (TRADING_DAYS / len(portfolio_returns)) - 1
+    annual_volatility = float(np.sqrt(weights @ cov @ weights))
+
+    losses = -portfolio_returns
+    var = np.quantile(losses, confidence)
+    cvar = losses[losses >= var].mean()
+
+    marginal = cov @ weights
+    contributions = weights * marginal / (weights @ marginal)
+
+    ter_by_name = {etf.name: etf.ter for etf in etfs}
+    return {
+        'method': method,
+        'weights': {symbol: float(w) for symbol, w in zip(symbols, weights)},
+        'risk_contributions': {symbol: float(c) for symbol, c in zip(symbols, contributions)},
+        # Pronto per PortfolioPayload.etfs di /api/backtest
+        'etfs': [
+            {'name': symbol, 'weight': round(float(w), 6), 'ter': ter_by_name.get(symbol, 0.0)}
+            for symbol, w in zip(symbols, weights)
+        ],
+        'metrics': {
+            'annual_return': float(annual_return),
+            'annual_volatility': annual_volatility,
+            'sharpe_ratio': float((annual_return - config.risk_free_rate) / annual_volatility) if annual_volatility > 0 else 0.0,
+            'daily_var': float(var),
+            'daily_cvar': float(cvar),
+            'cvar_confidence': confidence,
+        },
+        'config': {
+            'start_date': config.start_date,
+            'end_date': config.end_date,
+            'assets': symbols,
+            'observations': len(returns),
+        }
+    }
+
+
+def calculate_risk_parity(etfs: List[EtfInput], config: AllocationConfig) -> Dict:
+    """Equal (or budgeted) risk contribution allocation on the cached return matrix."""
+    returns = _net_returns(etfs, config)
+    symbols = list(returns.columns)
+    cov = np.cov(returns.to_numpy(), rowvar=False) * TRADING_DAYS
+
+    budgets = None
+    if config.risk_budgets:
+        budgets = np.array([config.risk_budgets.get(symbol, 0.0) for symbol in symbols])
+        if (budgets <= 0).any():
+            raise HTTPException(status_code=400, detail="risk_budgets must be positive for every asset")
+
+    weights = risk_parity_weights(cov, budgets)
+    return _allocation_result('risk_parity', weights, returns, etfs, config, config.cvar_confidence)
+
+
+def calculate_min_cvar(etfs: List[EtfInput], config: AllocationConfig) -> Dict:
+    """Minimum historical CVaR allocation under the frontier's weight and group constraints."""
+    returns = _net_returns(etfs, config)
+    constraints = build_constraint_set(
+        list(returns.columns),
+        min_weight=config.min_weight,
+        max_weight=config.max_weight,
+        asset_bounds=config.asset_bounds,
+        group_constraints=config.group_constraints
+    )
+    weights = min_cvar_weights(returns.to_numpy(), constraints, config.cvar_confidence)
+    result = _allocation_result('min_cvar', weights, returns, etfs, config, config.cvar_confidence)
+    result['config']['constraints'] = constraints.to_dict()
+    return result
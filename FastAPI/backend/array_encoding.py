@@ -0,0 +1,29 @@
+import base64
+
+import numpy as np
+
+
+def encode_float32(array: np.ndarray) -> str:
+    """Encode an array as base64 little-endian float32 (row-major)."""
+    return base64.b64encode(np.ascontiguousarray(array, dtype='<f4').tobytes()).decode()
+
+
+def as_float32(array: np.ndarray) -> np.ndarray:
+    """Same layout as encode_float32, left as a raw array for binary responses."""
+    return np.ascontiguousarray(array, dtype='<f4')
+
+
+def encode_plotly_array(values, dtype: str = 'f8') -> dict:
+    """
+    Encode values in Plotly's binary array format {'dtype', 'bdata'}.
+
+    plotly.js (>= 2.28) decodes these straight into typed arrays, so a
+    trace costs 8 bytes per point before base64 instead of a JSON number.
+    """
+    data = np.ascontiguousarray(values, dtype='<' + dtype)
+    return {'dtype': dtype, 'bdata': base64.b64encode(data.tobytes()).decode()}
+
+
+def epoch_milliseconds(index) -> np.ndarray:
+    """Milliseconds since 1970-01-01 for a DatetimeIndex, as float64 (exact up to 2**53)."""
+    return np.asarray(index.values.astype('datetime64[ms]').astype(np.int64), dtype=np.float64)
@@ -0,0 +1,364 @@
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+from fastapi import HTTPException
+from pydantic import BaseModel, conint, conlist
+
+from p1 import PortfolioAnalyzer
+from stage_metrics import StageClock, stage
+from tax_lots import LOT_METHODS, REBALANCE_PERIODS, TaxLotResult, simulate_tax_lots
+import renderers
+
+
+# --- Modelli di Dati per la richiesta API ---
+class Etf(BaseModel):
+    name: str
+    weight: float
+    ter: float = 0.0  # Total Expense Ratio (%) annuale
+
+class BacktestConfig(BaseModel):
+    start_date: str = "1990-01-01"
+    end_date: str = datetime.now().strftime('%Y-%m-%d')
+    initial_investment: float = 10000
+    rebalance_frequency: str = "quarterly"  # monthly, quarterly, yearly, none
+    transaction_cost: float = 0.001  # 0.1% per trade
+    reinvest_dividends: bool = True
+    max_points: Optional[conint(ge=3)] = None  # type: ignore  # Punti massimi per traccia nei grafici (LTTB, almeno 3); None = tutti
+    renderer: Optional[str] = None  # auto, plotly-json, matplotlib-png, data; None = predefinito del server
+    tax_rate: Optional[float] = None  # Aliquota sulle plusvalenze (es. 0.26): portafoglio ribilanciato; None = nessuna tassa
+    lot_method: str = "fifo"  # fifo, hifo: lotti venduti per primi (solo con tax_rate)
+    base_currency: Optional[str] = None  # Valuta in cui convertire i prezzi (es. EUR); None = nessuna conversione
+
+class PortfolioPayload(BaseModel):
+    etfs: conlist(Etf, min_length=1) # pyright: ignore[reportInvalidTypeForm]
+    benchmark: conlist(Etf, min_length=1) # type: ignore
+    config: BacktestConfig = BacktestConfig()
+
+
+class BacktestPerformance(NamedTuple):
+    """Rendimenti giornalieri (al netto del TER) e valore cumulativo di portafoglio e benchmark."""
+    portfolio_returns: pd.Series
+    benchmark_returns: pd.Series
+    portfolio_cumulative: pd.Series
+    benchmark_cumulative: pd.Series
+
+    def portfolio_drawdown(self) -> pd.Series:
+        """Drawdown del portafoglio rispetto al massimo precedente (frazione, <= 0)."""
+        return self.portfolio_cumulative / self.portfolio_cumulative.cummax() - 1
+
+    def monthly_returns(self) -> pd.Series:
+        """Rendimenti mensili composti del portafoglio."""
+        return (1 + self.portfolio_returns).resample('ME').prod() - 1
+
+
+class AdvancedPortfolioAnalyzer:
+    """
+    Analizzatore di portafoglio avanzato che estende PortfolioAnalyzer
+    con funzionalità di backtesting e metriche avanzate.
+
+    È l'unico nucleo di calcolo del backtest: i grafici sono prodotti dal renderer
+    scelto (vedi renderers.py) a partire dallo stesso BacktestPerformance.
+    """
+
+    def __init__(self, etfs: List[Etf], benchmark: List[Etf], config: BacktestConfig,
+                 prices: Optional[Dict[str, pd.Series]] = None):
+        self.etfs = etfs
+        self.benchmark = benchmark
+        self.config = config
+        # Prezzi già disponibili (es. archivio locale del batch runner): nessun download
+        self.prices = prices
+
+        # Converti in formato dizionario per PortfolioAnalyzer
+        self.etf_tickers = {etf.name: etf.weight for etf in etfs}
+        self.benchmark_tickers = {b.name: b.weight for b in benchmark}
+
+        # Calcola TER complessivi
+        self.portfolio_ter = sum(etf.weight * etf.ter for etf in etfs)
+        self.benchmark_ter = sum(b.weight * b.ter for b in benchmark)
+
+        self.tax_result: Optional[TaxLotResult] = None
+        # Stesso portafoglio ribilanciato senza tasse (per il confronto nel riepilogo)
+        self.pre_tax_equity: Optional[pd.Series] = None
+        if config.tax_rate is not None:
+            self._check_tax_config()
+
+        self.analyzer = PortfolioAnalyzer(
+            etf_tickers=self.etf_tickers,
+            benchmark_tickers=self.benchmark_tickers,
+            start_date=datetime.strptime(config.start_date, '%Y-%m-%d'),
+            end_date=datetime.strptime(config.end_date, '%Y-%m-%d'),
+            base_currency=config.base_currency
+        )
+
+    def preload_prices(self, shared: Dict[str, pd.Series]):
+        """
+        Scarica in shared solo i ticker che mancano (prezzi condivisi da più portafogli con
+        lo stesso intervallo) e verifica che il portafoglio abbia dati: ValueError altrimenti.
+        I calcoli successivi usano shared, senza altri download.
+        """
+        missing = [t for t in dict.fromkeys([*self.etf_tickers, *self.benchmark_tickers]) if t not in shared]
+        if missing:
+            shared.update(self.analyzer._download_prices(missing))
+        self.prices = shared
+        self.analyzer.load_prices(shared)
+        self.analyzer.calculate_portfolio()
+
+    def _check_tax_config(self):
+        """400 prima del download se i parametri del backtest con tasse non sono validi."""
+        if not 0 <= self.config.tax_rate <= 1:
+            raise HTTPException(status_code=400, detail="tax_rate deve essere compresa tra 0 e 1 (es. 0.26)")
+        if self.config.lot_method not in LOT_METHODS:
+            raise HTTPException(status_code=400, detail=f"lot_method deve essere uno tra: {', '.join(LOT_METHODS)}")
+        if self.config.rebalance_frequency not in REBALANCE_PERIODS:
+            raise HTTPException(status_code=400,
+                                detail=f"rebalance_frequency deve essere uno tra: {', '.join(REBALANCE_PERIODS)}")
+
+    def _compute_performance(self) -> BacktestPerformance:
+        """Scarica (o carica) i dati e calcola rendimenti (al netto del TER) e valore cumulativo."""
+        self._load_data()
+        return self._performance_after_load()
+
+    def _load_data(self):
+        # Ogni stadio finisce in Server-Timing e in /api/metrics
+        clock = StageClock('backtest')
+        if self.prices is None:
+            self.analyzer.download_data()
+        else:
+            self.analyzer.load_prices(self.prices)
+        clock.lap('download_data')
+
+    def _data_summary(self) -> Dict:
+        """Intervallo comune e giorni di borsa dei prezzi appena caricati (prima del calcolo del portafoglio)."""
+        start, end = self.analyzer.common_range()
+        index = self.analyzer.price_index
+        observations = max(int(index.searchsorted(end, side='right') - index.searchsorted(start, side='left')), 0)
+        return {
+            "start_date": start.strftime('%Y-%m-%d'),
+            "end_date": end.strftime('%Y-%m-%d'),
+            "observations": observations,
+            "tickers": list(self.etf_tickers),
+            "benchmark_tickers": list(self.benchmark_tickers),
+        }
+
+    def _performance_after_load(self) -> BacktestPerformance:
+        clock = StageClock('backtest')
+        self.analyzer.calculate_portfolio()
+        clock.lap('calculate_portfolio')
+        performance = self._performance_from_portfolio()
+        clock.lap('performance')
+        return performance
+
+    def _performance_from_portfolio(self) -> BacktestPerformance:
+        """Rendimenti e valore cumulativo dal portafoglio già calcolato (senza download, vedi benchmarks/)."""
+        portfolio_data = self.analyzer.my_etf_filtered
+        benchmark_data = self.analyzer.benchmark_filtered
+
+        # Calcola rendimenti (con tax_rate: portafoglio ribilanciato, valore dopo le tasse pagate)
+        if self.config.tax_rate is not None:
+            with stage('backtest.tax_lots'):
+                self.tax_result = self._simulate_taxes()
+            portfolio_returns = self.tax_result.equity.pct_change().dropna()
+        else:
+            portfolio_returns = portfolio_data['Portfolio'].pct_change().dropna()
+        benchmark_returns = benchmark_data['Benchmark'].pct_change().dropna()
+
+        # Applica i costi TER
+        portfolio_returns = self._apply_ter_costs(portfolio_returns, self.portfolio_ter)
+        benchmark_returns = self._apply_ter_costs(benchmark_returns, self.benchmark_ter)
+
+        # Calcola performance cumulativa
+        portfolio_cumulative = (1 + portfolio_returns).cumprod() * self.config.initial_investment
+        benchmark_cumulative = (1 + benchmark_returns).cumprod() * self.config.initial_investment
+
+        return BacktestPerformance(portfolio_returns, benchmark_returns, portfolio_cumulative, benchmark_cumulative)
+
+    def _simulate_taxes(self) -> TaxLotResult:
+        """
+        Lotti fiscali sui prezzi degli ETF, ribilanciati secondo rebalance_frequency (vedi tax_lots.py).
+        Il modello è diverso dal backtest senza tasse (pesi sui prezzi, mai ribilanciato): per il
+        confronto la stessa simulazione con aliquota 0 va in pre_tax_equity.
+        """
+        prices, dates = self.analyzer.etf_prices()
+        weights = np.array([self.etf_tickers[t] for t in self.analyzer.etf_columns])
+
+        def simulate(tax_rate: float) -> TaxLotResult:
+            return simulate_tax_lots(prices, dates, weights, self.config.initial_investment, tax_rate,
+                                     self.config.rebalance_frequency, self.config.lot_method, self.config.transaction_cost)
+        try:
+            result = simulate(self.config.tax_rate)
+            self.pre_tax_equity = simulate(0.0).equity if self.config.tax_rate > 0 else result.equity
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return result
+
+    def _tax_summary(self) -> Dict:
+        """
+        Plusvalenze e tasse per anno, valore finale dopo le tasse e in caso di liquidazione (prima del TER),
+        più il valore finale dello stesso portafoglio ribilanciato senza tasse.
+        """
+        result = self.tax_result
+        return {
+            "tax_rate": self.config.tax_rate,
+            "lot_method": self.config.lot_method,
+            "rebalance_frequency": self.config.rebalance_frequency,
+            "start_date": result.equity.index[0].strftime('%Y-%m-%d'),
+            "realized_gains": {str(year): gain for year, gain in result.realized_gains.items()},
+            "taxes": {str(year): tax for year, tax in result.taxes.items()},
+            "taxes_paid": round(sum(result.taxes.values()), 2),
+            "transaction_costs": round(result.transaction_costs, 2),
+            "unrealized_gain": round(result.unrealized_gain, 2),
+            "after_tax_final_value": round(float(result.equity.iloc[-1]), 2),
+            "pre_tax_final_value": round(float(self.pre_tax_equity.iloc[-1]), 2),
+            "liquidation_value": round(result.liquidation_value, 2),
+        }
+
+    def compute_daily_series(self) -> pd.DataFrame:
+        """
+        Serie giornaliere per l'export: valore, rendimento e drawdown di portafoglio e
+        benchmark, più il peso corrente di ogni asset del portafoglio (senza grafici).
+        """
+        return self._daily_series(*self._compute_performance())
+
+    def _daily_series(self, portfolio_returns, benchmark_returns, portfolio_cumulative, benchmark_cumulative) -> pd.DataFrame:
+        series = pd.DataFrame({
+            'portfolio_value': portfolio_cumulative,
+            'portfolio_return': portfolio_returns,
+            'portfolio_drawdown': portfolio_cumulative / portfolio_cumulative.cummax() - 1,
+            'benchmark_value': benchmark_cumulative,
+            'benchmark_return': benchmark_returns,
+            'benchmark_drawdown': benchmark_cumulative / benchmark_cumulative.cummax() - 1,
+        })
+
+        # Pesi correnti: valore pesato di ogni asset sul totale del portafoglio
+        series = series.join(self.analyzer.asset_weights().add_prefix('weight_'))
+        series.index.name = 'date'
+        return series
+
+    def _resolve_renderer(self) -> renderers.Renderer:
+        try:
+            return renderers.resolve(self.config.renderer)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    def run_advanced_backtest(self, include_plots: bool = True):
+        """
+        Esegue il backtest avanzato con tutte le metriche e grafici.
+        Con include_plots=False i grafici sono sostituiti da 'series', il DataFrame delle
+        serie giornaliere (per le risposte binarie Arrow/MessagePack).
+        """
+        renderer = self._resolve_renderer() if include_plots else None
+        try:
+            performance = self._compute_performance()
+            results = self._summary(*performance)
+
+            if include_plots:
+                # Grafici, una sola volta, con il renderer scelto
+                results["plots"] = renderer.render(self, performance)
+                results["config"]["renderer"] = renderer.name
+            else:
+                results["series"] = self._daily_series(*performance)
+            return results
+
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Errore nel backtest: {str(e)}")
+
+    def iter_backtest_events(self):
+        """
+        Backtest a stadi per lo streaming SSE: genera (evento, dati) appena ogni parte è pronta.
+        'data' appena caricati i prezzi (intervallo comune e giorni di borsa, prima di ogni
+        calcolo), 'metrics' con le metriche, poi un 'plot' per grafico e 'done'.
+        """
+        renderer = self._resolve_renderer()
+        self._load_data()
+        yield "data", self._data_summary()
+
+        performance = self._performance_after_load()
+        summary = self._summary(*performance)
+        summary["config"]["renderer"] = renderer.name
+        yield "metrics", summary
+
+        for name, plot in renderer.iter_plots(self, performance):
+            yield "plot", {"name": name, "figure": plot}
+        yield "done", {"plots": list(renderers.PLOT_NAMES)}
+
+    def _summary(self, portfolio_returns, benchmark_returns, portfolio_cumulative, benchmark_cumulative) -> Dict:
+        """Metriche, configurazione, valori finali e allocazione (tutto tranne grafici e serie)."""
+        with stage('backtest.metrics'):
+            metrics = {
+                "portfolio": self._calculate_advanced_metrics(portfolio_returns),
+                "benchmark": self._calculate_advanced_metrics(benchmark_returns),
+            }
+        summary = {
+            "success": True,
+            "metrics": metrics,
+            "config": {
+                "start_date": self.config.start_date,
+                "end_date": self.config.end_date,
+                "initial_investment": self.config.initial_investment,
+                "max_points": self.config.max_points,
+                "base_currency": self.config.base_currency,
+                "portfolio_ter": round(self.portfolio_ter, 4),
+                "benchmark_ter": round(self.benchmark_ter, 4),
+            },
+            "final_values": {
+                "portfolio": float(portfolio_cumulative.iloc[-1]),
+                "benchmark": float(benchmark_cumulative.iloc[-1]),
+            },
+            "allocation": {
+                "portfolio": [{"name": etf.name, "weight": etf.weight, "ter": etf.ter} for etf in self.etfs],
+                "benchmark": [{"name": b.name, "weight": b.weight, "ter": b.ter} for b in self.benchmark]
+            }
+        }
+        if self.tax_result is not None:
+            summary["tax"] = self._tax_summary()
+        return summary
+
+    def _apply_ter_costs(self, returns: pd.Series, ter: float) -> pd.Series:
+        """Applica i costi TER ai rendimenti."""
+        daily_ter = ter / 252  # TER annuale convertito in giornaliero
+        return returns - daily_ter
+
+    def _calculate_advanced_metrics(self, returns: pd.Series) -> Dict:
+        """Calcola metriche avanzate per una serie di rendimenti."""
+        if returns.empty:
+            return {}
+
+        # Rendimenti annualizzati
+        annual_return = (1 + returns.mean()) ** 252 - 1
+
+        # Volatilità annualizzata
+        annual_volatility = returns.std() * np.sqrt(252)
+
+        # Sharpe Ratio
+        risk_free_rate = 0.02
+        sharpe_ratio = (annual_return - risk_free_rate) / annual_volatility if annual_volatility > 0 else 0
+
+        # Max Drawdown
+        cumulative = (1 + returns).cumprod()
+        running_max = cumulative.cummax()
+        drawdown = (cumulative - running_max) / running_max
+        max_drawdown = drawdown.min()
+
+        # Sortino Ratio
+        negative_returns = returns[returns < 0]
+        downside_deviation = negative_returns.std() * np.sqrt(252) if len(negative_returns) > 0 else 0
+        sortino_ratio = (annual_return - risk_free_rate) / downside_deviation if downside_deviation > 0 else 0
+
+        # Calmar Ratio
+        calmar_ratio = annual_return / abs(max_drawdown) if max_drawdown != 0 else 0
+
+        # VaR (Value at Risk) al 95%
+        var_95 = np.percentile(returns, 5)
+
+        return {
+            "annual_return": round(annual_return, 4),
+            "annual_volatility": round(annual_volatility, 4),
+            "sharpe_ratio": round(sharpe_ratio, 4),
+            "sortino_ratio": round(sortino_ratio, 4),
+            "max_drawdown": round(max_drawdown, 4),
+            "calmar_ratio": round(calmar_ratio, 4),
+            "var_95": round(var_95, 4),
+            "total_return": round((1 + returns).prod() - 1, 4)
+        }
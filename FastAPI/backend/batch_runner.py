@@ -0,0 +1,277 @@
+"""
+Esecuzione batch di backtest, senza API e senza grafici.
+
+Legge le configurazioni (una cartella di file *.json o un file JSONL, ognuna un
+payload di /api/backtest con un campo "id" opzionale), le esegue in un pool di
+processi sui prezzi dell'archivio locale (price_store.py) e scrive i risultati
+in OUTPUT a blocchi, man mano che arrivano:
+
+  OUTPUT/metrics/part-00000.csv   una riga per configurazione (metriche di portafoglio e benchmark)
+  OUTPUT/equity/part-00000.csv    serie giornaliere (valore, rendimento, drawdown) per configurazione
+  OUTPUT/manifest.jsonl           blocchi completati (con i loro id) ed errori delle configurazioni
+
+Ripresa: rieseguendo sullo stesso OUTPUT le configurazioni già completate vengono
+saltate e quelle fallite ritentate. Un blocco compare nel manifest (in una sola
+riga) solo dopo che i suoi file sono stati scritti; all'avvio i blocchi che il
+manifest non registra (es. scritti prima di un'interruzione) vengono cancellati
+e le loro configurazioni rieseguite, quindi nessuna riga viene scritta due volte.
+Con --no-resume OUTPUT viene svuotato e tutte le configurazioni rieseguite.
+
+Uso: python batch_runner.py CONFIG [--output runs/oggi] [--format csv|parquet]
+     [--workers 8] [--flush-every 200] [--refresh-prices] [--no-resume]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+import pandas as pd
+
+import fx
+import price_store
+from backtest import AdvancedPortfolioAnalyzer, PortfolioPayload
+from export import SERIES_COLUMNS, check_format, stream_csv, stream_export
+
+
+# Configurazioni per blocco di output (e per voce del manifest)
+FLUSH_EVERY = 200
+# Configurazioni inviate al pool per worker: i risultati non ancora letti restano in memoria
+SUBMIT_AHEAD = 2
+METRIC_NAMES = ('annual_return', 'annual_volatility', 'sharpe_ratio', 'sortino_ratio', 'max_drawdown',
+                'calmar_ratio', 'var_95', 'total_return')
+# Colonne fisse delle metriche: tutti i blocchi hanno lo stesso schema (le tasse sono NaN senza tax_rate)
+METRIC_COLUMNS = (['id', 'start_date', 'end_date', 'portfolio_final_value', 'benchmark_final_value']
+                  + [f'{side}_{name}' for side in ('portfolio', 'benchmark') for name in METRIC_NAMES]
+                  + ['taxes_paid', 'liquidation_value'])
+EQUITY_COLUMNS = ['portfolio_id', 'date'] + SERIES_COLUMNS
+
+
+def iter_configs(source: str) -> Iterator[Tuple[str, Dict]]:
+    """(id, payload) da una cartella di *.json (id = nome del file) o da un JSONL (id = numero di riga)."""
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            if name.endswith('.json'):
+                with open(os.path.join(source, name)) as f:
+                    config = json.load(f)
+                yield str(config.pop('id', name[:-5])), config
+    else:
+        with open(source) as f:
+            for number, line in enumerate(f, start=1):
+                if line.strip():
+                    config = json.loads(line)
+                    yield str(config.pop('id', f'line-{number:06d}')), config
+
+
+def _metrics_row(config_id: str, results: Dict) -> Dict:
+    series = results['series']
+    row = {
+        'id': config_id,
+        'start_date': series.index[0].strftime('%Y-%m-%d'),
+        'end_date': series.index[-1].strftime('%Y-%m-%d'),
+        'portfolio_final_value': results['final_values']['portfolio'],
+        'benchmark_final_value': results['final_values']['benchmark'],
+    }
+    for side in ('portfolio', 'benchmark'):
+        for name in METRIC_NAMES:
+            row[f'{side}_{name}'] = results['metrics'][side].get(name)
+    tax = results.get('tax') or {}
+    row.update(taxes_paid=tax.get('taxes_paid'), liquidation_value=tax.get('liquidation_value'))
+    return row
+
+
+EquityBlock = Union[pd.DataFrame, bytes]
+
+
+def run_config(config_id: str, config: Dict, fmt: str) -> Tuple[str, Optional[Dict], Optional[EquityBlock], Optional[str]]:
+    """
+    Backtest di una configurazione nel worker: (id, riga delle metriche, serie giornaliere, errore).
+    Legge solo dall'archivio locale (i download sono fatti prima dal processo principale);
+    un ticker senza prezzi nel periodo fa fallire la configurazione.
+    In CSV le serie tornano già formattate (righe senza intestazione): la conversione in
+    testo è la parte più lenta della scrittura e così avviene in parallelo nei worker.
+    """
+    try:
+        payload = PortfolioPayload(**config)
+        tickers = [etf.name for etf in payload.etfs] + [b.name for b in payload.benchmark]
+        if payload.config.base_currency:
+            # I cambi sono nell'archivio come gli altri prezzi (metadati già letti dal processo principale)
+            tickers += fx.fx_symbols(tickers, payload.config.base_currency, fetch=False)
+        prices = price_store.get_prices(tickers, payload.config.start_date, payload.config.end_date)
+        # load_prices ignorerebbe i ticker senza dati: il risultato sarebbe di un portafoglio parziale
+        missing = [ticker for ticker in dict.fromkeys(tickers) if ticker not in prices or prices[ticker].empty]
+        if missing:
+            raise ValueError(f"Nessun prezzo nell'archivio nel periodo richiesto per: {', '.join(missing)}")
+        analyzer = AdvancedPortfolioAnalyzer(payload.etfs, payload.benchmark, payload.config, prices=prices)
+        results = analyzer.run_advanced_backtest(include_plots=False)
+        series = results['series'][SERIES_COLUMNS]
+        if fmt == 'csv':
+            series = b''.join(islice(stream_csv([(config_id, series)], EQUITY_COLUMNS), 1, None))
+        return config_id, _metrics_row(config_id, results), series, None
+    except Exception as e:
+        detail = getattr(e, 'detail', None) or str(e) or traceback.format_exc(limit=1)
+        return config_id, None, None, detail
+
+
+class BatchOutput:
+    """
+    Blocchi di risultati in OUTPUT/metrics e OUTPUT/equity, più il manifest per la ripresa.
+    Senza resume il contenuto precedente di OUTPUT viene cancellato.
+    """
+
+    SUBDIRECTORIES = ('metrics', 'equity')
+
+    def __init__(self, directory: str, fmt: str, resume: bool = True):
+        self.directory = directory
+        self.fmt = fmt
+        self.manifest_path = os.path.join(directory, 'manifest.jsonl')
+        for subdirectory in self.SUBDIRECTORIES:
+            os.makedirs(os.path.join(directory, subdirectory), exist_ok=True)
+        if not resume and os.path.exists(self.manifest_path):
+            os.remove(self.manifest_path)
+        parts, self.failed = self._read_manifest()
+        # Valgono solo i blocchi registrati con entrambi i file; gli altri file vengono cancellati
+        parts = {part: ids for part, ids in parts.items()
+                 if all(os.path.exists(self._path(subdirectory, part)) for subdirectory in self.SUBDIRECTORIES)}
+        self._remove_unregistered(parts)
+        self.completed = {config_id for ids in parts.values() for config_id in ids}
+        self.failed -= self.completed
+        self.next_part = max((int(part[5:]) for part in parts), default=-1) + 1
+        self._rows: List[Dict] = []
+        self._series: List[Tuple[str, EquityBlock]] = []
+
+    def _path(self, subdirectory: str, part: str) -> str:
+        return os.path.join(self.directory, subdirectory, f'{part}.{self.fmt}')
+
+    def _read_manifest(self) -> Tuple[Dict[str, List[str]], set]:
+        parts, failed = {}, set()
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Riga troncata da un'interruzione
+                    if entry['status'] == 'ok':
+                        parts[entry['part']] = entry['ids']
+                    else:
+                        failed.add(entry['id'])
+        return parts, failed
+
+    def _remove_unregistered(self, parts: Dict[str, List[str]]):
+        keep = {f'{part}.{self.fmt}' for part in parts}
+        for subdirectory in self.SUBDIRECTORIES:
+            for name in os.listdir(os.path.join(self.directory, subdirectory)):
+                if name.startswith('part-') and name not in keep:
+                    os.remove(os.path.join(self.directory, subdirectory, name))
+
+    def _append_manifest(self, entries: List[Dict]):
+        with open(self.manifest_path, 'a') as f:
+            f.writelines(json.dumps(entry) + '\n' for entry in entries)
+
+    def add(self, row: Dict, series: EquityBlock):
+        self._rows.append(row)
+        self._series.append((row['id'], series))
+
+    def fail(self, config_id: str, error: str):
+        self._append_manifest([{'id': config_id, 'status': 'error', 'error': error}])
+
+    def pending(self) -> int:
+        return len(self._rows)
+
+    def _write(self, subdirectory: str, part: str, chunks: Iterator[bytes]):
+        path = self._path(subdirectory, part)
+        with open(path + '.tmp', 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(path + '.tmp', path)
+
+    def flush(self):
+        """Scrive il blocco corrente (metriche ed equity) e solo dopo lo registra nel manifest, in una riga."""
+        if not self._rows:
+            return
+        part = f'part-{self.next_part:05d}'
+        metrics = pd.DataFrame(self._rows, columns=METRIC_COLUMNS)
+        if self.fmt == 'csv':
+            self._write('metrics', part, iter([metrics.to_csv(index=False).encode()]))
+            header = (','.join(EQUITY_COLUMNS) + '\n').encode()
+            self._write('equity', part, iter([header, *(rows for _, rows in self._series)]))
+        else:
+            self._write('metrics', part, iter([metrics.to_parquet(index=False)]))
+            self._write('equity', part, stream_export(self._series, EQUITY_COLUMNS, self.fmt))
+        self._append_manifest([{'status': 'ok', 'part': part, 'ids': [row['id'] for row in self._rows]}])
+        self.next_part += 1
+        self._rows, self._series = [], []
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('config', help='cartella di file *.json o file JSONL di payload del backtest')
+    parser.add_argument('--output', default=os.path.join('runs', time.strftime('%Y%m%d-%H%M%S')))
+    parser.add_argument('--format', default='csv', choices=['csv', 'parquet'])
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--flush-every', type=int, default=FLUSH_EVERY)
+    parser.add_argument('--refresh-prices', action='store_true', help='riscarica i prezzi di tutti i ticker')
+    parser.add_argument('--no-resume', action='store_true', help='riesegue anche le configurazioni già completate')
+    args = parser.parse_args()
+
+    try:
+        check_format(args.format)
+    except ValueError as e:
+        parser.error(str(e))
+
+    output = BatchOutput(args.output, args.format, resume=not args.no_resume)
+    configs = list(iter_configs(args.config))
+    todo = [(config_id, config) for config_id, config in configs if config_id not in output.completed]
+    retried = sum(config_id in output.failed for config_id, _ in todo)
+    print(f"{len(configs)} configurazioni, {len(configs) - len(todo)} già completate, "
+          f"{len(todo)} da eseguire ({retried} fallite in precedenza)")
+
+    # Download una volta sola, prima dei worker (che leggono solo da disco)
+    tickers = []
+    for _, config in todo:
+        names = [etf['name'] for group in ('etfs', 'benchmark') for etf in config.get(group, [])]
+        base_currency = config.get('config', {}).get('base_currency')
+        tickers += names + (fx.fx_symbols(names, base_currency) if base_currency else [])
+    missing = price_store.prefetch(tickers, refresh=args.refresh_prices)
+    if missing:
+        print(f"Nessun dato per: {', '.join(missing)}")
+
+    start = time.perf_counter()
+    done = failed = 0
+    queue = iter(todo)
+    running = set()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        # Finestra limitata di configurazioni in corso: ogni risultato viene rilasciato appena scritto
+        while True:
+            for config_id, config in islice(queue, args.workers * SUBMIT_AHEAD - len(running)):
+                running.add(pool.submit(run_config, config_id, config, args.format))
+            if not running:
+                break
+            finished, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                config_id, row, series, error = future.result()
+                if error is not None:
+                    failed += 1
+                    output.fail(config_id, error)
+                    print(f"  {config_id}: {error}", file=sys.stderr)
+                else:
+                    done += 1
+                    output.add(row, series)
+                    if output.pending() >= args.flush_every:
+                        output.flush()
+                        elapsed = time.perf_counter() - start
+                        print(f"  {done + failed}/{len(todo)} ({(done + failed) / elapsed:.1f} config/s)")
+    output.flush()
+
+    elapsed = time.perf_counter() - start
+    print(f"Completate {done}, fallite {failed} in {elapsed:.1f} s. Risultati in {args.output}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+"""
+Benchmark riproducibile dei motori di backtest e frontiera efficiente.
+
+Usa pannelli di prezzi sintetici con seed fisso (nessuna rete, nessun yfinance)
+e misura, per ogni stadio, il tempo migliore su --repeat esecuzioni e il picco
+di memoria (tracemalloc, in un'esecuzione separata per non falsare i tempi):
+
+  backtest   load_prices, load_prices_mixed (metà dei ticker su un'altra borsa,
+             con calendario diverso), calculate_portfolio, performance (rendimenti, TER,
+             cumulato), advanced_metrics (portafoglio e benchmark),
+             tax_lots (ribilanciamento mensile con lotti FIFO e HIFO)
+  frontier   return_matrix (resampling mensile e rendimenti, cache vuota),
+             frontier (campionamento e portafogli modello, plots='none')
+
+Il backtest scala su numero di ticker e anni di storia, la frontiera su
+numero di ticker e num_portfolios. I risultati sono salvati in JSON; con
+--compare si confrontano con un'esecuzione precedente.
+
+Uso: python benchmarks/bench_engines.py [--quick] [--tickers 2 20 200] [--years 1 10 40]
+     [--portfolios 1000 100000 1000000] [--output risultati.json] [--compare base.json]
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import warnings
+from datetime import datetime
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import market_data  # noqa: E402
+import ticker_info  # noqa: E402
+from backtest import AdvancedPortfolioAnalyzer, BacktestConfig, Etf  # noqa: E402
+from efficient_frontier import EfficientFrontierConfig, EtfInput, calculate_efficient_frontier  # noqa: E402
+from tax_lots import simulate_tax_lots  # noqa: E402
+
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+SEED = 42
+
+DEFAULT_TICKERS = [2, 20, 200]
+DEFAULT_YEARS = [1, 10, 40]
+DEFAULT_PORTFOLIOS = [1000, 100000, 1000000]
+QUICK = {'tickers': [2, 20], 'years': [1, 10], 'portfolios': [1000, 10000]}
+
+# Storia usata per la frontiera (rendimenti mensili, come il default dell'API)
+FRONTIER_YEARS = 15
+# Oltre num_portfolios x ticker celle (~400 MB per copia dei pesi) il caso viene saltato
+MAX_WEIGHT_CELLS = 50_000_000
+
+
+def synthetic_prices(n_tickers: int, years: int, seed: int = SEED) -> pd.DataFrame:
+    """Prezzi giornalieri GBM con un fattore di mercato comune (correlazioni realistiche)."""
+    rng = np.random.default_rng([seed, n_tickers, years])
+    index = pd.bdate_range(end='2024-12-31', periods=years * 252)
+    market = rng.normal(0.0003, 0.009, len(index))
+    betas = rng.uniform(0.3, 1.2, n_tickers)
+    idiosyncratic = rng.normal(0.0, 0.006, (len(index), n_tickers))
+    returns = market[:, None] * betas + idiosyncratic
+    return pd.DataFrame(100 * np.exp(np.cumsum(returns, axis=0)), index=index,
+                        columns=[f'T{i:03d}' for i in range(n_tickers)])
+
+
+def mixed_calendar(prices: pd.DataFrame, seed: int = SEED) -> pd.DataFrame:
+    """Stessi prezzi con i ticker dispari su un'altra borsa: ~2% di giorni di chiusura diversi (NaN)."""
+    rng = np.random.default_rng([seed, prices.shape[1]])
+    mixed = prices.copy()
+    closed = rng.random(len(prices)) < 0.02
+    mixed.iloc[closed, 1::2] = np.nan
+    return mixed
+
+
+def load_synthetic_prices(analyzer, prices: pd.DataFrame):
+    """Equivalente di PortfolioAnalyzer.download_data() sui prezzi sintetici."""
+    analyzer.load_prices(prices)
+
+
+def measure(fn, repeat: int):
+    """
+    (miglior tempo in ms, picco di memoria in MB, memoria trattenuta in MB) di fn.
+    La memoria trattenuta è quella ancora allocata al termine (es. copie salvate come attributi).
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        result = fn()
+        after, peak = tracemalloc.get_traced_memory()
+        del result
+    finally:
+        tracemalloc.stop()
+    return min(timings) * 1000, (peak - before) / 2**20, (after - before) / 2**20
+
+
+def bench_backtest(n_tickers: int, years: int, repeat: int):
+    prices = synthetic_prices(n_tickers, years)
+    mixed_prices = mixed_calendar(prices)
+    weight = 1.0 / n_tickers
+    backtest = AdvancedPortfolioAnalyzer(
+        etfs=[Etf(name=ticker, weight=weight, ter=0.2) for ticker in prices.columns],
+        benchmark=[Etf(name=prices.columns[0], weight=1.0)],
+        config=BacktestConfig(start_date=prices.index[0].strftime('%Y-%m-%d'),
+                              end_date=prices.index[-1].strftime('%Y-%m-%d'))
+    )
+    load_synthetic_prices(backtest.analyzer, prices)
+    backtest.analyzer.calculate_portfolio()
+    performance = backtest._performance_from_portfolio()
+    etf_prices, dates = backtest.analyzer.etf_prices()
+    weights = np.full(n_tickers, weight)
+    tax_lots = lambda method: simulate_tax_lots(etf_prices, dates, weights, 10000, 0.26, 'monthly', method, 0.001)
+
+    stages = {
+        'load_prices_mixed': lambda: load_synthetic_prices(backtest.analyzer, mixed_prices),
+        'load_prices': lambda: load_synthetic_prices(backtest.analyzer, prices),
+        'calculate_portfolio': backtest.analyzer.calculate_portfolio,
+        'performance': backtest._performance_from_portfolio,
+        'advanced_metrics': lambda: (backtest._calculate_advanced_metrics(performance.portfolio_returns),
+                                     backtest._calculate_advanced_metrics(performance.benchmark_returns)),
+        'tax_lots_fifo': lambda: tax_lots('fifo'),
+        'tax_lots_hifo': lambda: tax_lots('hifo'),
+    }
+    params = {'tickers': n_tickers, 'years': years, 'observations': len(prices)}
+    for stage, fn in stages.items():
+        yield stage, params, measure(fn, repeat)
+
+
+def bench_frontier(n_tickers: int, num_portfolios: int, repeat: int):
+    prices = synthetic_prices(n_tickers, FRONTIER_YEARS)
+    etfs = [EtfInput(name=ticker, weight=1.0 / n_tickers) for ticker in prices.columns]
+    config = EfficientFrontierConfig(
+        start_date=prices.index[0].strftime('%Y-%m-%d'),
+        end_date=prices.index[-1].strftime('%Y-%m-%d'),
+        num_portfolios=num_portfolios,
+        plots='none'
+    )
+
+    def return_matrix():
+        market_data.clear_cache()
+        return market_data.load_return_matrix(list(prices.columns), config.start_date, config.end_date, config.return_frequency)
+
+    def frontier():
+        np.random.seed(SEED)
+        return calculate_efficient_frontier(etfs, config)
+
+    # Sostituisce il download (lru_cache compreso, per clear_cache) con il pannello sintetico
+    original = market_data._download_price_panel
+    market_data._download_price_panel = lru_cache(maxsize=market_data.PRICE_CACHE_SIZE)(lambda tickers, start, end: prices[list(tickers)])
+    try:
+        params = {'tickers': n_tickers, 'num_portfolios': num_portfolios, 'years': FRONTIER_YEARS}
+        yield 'return_matrix', params, measure(return_matrix, repeat)
+        return_matrix()
+        yield 'frontier', params, measure(frontier, repeat)
+    finally:
+        market_data._download_price_panel = original
+        market_data.clear_cache()
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def case_key(result):
+    return (result['engine'], result['stage'], tuple(sorted(result['params'].items())))
+
+
+def _ratio(result, previous, key) -> str:
+    if key not in previous or previous[key] <= 1e-3:
+        return '-'
+    return f"{result[key] / previous[key]:.2f}x"
+
+
+def print_comparison(results, baseline_path: str):
+    with open(baseline_path) as f:
+        baseline = {case_key(result): result for result in json.load(f)['results']}
+
+    print(f"\nConfronto con {baseline_path} (tempo e picco attuali / precedenti)")
+    print(f"{'motore':<10}{'stadio':<22}{'parametri':<42}{'tempo':>9}{'picco':>9}{'trattenuta':>12}")
+    for result in results:
+        previous = baseline.get(case_key(result))
+        if previous is None:
+            continue
+        params = ' '.join(f'{k}={v}' for k, v in result['params'].items())
+        print(f"{result['engine']:<10}{result['stage']:<22}{params:<42}"
+              f"{_ratio(result, previous, 'time_ms'):>9}{_ratio(result, previous, 'peak_mb'):>9}"
+              f"{_ratio(result, previous, 'retained_mb'):>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--quick', action='store_true', help='griglia ridotta per una verifica veloce')
+    parser.add_argument('--tickers', type=int, nargs='+')
+    parser.add_argument('--years', type=int, nargs='+')
+    parser.add_argument('--portfolios', type=int, nargs='+')
+    parser.add_argument('--engines', nargs='+', choices=['backtest', 'frontier'], default=['backtest', 'frontier'])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help=f'file JSON dei risultati (default: {RESULTS_DIR}/engines-<data>.json)')
+    parser.add_argument('--compare', help='JSON di un\'esecuzione precedente da confrontare')
+    args = parser.parse_args()
+
+    tickers = args.tickers or (QUICK['tickers'] if args.quick else DEFAULT_TICKERS)
+    years = args.years or (QUICK['years'] if args.quick else DEFAULT_YEARS)
+    portfolios = args.portfolios or (QUICK['portfolios'] if args.quick else DEFAULT_PORTFOLIOS)
+
+    # Il DataFrame dei pesi della frontiera è costruito colonna per colonna: il costo
+    # compare già nei tempi, l'avviso di frammentazione ripetuto renderebbe illeggibile l'output
+    warnings.simplefilter('ignore', pd.errors.PerformanceWarning)
+
+    # Archivio dei metadati in memoria: nessun file e nessuna chiamata al provider
+    ticker_info.TICKER_INFO_DB = ':memory:'
+
+    cases = []
+    if 'backtest' in args.engines:
+        cases += [('backtest', bench_backtest, (n, y)) for n in tickers for y in years]
+    if 'frontier' in args.engines:
+        cases += [('frontier', bench_frontier, (n, p)) for n in tickers for p in portfolios]
+
+    results, skipped = [], []
+    print(f"{'motore':<10}{'stadio':<22}{'parametri':<42}{'tempo (ms)':>12}{'picco (MB)':>12}{'trattenuta (MB)':>16}")
+    for engine, bench, case in cases:
+        if engine == 'frontier' and case[0] * case[1] > MAX_WEIGHT_CELLS:
+            skipped.append({'engine': engine, 'params': {'tickers': case[0], 'num_portfolios': case[1]}})
+            continue
+        for stage, params, (time_ms, peak_mb, retained_mb) in bench(*case, args.repeat):
+            results.append({'engine': engine, 'stage': stage, 'params': params, 'time_ms': round(time_ms, 3),
+                            'peak_mb': round(peak_mb, 3), 'retained_mb': round(retained_mb, 3)})
+            label = ' '.join(f'{k}={v}' for k, v in params.items())
+            print(f"{engine:<10}{stage:<22}{label:<42}{time_ms:>12.1f}{peak_mb:>12.1f}{retained_mb:>16.1f}")
+    for case in skipped:
+        print(f"saltato: {case['engine']} {case['params']} (oltre {MAX_WEIGHT_CELLS:,} celle di pesi)")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"engines-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({
+            'meta': {
+                'created_at': datetime.now().isoformat(timespec='seconds'),
+                'git_revision': git_revision(),
+                'seed': SEED,
+                'repeat': args.repeat,
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'pandas': pd.__version__,
+                'machine': platform.platform(),
+                'cpu_count': os.cpu_count(),
+            },
+            'results': results,
+            'skipped': skipped,
+        }, f, indent=2)
+    print(f"\nRisultati salvati in {output}")
+
+    if args.compare:
+        print_comparison(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Benchmark del tempo di avvio (import) del processo API.
+
+Importa l'app in un interprete nuovo con `python -X importtime`, ripete la
+misura e tiene il tempo migliore, poi mostra i moduli più costosi. Esce con
+codice 1 se il tempo supera il budget, o se all'avvio viene caricato uno dei
+backend che devono restare lazy (grafici, provider dati, solver).
+
+Uso: python benchmarks/bench_import_time.py [--module main] [--repeat 5] [--budget-ms 1800]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Misurato a ~1.1 s (era ~2.8 s con import eager); margine per macchine più lente
+IMPORT_BUDGET_MS = 1800
+
+# Moduli che l'avvio non deve importare: vengono caricati al primo utilizzo
+LAZY_MODULES = [
+    'matplotlib.pyplot',
+    'plotly.graph_objects',
+    'plotly.express',
+    'yfinance',
+    'scipy.optimize',
+    'scipy.cluster',
+    'sqlalchemy',
+]
+
+
+def import_profile(module: str):
+    """Return {module: cumulative microseconds} for one fresh `import module`."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=BACKEND_DIR, capture_output=True, text=True,
+        env={**os.environ, 'PYTHONDONTWRITEBYTECODE': '1'},
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+
+    profile = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        # "import time:  self [us] | cumulative | imported package"
+        _, cumulative, name = line[len('import time:'):].split('|')
+        profile[name.strip()] = int(cumulative)
+    return profile
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--module', default='main')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=IMPORT_BUDGET_MS)
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    profiles = [import_profile(args.module) for _ in range(args.repeat)]
+    best = min(profiles, key=lambda p: p[args.module])
+    total_ms = best[args.module] / 1000
+
+    print(f"import {args.module}: {total_ms:.0f} ms (migliore di {args.repeat}, budget {args.budget_ms:.0f} ms)")
+    print(f"{'modulo':<45}{'cumulativo (ms)':>16}")
+    top = sorted(best.items(), key=lambda item: item[1], reverse=True)[1:args.top + 1]
+    for name, cumulative in top:
+        print(f"{name:<45}{cumulative / 1000:>16.1f}")
+
+    failures = []
+    eager = [name for name in LAZY_MODULES if name in best]
+    if eager:
+        failures.append(f"moduli importati all'avvio invece che al primo uso: {', '.join(eager)}")
+    if total_ms > args.budget_ms:
+        failures.append(f"tempo di import {total_ms:.0f} ms oltre il budget di {args.budget_ms:.0f} ms")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Benchmark della serializzazione dei grafici di /api/backtest.
+
+Confronta il percorso precedente (go.Figure con i dati -> PlotlyJSONEncoder ->
+json.loads -> jsonable_encoder + json.dumps di FastAPI) con quello attuale
+(figure senza dati + array binari Plotly -> orjson) su serie giornaliere
+sintetiche. Non richiede rete.
+
+Uso: python benchmarks/bench_plot_serialization.py [--years 35] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import orjson
+import plotly.graph_objects as go
+import plotly.utils
+from fastapi.encoders import jsonable_encoder
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backtest import AdvancedPortfolioAnalyzer, BacktestConfig, BacktestPerformance, Etf  # noqa: E402
+from renderers import RENDERERS  # noqa: E402
+
+
+def synthetic_series(years: int, seed: int = 42):
+    rng = np.random.default_rng(seed)
+    index = pd.bdate_range('1990-01-01', periods=years * 252)
+    portfolio_returns = pd.Series(rng.normal(0.0003, 0.01, len(index)), index=index)
+    benchmark_returns = pd.Series(rng.normal(0.0003, 0.011, len(index)), index=index)
+    return ((1 + portfolio_returns).cumprod() * 10000, (1 + benchmark_returns).cumprod() * 10000,
+            portfolio_returns, benchmark_returns)
+
+
+def legacy_response(portfolio_cum, benchmark_cum, portfolio_returns) -> bytes:
+    """Percorso originale: figure con i dati, doppio passaggio JSON e jsonable_encoder."""
+    performance_fig = go.Figure()
+    performance_fig.add_trace(go.Scatter(x=portfolio_cum.index, y=portfolio_cum.values, mode='lines', name='Portfolio'))
+    performance_fig.add_trace(go.Scatter(x=benchmark_cum.index, y=benchmark_cum.values, mode='lines', name='Benchmark'))
+    performance_fig.update_layout(template='plotly_white', height=500)
+
+    normalized = portfolio_cum / portfolio_cum.iloc[0]
+    drawdown = (normalized - normalized.cummax()) / normalized.cummax()
+    drawdown_fig = go.Figure()
+    drawdown_fig.add_trace(go.Scatter(x=drawdown.index, y=drawdown.values * 100, mode='lines', fill='tonexty'))
+    drawdown_fig.update_layout(template='plotly_white', height=400)
+
+    monthly_returns = (1 + portfolio_returns).resample('ME').prod() - 1
+    distribution_fig = go.Figure()
+    distribution_fig.add_trace(go.Histogram(x=monthly_returns.values * 100, nbinsx=30))
+    distribution_fig.update_layout(template='plotly_white', height=400)
+
+    plots = {
+        "performance": json.loads(plotly.utils.PlotlyJSONEncoder().encode(performance_fig)),
+        "drawdown": json.loads(plotly.utils.PlotlyJSONEncoder().encode(drawdown_fig)),
+        "distribution": json.loads(plotly.utils.PlotlyJSONEncoder().encode(distribution_fig)),
+    }
+    return json.dumps(jsonable_encoder({"plots": plots})).encode()
+
+
+def current_response(analyzer, portfolio_cum, benchmark_cum, portfolio_returns, benchmark_returns) -> bytes:
+    performance = BacktestPerformance(portfolio_returns, benchmark_returns, portfolio_cum, benchmark_cum)
+    plots = RENDERERS['plotly-json'].render(analyzer, performance)
+    plots.pop("allocation")
+    return orjson.dumps({"plots": plots}, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+def measure(fn, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings), len(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--years', type=int, default=35)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    series = synthetic_series(args.years)
+    analyzer = AdvancedPortfolioAnalyzer(
+        etfs=[Etf(name='VTI', weight=1.0)],
+        benchmark=[Etf(name='VT', weight=1.0)],
+        config=BacktestConfig()
+    )
+
+    legacy_time, legacy_size = measure(lambda: legacy_response(*series[:3]), args.repeat)
+    current_time, current_size = measure(lambda: current_response(analyzer, *series), args.repeat)
+
+    print(f"Serie giornaliere: {len(series[0])} punti x 3 tracce ({args.years} anni), plotly {plotly.__version__}")
+    print(f"{'percorso':<12}{'tempo (ms)':>12}{'dimensione (KB)':>18}")
+    print(f"{'precedente':<12}{legacy_time * 1000:>12.1f}{legacy_size / 1024:>18.1f}")
+    print(f"{'attuale':<12}{current_time * 1000:>12.1f}{current_size / 1024:>18.1f}")
+    print(f"speedup x{legacy_time / current_time:.1f}, dimensione {current_size / legacy_size:.0%}")
+
+
+if __name__ == "__main__":
+    main()
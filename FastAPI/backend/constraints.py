@@ -0,0 +1,172 @@
+import numpy as np
+from typing import Dict, List, Optional
+from pydantic import BaseModel
+from fastapi import HTTPException
+
+from ticker_catalog import TICKER_CATEGORIES
+
+
+class WeightBounds(BaseModel):
+    min_weight: float = 0.0
+    max_weight: float = 1.0
+
+
+class GroupConstraint(BaseModel):
+    category: str                        # Categoria di /api/tickers (es. "Bond ETFs") o nome libero
+    tickers: Optional[List[str]] = None  # Membri espliciti; se assente si usa il catalogo
+    min_weight: float = 0.0
+    max_weight: float = 1.0
+
+
+class ConstraintSet:
+    """
+    Feasible region {w : sum(w) = 1, lo <= w <= hi, L_g <= sum(w[g]) <= U_g}
+    resolved against the asset order of the return matrix.
+
+    Groups are disjoint and cover every asset: assets not named by any
+    group constraint fall into an implicit unconstrained residual group.
+    """
+
+    def __init__(self, symbols: List[str], lo: np.ndarray, hi: np.ndarray,
+                 groups: List[np.ndarray], group_lo: np.ndarray, group_hi: np.ndarray,
+                 group_names: List[str]):
+        self.symbols = list(symbols)
+        self.lo = lo
+        self.hi = hi
+        self.groups = groups
+        self.group_lo = group_lo
+        self.group_hi = group_hi
+        self.group_names = group_names
+
+    def to_dict(self) -> Dict:
+        return {
+            'bounds': {
+                symbol: {'min_weight': float(lo), 'max_weight': float(hi)}
+                for symbol, lo, hi in zip(self.symbols, self.lo, self.hi)
+            },
+            'groups': [
+                {
+                    'category': name,
+                    'tickers': [self.symbols[i] for i in idx],
+                    'min_weight': float(glo),
+                    'max_weight': float(ghi),
+                }
+                for name, idx, glo, ghi in zip(self.group_names, self.groups, self.group_lo, self.group_hi)
+            ],
+        }
+
+
+def build_constraint_set(symbols: List[str],
+                         min_weight: float = 0.0,
+                         max_weight: float = 1.0,
+                         asset_bounds: Optional[Dict[str, WeightBounds]] = None,
+                         group_constraints: Optional[List[GroupConstraint]] = None) -> ConstraintSet:
+    """Resolve global, per-asset and group limits into a ConstraintSet and check feasibility."""
+    symbols = list(symbols)
+    n_assets = len(symbols)
+    asset_bounds = asset_bounds or {}
+    group_constraints = group_constraints or []
+
+    lo = np.full(n_assets, float(min_weight))
+    hi = np.full(n_assets, float(max_weight))
+    for i, symbol in enumerate(symbols):
+        if symbol in asset_bounds:
+            lo[i] = asset_bounds[symbol].min_weight
+            hi[i] = asset_bounds[symbol].max_weight
+    lo = np.clip(lo, 0.0, 1.0)
+    hi = np.clip(hi, 0.0, 1.0)
+
+    bad = [symbols[i] for i in np.flatnonzero(lo > hi)]
+    if bad:
+        raise HTTPException(status_code=400, detail=f"min_weight greater than max_weight for: {', '.join(bad)}")
+
+    position = {symbol: i for i, symbol in enumerate(symbols)}
+    assigned = np.full(n_assets, -1)
+    groups, group_lo, group_hi, group_names = [], [], [], []
+
+    for constraint in group_constraints:
+        members = constraint.tickers
+        if members is None:
+            if constraint.category not in TICKER_CATEGORIES:
+                raise HTTPException(status_code=400, detail=f"Unknown category: {constraint.category}")
+            members = TICKER_CATEGORIES[constraint.category]
+
+        idx = np.array(sorted(position[t] for t in set(members) if t in position), dtype=int)
+        if idx.size == 0:
+            if constraint.min_weight > 0:
+                raise HTTPException(status_code=400,
+                                    detail=f"Group '{constraint.category}' requires {constraint.min_weight:.0%} but none of its assets are in the portfolio")
+            continue
+
+        overlap = [symbols[i] for i in idx if assigned[i] >= 0]
+        if overlap:
+            raise HTTPException(status_code=400, detail=f"Assets assigned to more than one group: {', '.join(overlap)}")
+        assigned[idx] = len(groups)
+
+        groups.append(idx)
+        group_lo.append(max(constraint.min_weight, lo[idx].sum()))
+        group_hi.append(min(constraint.max_weight, hi[idx].sum()))
+        group_names.append(constraint.category)
+
+    residual = np.flatnonzero(assigned < 0)
+    if residual.size > 0:
+        groups.append(residual)
+        group_lo.append(lo[residual].sum())
+        group_hi.append(min(1.0, hi[residual].sum()))
+        group_names.append('Other')
+
+    group_lo = np.array(group_lo)
+    group_hi = np.array(group_hi)
+
+    infeasible = [name for name, glo, ghi in zip(group_names, group_lo, group_hi) if glo > ghi + 1e-12]
+    if infeasible:
+        raise HTTPException(status_code=400, detail=f"Group limits incompatible with asset bounds: {', '.join(infeasible)}")
+    if group_lo.sum() > 1.0 + 1e-9 or group_hi.sum() < 1.0 - 1e-9:
+        raise HTTPException(status_code=400, detail="Constraints are infeasible: weights cannot sum to 100%")
+
+    return ConstraintSet(symbols, lo, hi, groups, group_lo, group_hi, group_names)
+
+
+def _sample_bounded_simplex(num_samples: int, lo: np.ndarray, hi: np.ndarray, total) -> np.ndarray:
+    """
+    Draw points with lo <= x <= hi and sum(x) = total (scalar or one total per row).
+
+    Uniform simplex draws are scaled into the free budget above the lower
+    bounds; any mass above an upper bound is redistributed in proportion to
+    the remaining headroom, which lands every row inside the box in one pass.
+    """
+    raw = np.random.random((num_samples, len(lo)))
+    raw /= raw.sum(axis=1, keepdims=True)
+
+    free = np.reshape(total, (-1, 1)) - lo.sum()
+    weights = lo + free * raw
+
+    over = weights > hi
+    if over.any():
+        excess = np.where(over, weights - hi, 0.0).sum(axis=1, keepdims=True)
+        np.minimum(weights, hi, out=weights)
+        headroom = hi - weights
+        headroom_sum = headroom.sum(axis=1, keepdims=True)
+        share = np.divide(headroom, headroom_sum, out=np.zeros_like(headroom), where=headroom_sum > 0)
+        weights += excess * share
+    return weights
+
+
+def sample_feasible_weights(num_samples: int, constraints: ConstraintSet) -> np.ndarray:
+    """
+    Generate num_samples random portfolios that all satisfy the constraints.
+
+    Group totals are drawn first, then asset weights inside each group, so
+    no draw is ever rejected. Without constraints this reduces to the plain
+    normalized uniform draw used by the unconstrained frontier.
+    """
+    n_assets = len(constraints.symbols)
+    if len(constraints.groups) == 1:
+        return _sample_bounded_simplex(num_samples, constraints.lo, constraints.hi, 1.0)
+
+    group_totals = _sample_bounded_simplex(num_samples, constraints.group_lo, constraints.group_hi, 1.0)
+    weights = np.empty((num_samples, n_assets))
+    for g, idx in enumerate(constraints.groups):
+        weights[:, idx] = _sample_bounded_simplex(num_samples, constraints.lo[idx], constraints.hi[idx],
+                                                  group_totals[:, g])
+    return weights
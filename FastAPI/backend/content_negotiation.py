@@ -0,0 +1,177 @@
+import gzip
+import importlib.util
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import orjson
+import pandas as pd
+from fastapi import Response
+
+
+JSON = 'application/json'
+ARROW_STREAM = 'application/vnd.apache.arrow.stream'
+MSGPACK = 'application/msgpack'
+
+# Alias accettati nell'header Accept
+_MEDIA_ALIASES = {
+    JSON: JSON,
+    ARROW_STREAM: ARROW_STREAM,
+    MSGPACK: MSGPACK,
+    'application/x-msgpack': MSGPACK,
+    'application/vnd.msgpack': MSGPACK,
+}
+
+# Sotto questa soglia la compressione costa più di quanto fa risparmiare
+COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+_JSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+@lru_cache(maxsize=None)
+def _available(module: str) -> bool:
+    """Libreria installata (controllata una volta sola e senza importarla: pyarrow è lento da caricare)."""
+    return importlib.util.find_spec(module) is not None
+
+
+def _parse_header(header: Optional[str]) -> List[Tuple[str, float]]:
+    """Split an Accept / Accept-Encoding header into (value, q) pairs, highest q first."""
+    entries = []
+    for position, part in enumerate((header or '').split(',')):
+        fields = [f.strip() for f in part.split(';')]
+        if not fields[0]:
+            continue
+        q = 1.0
+        for param in fields[1:]:
+            if param.startswith('q='):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        entries.append((fields[0].lower(), q, position))
+    entries.sort(key=lambda e: (-e[1], e[2]))
+    return [(value, q) for value, q, _ in entries]
+
+
+def negotiate_media_type(accept: Optional[str]) -> str:
+    """
+    Pick the response format from the Accept header.
+
+    Binary formats are offered only when their library is installed
+    (pyarrow for Arrow, msgpack for MessagePack). Anything else, including
+    a missing header or */*, falls back to JSON.
+    """
+    offered = {JSON: True, ARROW_STREAM: _available('pyarrow'), MSGPACK: _available('msgpack')}
+    for value, q in _parse_header(accept):
+        media_type = _MEDIA_ALIASES.get(value)
+        if q > 0 and media_type and offered[media_type]:
+            return media_type
+    return JSON
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Pick zstd (if zstandard is installed) or gzip from Accept-Encoding; None means identity."""
+    offered = ['zstd', 'gzip'] if _available('zstandard') else ['gzip']
+    accepted = {value: q for value, q in _parse_header(accept_encoding)}
+    best = None
+    for coding in offered:
+        q = accepted.get(coding, accepted.get('*', 0.0))
+        if q > 0 and (best is None or q > best[1]):
+            best = (coding, q)
+    return best[0] if best else None
+
+
+def compress(body: bytes, coding: Optional[str]) -> bytes:
+    if coding == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+    if coding == 'gzip':
+        return gzip.compress(body, compresslevel=GZIP_LEVEL)
+    return body
+
+
+def _column_array(values) -> np.ndarray:
+    """Contiguous little-endian array for a column; datetimes become int64 milliseconds since epoch."""
+    values = np.asarray(values)
+    if np.issubdtype(values.dtype, np.datetime64):
+        values = values.astype('datetime64[ms]').astype(np.int64)
+    return np.ascontiguousarray(values, dtype=values.dtype.newbyteorder('<'))
+
+
+def _frame_columns(frame: pd.DataFrame) -> Dict[str, np.ndarray]:
+    columns = {}
+    if frame.index.name:
+        columns[frame.index.name] = _column_array(frame.index.values)
+    for name in frame.columns:
+        columns[name] = _column_array(frame[name].to_numpy())
+    return columns
+
+
+def _msgpack_default(obj):
+    if isinstance(obj, pd.DataFrame):
+        return {'length': len(obj), 'columns': _frame_columns(obj)}
+    if isinstance(obj, np.ndarray):
+        array = _column_array(obj)
+        # Il buffer NumPy va direttamente nel tipo bin di msgpack, senza liste Python
+        return {'dtype': array.dtype.str, 'shape': list(array.shape), 'data': memoryview(array).cast('B')}
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f'Cannot serialize {type(obj).__name__} to msgpack')
+
+
+def encode_msgpack(content: Dict) -> bytes:
+    import msgpack
+    return msgpack.packb(content, default=_msgpack_default, use_bin_type=True)
+
+
+def encode_arrow(content: Dict, table_key: str) -> bytes:
+    """
+    Arrow IPC stream whose record batch is content[table_key].
+
+    That value is a DataFrame or a dict of equal-length 1-D arrays. Its
+    float columns are wrapped without copying. Every other key travels as
+    JSON in the schema metadata under b'content'.
+    """
+    import pyarrow as pa
+
+    table = content.get(table_key)
+    if isinstance(table, pd.DataFrame):
+        columns = _frame_columns(table)
+    else:
+        columns = {name: _column_array(values) for name, values in (table or {}).items()
+                   if isinstance(values, np.ndarray) and values.ndim == 1}
+
+    arrays, fields = [], []
+    for name, values in columns.items():
+        array = pa.array(values)
+        if name == 'date' and values.dtype == np.int64:
+            array = array.view(pa.timestamp('ms'))
+        arrays.append(array)
+        fields.append(pa.field(name, array.type))
+
+    rest = {key: value for key, value in content.items() if key != table_key}
+    schema = pa.schema(fields, metadata={b'content': orjson.dumps(rest, option=_JSON_OPTIONS), b'table': table_key.encode()})
+    batch = pa.record_batch(arrays, schema=schema)
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        writer.write_batch(batch)
+    return sink.getvalue().to_pybytes()
+
+
+def negotiated_response(content: Dict, media_type: str, coding: Optional[str], table_key: str) -> Response:
+    """Serialize content in the negotiated format and, if worthwhile, compress it."""
+    if media_type == ARROW_STREAM:
+        body = encode_arrow(content, table_key)
+    elif media_type == MSGPACK:
+        body = encode_msgpack(content)
+    else:
+        body = orjson.dumps(content, option=_JSON_OPTIONS)
+
+    headers = {'Vary': 'Accept, Accept-Encoding'}
+    if coding and len(body) >= COMPRESS_MIN_BYTES:
+        body = compress(body, coding)
+        headers['Content-Encoding'] = coding
+    return Response(content=body, media_type=media_type, headers=headers)
@@ -0,0 +1,137 @@
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+import numpy as np
+from pydantic import BaseModel
+from fastapi import HTTPException
+
+from array_encoding import encode_float32
+from market_data import load_return_matrix
+
+
+CORRELATION_CACHE_SIZE = 32
+
+
+class CorrelationRequest(BaseModel):
+    tickers: List[str]
+    start_date: str = "2010-01-01"
+    end_date: str = "2024-12-31"
+    window: int = 63       # Finestra mobile in giorni di borsa (~3 mesi)
+    step: int = 21         # Distanza tra due matrici mobili consecutive (~1 mese)
+    cluster: bool = False  # Riordina gli asset per clustering gerarchico
+
+
+def _to_correlation(cov: np.ndarray) -> np.ndarray:
+    std = np.sqrt(np.diagonal(cov, axis1=-2, axis2=-1))
+    denom = std[..., :, None] * std[..., None, :]
+    corr = np.divide(cov, denom, out=np.full_like(cov, np.nan), where=denom > 0)
+    return np.clip(corr, -1.0, 1.0)
+
+
+def rolling_correlations(returns: np.ndarray, window: int, step: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Rolling correlation matrices from cumulative cross-product sums.
+
+    Only the prefix sums at window boundaries are materialized: the prefix
+    cross-product X[:k]'X[:k] is advanced from one boundary to the next with
+    a single matmul over the rows in between, so the total cost is O(T·N²)
+    regardless of window length and memory is O(K·N²) for K output matrices.
+    Returns (end_positions, matrices) where matrix k covers rows
+    end_positions[k] - window + 1 .. end_positions[k].
+    """
+    n_obs, n_assets = returns.shape
+    # Centering on the full-period mean keeps the sum-of-squares formula stable
+    x = returns - returns.mean(axis=0)
+
+    ends = np.arange(n_obs, window - 1, -step)[::-1]  # esclusivi: la finestra è x[end - window:end]
+    boundaries = np.unique(np.concatenate([ends - window, ends]))
+
+    prefix_sum = np.cumsum(np.vstack([np.zeros(n_assets), x]), axis=0)[boundaries]
+    prefix_cross = np.empty((len(boundaries), n_assets, n_assets))
+    running = np.zeros((n_assets, n_assets))
+    previous = 0
+    for k, boundary in enumerate(boundaries):
+        block = x[previous:boundary]
+        running += block.T @ block
+        prefix_cross[k] = running
+        previous = boundary
+
+    start_idx = np.searchsorted(boundaries, ends - window)
+    end_idx = np.searchsorted(boundaries, ends)
+    sums = prefix_sum[end_idx] - prefix_sum[start_idx]
+    cross = prefix_cross[end_idx] - prefix_cross[start_idx]
+    cov = (cross - sums[:, :, None] * sums[:, None, :] / window) / (window - 1)
+    return ends - 1, _to_correlation(cov)
+
+
+def cluster_order(corr: np.ndarray) -> np.ndarray:
+    """Leaf order of an average-linkage clustering on the distance sqrt((1 - rho) / 2)."""
+    from scipy.cluster.hierarchy import leaves_list, linkage
+    from scipy.spatial.distance import squareform
+
+    if len(corr) < 3:
+        return np.arange(len(corr))
+    distance = np.sqrt(np.clip((1.0 - np.nan_to_num(corr)) / 2.0, 0.0, None))
+    np.fill_diagonal(distance, 0.0)
+    return leaves_list(linkage(squareform(distance, checks=False), method='average'))
+
+
+@lru_cache(maxsize=CORRELATION_CACHE_SIZE)
+def _correlation_analysis(tickers: Tuple[str, ...], start_date: str, end_date: str,
+                          window: int, step: int, cluster: bool) -> Dict:
+    returns = load_return_matrix(list(tickers), start_date, end_date)
+    if returns.empty:
+        raise HTTPException(status_code=400, detail="No data available for the specified period")
+    if returns.shape[1] < 2:
+        raise HTTPException(status_code=400, detail="At least 2 assets are required for correlation analysis")
+
+    values = returns.to_numpy()
+    symbols = list(returns.columns)
+    full = _to_correlation(np.cov(values, rowvar=False))
+
+    order = cluster_order(full) if cluster else np.arange(len(symbols))
+    full = full[np.ix_(order, order)]
+
+    result = {
+        'symbols': [symbols[i] for i in order],
+        'dtype': 'float32',
+        'full': {
+            'shape': list(full.shape),
+            'data': encode_float32(full),
+        },
+        'rolling': None,
+        'config': {
+            'start_date': start_date,
+            'end_date': end_date,
+            'window': window,
+            'step': step,
+            'cluster': cluster,
+            'observations': len(values),
+        }
+    }
+
+    if len(values) >= window:
+        positions, matrices = rolling_correlations(values, window, step)
+        matrices = matrices[:, order][:, :, order]
+        result['rolling'] = {
+            'dates': [d.strftime('%Y-%m-%d') for d in returns.index[positions]],
+            'shape': list(matrices.shape),
+            'data': encode_float32(matrices),
+        }
+    return result
+
+
+def calculate_correlation(request: CorrelationRequest) -> Dict:
+    """
+    Full-period and rolling correlation matrices for a ticker set.
+
+    Matrices are sent as base64 float32 buffers (row-major, see 'shape');
+    results are cached per universe, date range and window settings.
+    """
+    if len(set(request.tickers)) < 2:
+        raise HTTPException(status_code=400, detail="At least 2 tickers are required for correlation analysis")
+    if request.window < 2 or request.step < 1:
+        raise HTTPException(status_code=400, detail="window must be >= 2 and step >= 1")
+
+    return _correlation_analysis(tuple(sorted(set(request.tickers))), request.start_date, request.end_date,
+                                 request.window, request.step, request.cluster)
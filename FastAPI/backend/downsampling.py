@@ -0,0 +1,70 @@
+import numpy as np
+
+
+def _bucket_layout(n_points: int, n_out: int):
+    """Padded (buckets x max_size) matrix of point indices for the n_out - 2 inner LTTB buckets."""
+    edges = (np.arange(n_out - 1) * (n_points - 2) / (n_out - 2)).astype(np.int64) + 1
+    edges[-1] = n_points - 1
+    sizes = np.diff(edges)
+    offsets = np.arange(sizes.max())
+    idx = edges[:-1, None] + offsets[None, :]
+    valid = offsets[None, :] < sizes[:, None]
+    return np.where(valid, idx, edges[:-1, None]), valid
+
+
+def _select(x, y, idx, valid, anchor_x, anchor_y, next_x, next_y):
+    """Pick, in every bucket at once, the point forming the largest triangle with its neighbours."""
+    px, py = x[idx], y[idx]
+    area = np.abs((anchor_x[:, None] - next_x[:, None]) * (py - anchor_y[:, None])
+                  - (anchor_x[:, None] - px) * (next_y[:, None] - anchor_y[:, None]))
+    area = np.where(valid, area, -1.0)
+    return idx[np.arange(len(idx)), np.argmax(area, axis=1)]
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Indices of a Largest-Triangle-Three-Buckets downsampling of (x, y).
+
+    All buckets are processed together in NumPy. Sequential LTTB anchors each
+    bucket on the point picked in the previous one. Here a first pass
+    anchors on the previous bucket's mean, and a second pass re-anchors on
+    the first pass's picks. The first and last points are always kept, and
+    so are the global minimum and maximum of y, so drawdown troughs and
+    equity peaks survive at full depth. Their slots come out of the bucket
+    budget, so at most max_points indices are returned.
+
+    Raises ValueError when max_points < 3 (None keeps every point).
+    """
+    if max_points is not None and max_points < 3:
+        raise ValueError("max_points deve essere almeno 3 (primo, ultimo e un punto intermedio)")
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n_points = len(y)
+    if max_points is None or n_points <= max_points:
+        return np.arange(n_points)
+
+    # Minimo e massimo interni (prima il minimo: il fondo del drawdown), ognuno con un posto riservato
+    extremes = list(dict.fromkeys(e for e in (int(np.argmin(y)), int(np.argmax(y))) if 0 < e < n_points - 1))
+    n_out = max_points - len(extremes)
+    if n_out < 3:
+        return np.unique([0, *extremes[:max_points - 2], n_points - 1]).astype(np.int64)
+
+    idx, valid = _bucket_layout(n_points, n_out)
+    counts = valid.sum(axis=1)
+    mean_x = np.where(valid, x[idx], 0.0).sum(axis=1) / counts
+    mean_y = np.where(valid, y[idx], 0.0).sum(axis=1) / counts
+
+    next_x = np.append(mean_x[1:], x[-1])
+    next_y = np.append(mean_y[1:], y[-1])
+
+    # Pass 1: anchor on the previous bucket's mean
+    prev_x = np.insert(mean_x[:-1], 0, x[0])
+    prev_y = np.insert(mean_y[:-1], 0, y[0])
+    selected = _select(x, y, idx, valid, prev_x, prev_y, next_x, next_y)
+
+    # Pass 2: anchor on the point selected in the previous bucket
+    prev_sel = np.insert(selected[:-1], 0, 0)
+    selected = _select(x, y, idx, valid, x[prev_sel], y[prev_sel], next_x, next_y)
+
+    # Extremes go in their reserved slots (duplicates of a bucket pick collapse in unique)
+    return np.unique(np.concatenate([[0], selected, extremes, [n_points - 1]])).astype(np.int64)
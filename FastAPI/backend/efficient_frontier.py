@@ -1,13 +1,24 @@
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import yfinance as yf
-from typing import List
-from pydantic import BaseModel
+from typing import Dict, List
+from datetime import datetime
+from pydantic import BaseModel, Field, conint
 from fastapi import HTTPException
 import io
 import base64
 
+from market_data import load_price_panel, load_return_matrix, periods_per_year
+from frontier_density import FrontierDensity
+from array_encoding import encode_float32
+from plot_store import register_plots
+from plotting import pyplot
+from stage_metrics import StageClock
+from constraints import WeightBounds, GroupConstraint, build_constraint_set, sample_feasible_weights
+
+
+# Portafogli campionati per blocco (limita la memoria temporanea di dot/einsum)
+SAMPLE_CHUNK_SIZE = 50000
+
 
 class EtfInput(BaseModel):
     name: str
@@ -17,20 +28,36 @@ class EtfInput(BaseModel):
 
 class EfficientFrontierConfig(BaseModel):
     start_date: str = "2010-01-01"
-    end_date: str = "2024-12-31"
-    num_portfolios: int = 100000
+    end_date: str = Field(default_factory=lambda: datetime.now().strftime('%Y-%m-%d'))
+    num_portfolios: conint(ge=1) = 50000  # type: ignore
     risk_free_rate: float = 0.02
     num_efficient_portfolios: int = 3
+    return_frequency: str = "monthly"  # daily, weekly, monthly
+    frontier_mode: str = "scatter"  # scatter (ogni campione), density (griglia volatilità/rendimento)
+    plots: str = "png"  # none, data (solo array), png (URL a /api/plots, rendering differito)
+    density_bins: conint(ge=2, le=1000) = 100  # type: ignore  # Risoluzione della griglia in modalità density (bins x bins celle)
+    min_weight: float = 0.0  # Peso minimo per ogni asset
+    max_weight: float = 1.0  # Peso massimo per ogni asset (es. 0.4 = nessun asset oltre il 40%)
+    asset_bounds: Dict[str, WeightBounds] = {}  # Limiti specifici per ticker, prevalgono su min/max_weight
+    group_constraints: List[GroupConstraint] = []  # Limiti per categoria (es. "Bond ETFs" >= 20%)
 
 
-def fig_to_base64(fig):
-    """Convert matplotlib figure to base64 string."""
+class EfficientFrontierPayload(BaseModel):
+    etfs: List[EtfInput]
+    config: EfficientFrontierConfig = EfficientFrontierConfig()
+
+
+def fig_to_png(fig) -> bytes:
+    """Render a matplotlib figure to PNG bytes and release it."""
     img_buffer = io.BytesIO()
     fig.savefig(img_buffer, format='png', dpi=150, bbox_inches='tight')
-    img_buffer.seek(0)
-    img_str = base64.b64encode(img_buffer.getvalue()).decode()
-    plt.close(fig)
-    return img_str
+    pyplot().close(fig)
+    return img_buffer.getvalue()
+
+
+def fig_to_base64(fig):
+    """Convert matplotlib figure to base64 string."""
+    return base64.b64encode(fig_to_png(fig)).decode()
 
 
 def load_etf_data(etfs: List[EtfInput], start_date: str, end_date: str) -> pd.DataFrame:
@@ -38,40 +65,53 @@ def load_etf_data(etfs: List[EtfInput], start_date: str, end_date: str) -> pd.Da
     tickers = [etf.name for etf in etfs]
     
     try:
-        # Download data for all tickers
-        data = yf.download(tickers, start=start_date, end=end_date, progress=False)
-        if data.empty:
-            raise ValueError("No data downloaded. Check tickers.")
-        
-        # Handle both single and multiple ticker cases
-        if len(tickers) == 1:
-            adj_close = data[['Close']].rename(columns={'Close': tickers[0]})
-        else:
-            adj_close = data['Close']
-        
-        return adj_close.dropna(how='all')
+        # Prices are cached per universe/date range in market_data
+        return load_price_panel(tickers, start_date, end_date)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error loading data: {e}")
 
 
-def calculate_efficient_frontier(etfs: List[EtfInput], config: EfficientFrontierConfig):
-    """Calculate efficient frontier and return analysis results."""
+def load_etf_returns(etfs: List[EtfInput], start_date: str, end_date: str,
+                     frequency: str = 'daily') -> pd.DataFrame:
+    """Load the cached return matrix shared by the frontier and the allocators."""
+    tickers = [etf.name for etf in etfs]
     
-    # Load ETF data
-    all_normalized_assets_ef = load_etf_data(etfs, config.start_date, config.end_date)
+    try:
+        return load_return_matrix(tickers, start_date, end_date, frequency)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error loading data: {e}")
+
+
+def calculate_efficient_frontier(etfs: List[EtfInput], config: EfficientFrontierConfig, encode=encode_float32):
+    """
+    Calculate efficient frontier and return analysis results.
+
+    encode turns sample and density arrays into their wire form: base64
+    float32 for JSON, or as_float32 to keep NumPy arrays for binary responses.
+    """
     
-    if all_normalized_assets_ef.empty:
+    # Stage timings (load/sample/extract) for Server-Timing and /api/metrics
+    clock = StageClock('frontier')
+    
+    # Load ETF returns at the requested frequency (shared cached return matrix)
+    try:
+        periods = periods_per_year(config.return_frequency)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    period_returns = load_etf_returns(etfs, config.start_date, config.end_date, config.return_frequency)
+    
+    if period_returns.empty:
         raise HTTPException(status_code=400, detail="No data available for the specified period")
     
-    # Extract monthly returns for all columns
-    monthly_returns = all_normalized_assets_ef.pct_change().dropna()
-    symbols = monthly_returns.columns
+    symbols = period_returns.columns
     
     if len(symbols) < 2:
         raise HTTPException(status_code=400, detail="At least 2 assets are required for efficient frontier analysis")
     
-    n_months = len(monthly_returns)
-    annual_returns = (1 + monthly_returns).prod() ** (12 / n_months) - 1
+    clock.lap('load')
+    
+    n_periods = len(period_returns)
+    annual_returns = (1 + period_returns).prod() ** (periods / n_periods) - 1
     
     # Applica TER (fee annuali) ai rendimenti degli ETF
     etf_ter_dict = {etf.name: etf.ter for etf in etfs}
@@ -83,15 +123,43 @@ def calculate_efficient_frontier(etfs: List[EtfInput], config: EfficientFrontier
     cagr = annual_returns
     
     # Calculate the annualized covariance matrix
-    cov_matrix = monthly_returns.cov() * 12
-    
-    # Randomly generate weights for the portfolios
-    weights = np.random.random((config.num_portfolios, len(symbols)))
-    weights /= weights.sum(axis=1, keepdims=True)
+    cov_matrix = period_returns.cov() * periods
+    
+    # Randomly generate feasible weights for the portfolios (no draw is rejected)
+    constraints = build_constraint_set(
+        list(symbols),
+        min_weight=config.min_weight,
+        max_weight=config.max_weight,
+        asset_bounds=config.asset_bounds,
+        group_constraints=config.group_constraints
+    )
+    if config.frontier_mode not in ('scatter', 'density'):
+        raise HTTPException(status_code=400, detail="frontier_mode must be 'scatter' or 'density'")
+    if config.plots not in ('none', 'data', 'png'):
+        raise HTTPException(status_code=400, detail="plots must be 'none', 'data' or 'png'")
+    
+    cagr_values = cagr.to_numpy()
+    cov_values = cov_matrix.to_numpy()
+    density = FrontierDensity.for_assets(cagr_values, cov_values, config.density_bins) if config.frontier_mode == 'density' else None
+    
+    # Sample in chunks: returns, std and Sharpe per chunk, density grid filled while sampling
+    weights = np.empty((config.num_portfolios, len(symbols)))
+    portfolio_returns = np.empty(config.num_portfolios)
+    portfolio_std_devs = np.empty(config.num_portfolios)
+    for start in range(0, config.num_portfolios, SAMPLE_CHUNK_SIZE):
+        stop = min(start + SAMPLE_CHUNK_SIZE, config.num_portfolios)
+        chunk = sample_feasible_weights(stop - start, constraints)
+        weights[start:stop] = chunk
+        portfolio_returns[start:stop] = chunk @ cagr_values
+        portfolio_std_devs[start:stop] = np.sqrt(np.einsum('ij,ij->i', chunk @ cov_values, chunk))
+        if density is not None:
+            density.update(
+                portfolio_std_devs[start:stop],
+                portfolio_returns[start:stop],
+                (portfolio_returns[start:stop] - config.risk_free_rate) / portfolio_std_devs[start:stop]
+            )
     
-    # Calculate portfolio returns and std
-    portfolio_returns = np.dot(weights, cagr)
-    portfolio_std_devs = np.sqrt(np.einsum('ij,ji->i', weights.dot(cov_matrix), weights.T))
+    clock.lap('sample')
     
     # Calculate Sharpe Ratios
     sharpe_ratios = (portfolio_returns - config.risk_free_rate) / portfolio_std_devs
@@ -142,8 +210,21 @@ def calculate_efficient_frontier(etfs: List[EtfInput], config: EfficientFrontier
     portfolio_names = [f'Efficient {i+1}' for i in range(config.num_efficient_portfolios)] + ['Max Sharpe', 'Min Volatility', 'Max Return']
     all_model_portfolios['Portfolio'] = portfolio_names
     
-    # Generate plots
-    plots = generate_plots(results_df, all_model_portfolios, symbols)
+    # Plots: PNGs are rendered lazily by /api/plots/{result_id}/{name}
+    plots = None
+    samples = None
+    if config.plots == 'png':
+        plot_source = results_df[['Annual Volatility', 'Annual Return', 'Sharpe Ratio']] if density is None else None
+        result_id = register_plots(render_frontier_plot, list(FRONTIER_PLOTS), plot_source, all_model_portfolios, density)
+        plots = {name: f'/api/plots/{result_id}/{name}' for name in FRONTIER_PLOTS}
+    elif config.plots == 'data' and density is None:
+        samples = {
+            'dtype': 'float32',
+            'length': len(results_df),
+            'volatility': encode(portfolio_std_devs),
+            'return': encode(portfolio_returns),
+            'sharpe': encode(sharpe_ratios),
+        }
     
     # Prepare portfolio data for frontend
     portfolios_data = []
@@ -163,30 +244,44 @@ def calculate_efficient_frontier(etfs: List[EtfInput], config: EfficientFrontier
             portfolio_dict['weights'][asset_name] = float(portfolio[col])
         
         portfolios_data.append(portfolio_dict)
+    clock.lap('extract')
     
     return {
         'portfolios': portfolios_data,
         'plots': plots,
+        'samples': samples,
+        'density': density.to_dict(encode) if density is not None else None,
         'config': {
             'start_date': config.start_date,
             'end_date': config.end_date,
             'num_portfolios': config.num_portfolios,
             'risk_free_rate': config.risk_free_rate,
-            'assets': list(symbols)
+            'return_frequency': config.return_frequency,
+            'frontier_mode': config.frontier_mode,
+            'plots': config.plots,
+            'observations': n_periods,
+            'assets': list(symbols),
+            'constraints': constraints.to_dict()
         }
     }
 
 
-def generate_plots(results_df, all_model_portfolios, symbols):
-    """Generate visualization plots for efficient frontier analysis."""
-    plots = {}
-    
-    # Plot 1: Efficient Frontier
+def plot_efficient_frontier(results_df, all_model_portfolios, density=None):
+    """Plot 1: Efficient Frontier (every sample, or the density grid in density mode)."""
+    plt = pyplot()
     plt.style.use('default')
     fig1, ax1 = plt.subplots(figsize=(12, 8))
-    scatter = ax1.scatter(results_df['Annual Volatility'], results_df['Annual Return'], 
-                         c=results_df['Sharpe Ratio'], cmap='viridis', alpha=0.6, s=1)
-    plt.colorbar(scatter, label='Sharpe Ratio')
+    if density is None:
+        scatter = ax1.scatter(results_df['Annual Volatility'], results_df['Annual Return'], 
+                             c=results_df['Sharpe Ratio'], cmap='viridis', alpha=0.6, s=1)
+        plt.colorbar(scatter, label='Sharpe Ratio')
+    else:
+        # Density mode: one mesh of bins x bins cells, independent of num_portfolios
+        grid = np.where(density.counts > 0, density.max_sharpe, np.nan).reshape(density.bins, density.bins)
+        mesh = ax1.pcolormesh(density.vol_edges, density.ret_edges, np.ma.masked_invalid(grid), cmap='viridis')
+        plt.colorbar(mesh, label='Max Sharpe Ratio')
+        env_vols, env_rets = density.envelope()
+        ax1.plot(env_vols, env_rets, color='black', linewidth=1.5, label='Efficient Envelope')
     
     colors = ['red', 'blue', 'green', 'purple', 'orange', 'black']
     markers = ['o', 'o', 'o', 'X', 'X', 'X']
@@ -203,9 +298,12 @@ def generate_plots(results_df, all_model_portfolios, symbols):
     ax1.grid(True, alpha=0.3)
     plt.tight_layout()
     
-    plots['efficient_frontier'] = fig_to_base64(fig1)
-    
-    # Plot 2: Portfolio Compositions
+    return fig1
+
+
+def plot_portfolio_compositions(results_df, all_model_portfolios, density=None):
+    """Plot 2: Portfolio Compositions of the model portfolios (None without weights)."""
+    plt = pyplot()
     weight_columns = [col for col in all_model_portfolios.columns if 'Weight' in col]
     
     if len(weight_columns) > 0:
@@ -216,7 +314,7 @@ def generate_plots(results_df, all_model_portfolios, symbols):
         all_assets = [col.replace(' Weight', '') for col in weight_columns]
         
         # Define color map for consistency
-        color_map = plt.cm.get_cmap('tab20')
+        color_map = plt.get_cmap('tab20')
         color_dict = {asset: color_map(i / len(all_assets)) for i, asset in enumerate(all_assets)}
         
         # Plot each portfolio's composition
@@ -224,7 +322,7 @@ def generate_plots(results_df, all_model_portfolios, symbols):
             if i >= len(axes):
                 break
             
-            weights = portfolio[weight_columns]
+            weights = portfolio[weight_columns].astype(float)
             
             # Filter out positions smaller than 5%
             significant_weights = weights[weights >= 0.05]
@@ -285,6 +383,30 @@ def generate_plots(results_df, all_model_portfolios, symbols):
         plt.tight_layout()
         plt.subplots_adjust(top=0.9)
         
-        plots['portfolio_compositions'] = fig_to_base64(fig2)
+        return fig2
     
+    return None
+
+
+FRONTIER_PLOTS = {
+    'efficient_frontier': plot_efficient_frontier,
+    'portfolio_compositions': plot_portfolio_compositions,
+}
+
+
+def render_frontier_plot(name, results_df, all_model_portfolios, density=None) -> bytes:
+    """Render one named frontier figure to PNG bytes (executed in the plot process pool)."""
+    fig = FRONTIER_PLOTS[name](results_df, all_model_portfolios, density)
+    if fig is None:
+        raise KeyError(name)
+    return fig_to_png(fig)
+
+
+def generate_plots(results_df, all_model_portfolios, symbols, density=None):
+    """Generate all frontier plots inline as base64 PNG strings."""
+    plots = {}
+    for name, plot in FRONTIER_PLOTS.items():
+        fig = plot(results_df, all_model_portfolios, density)
+        if fig is not None:
+            plots[name] = fig_to_base64(fig)
     return plots
\ No newline at end of file
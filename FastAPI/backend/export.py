@@ -0,0 +1,122 @@
+import io
+from typing import Iterable, Iterator, List, Tuple
+
+import pandas as pd
+
+
+# Righe scritte per blocco: limita il buffer in memoria indipendentemente dalla lunghezza dello storico
+EXPORT_CHUNK_ROWS = 2000
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows'),
+}
+
+SERIES_COLUMNS = [
+    'portfolio_value', 'portfolio_return', 'portfolio_drawdown',
+    'benchmark_value', 'benchmark_return', 'benchmark_drawdown',
+]
+
+
+def export_columns(tickers: Iterable[str]) -> List[str]:
+    """Colonne fisse dell'export: identificativo, data, serie e un peso per ogni ticker del batch."""
+    weights = [f'weight_{ticker}' for ticker in dict.fromkeys(tickers)]
+    return ['portfolio_id', 'date'] + SERIES_COLUMNS + weights
+
+
+def _chunks(frames: Iterable[Tuple[str, pd.DataFrame]], columns: List[str],
+            chunk_rows: int) -> Iterator[pd.DataFrame]:
+    """Blocchi di al più chunk_rows righe con le colonne comuni, un portafoglio alla volta."""
+    for portfolio_id, series in frames:
+        for start in range(0, len(series), chunk_rows):
+            block = series.iloc[start:start + chunk_rows].reset_index()
+            block.insert(0, 'portfolio_id', portfolio_id)
+            yield block.reindex(columns=columns)
+
+
+def stream_csv(frames: Iterable[Tuple[str, pd.DataFrame]], columns: List[str],
+               chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[bytes]:
+    """Export in CSV: prima l'intestazione, poi un blocco alla volta."""
+    yield (','.join(columns) + '\n').encode()
+    for block in _chunks(frames, columns, chunk_rows):
+        yield block.to_csv(header=False, index=False, date_format='%Y-%m-%d').encode()
+
+
+class _ChunkSink(io.RawIOBase):
+    """File in sola scrittura che restituisce al generatore i byte scritti."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer.extend(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def _arrow_schema(columns: List[str]):
+    import pyarrow as pa
+
+    fields = [pa.field('portfolio_id', pa.string()), pa.field('date', pa.timestamp('ms'))]
+    fields += [pa.field(column, pa.float64()) for column in columns[2:]]
+    return pa.schema(fields)
+
+
+def stream_arrow(frames: Iterable[Tuple[str, pd.DataFrame]], columns: List[str], fmt: str,
+                 chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[bytes]:
+    """
+    Export in Parquet (un row group per blocco) o come stream Arrow IPC.
+
+    Ogni blocco viene scritto e i suoi byte restituiti subito: la memoria resta
+    limitata a un blocco anche per Parquet, il cui footer è scritto solo alla fine.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _arrow_schema(columns)
+    sink = _ChunkSink()
+    if fmt == 'parquet':
+        writer = pq.ParquetWriter(sink, schema)
+        write = writer.write_table
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+        write = writer.write_table
+
+    for block in _chunks(frames, columns, chunk_rows):
+        write(pa.Table.from_pandas(block, schema=schema, preserve_index=False))
+        data = sink.drain()
+        if data:
+            yield data
+    writer.close()
+    yield sink.drain()
+
+
+def check_format(fmt: str):
+    """Verifica il formato richiesto prima di iniziare lo stream (dopo non si può più cambiare lo status)."""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Formato non supportato '{fmt}'. Usare uno tra: {', '.join(EXPORT_FORMATS)}")
+    if fmt != 'csv':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ValueError(f"Il formato '{fmt}' richiede pyarrow (pip install pyarrow)")
+
+
+def stream_export(frames: Iterable[Tuple[str, pd.DataFrame]], columns: List[str], fmt: str) -> Iterator[bytes]:
+    """Export nel formato richiesto (già verificato con check_format)."""
+    if fmt == 'csv':
+        return stream_csv(frames, columns)
+    return stream_arrow(frames, columns, fmt)
@@ -0,0 +1,80 @@
+import numpy as np
+from typing import Dict
+
+from array_encoding import encode_float32
+
+
+class FrontierDensity:
+    """
+    Fixed volatility/return grid filled chunk by chunk while portfolios are sampled.
+
+    Each cell keeps the best Sharpe ratio that landed in it, and each
+    volatility column keeps its highest-return sample for the envelope.
+    The grid limits are known before sampling: a long-only portfolio's
+    return lies between the lowest and highest asset return, and its
+    volatility is at most the highest asset volatility. So samples can be
+    binned as they are drawn and the output size depends only on the grid.
+    """
+
+    def __init__(self, vol_range, ret_range, bins: int = 100):
+        self.bins = bins
+        self.vol_edges = np.linspace(vol_range[0], vol_range[1], bins + 1)
+        self.ret_edges = np.linspace(ret_range[0], ret_range[1], bins + 1)
+        self.max_sharpe = np.full(bins * bins, -np.inf)
+        self.counts = np.zeros(bins * bins, dtype=np.int64)
+        self.column_best_return = np.full(bins, -np.inf)
+        self.column_best_vol = np.full(bins, np.nan)
+
+    @classmethod
+    def for_assets(cls, asset_returns: np.ndarray, asset_cov: np.ndarray, bins: int = 100) -> 'FrontierDensity':
+        asset_vols = np.sqrt(np.diag(asset_cov))
+        ret_lo, ret_hi = float(np.min(asset_returns)), float(np.max(asset_returns))
+        if ret_hi <= ret_lo:
+            ret_hi = ret_lo + 1e-6
+        return cls((0.0, float(asset_vols.max()) * (1 + 1e-9)), (ret_lo, ret_hi), bins)
+
+    def _bin(self, values: np.ndarray, edges: np.ndarray) -> np.ndarray:
+        return np.clip(np.searchsorted(edges, values, side='right') - 1, 0, self.bins - 1)
+
+    def update(self, vols: np.ndarray, rets: np.ndarray, sharpes: np.ndarray):
+        """Fold one chunk of sampled portfolios into the grid."""
+        vol_bin = self._bin(vols, self.vol_edges)
+        ret_bin = self._bin(rets, self.ret_edges)
+        cell = ret_bin * self.bins + vol_bin
+
+        np.maximum.at(self.max_sharpe, cell, sharpes)
+        self.counts += np.bincount(cell, minlength=self.bins * self.bins)
+
+        # Highest return per volatility column, with the volatility at which it occurs
+        order = np.lexsort((rets, vol_bin))
+        last_in_column = np.r_[vol_bin[order][1:] != vol_bin[order][:-1], True]
+        top = order[last_in_column]
+        columns = vol_bin[top]
+        better = rets[top] > self.column_best_return[columns]
+        self.column_best_return[columns[better]] = rets[top][better]
+        self.column_best_vol[columns[better]] = vols[top][better]
+
+    def envelope(self):
+        """Upper efficient envelope: column maxima whose return beats every lower-volatility column."""
+        filled = np.isfinite(self.column_best_return)
+        vols = self.column_best_vol[filled]
+        rets = self.column_best_return[filled]
+        efficient = rets >= np.maximum.accumulate(rets)
+        return vols[efficient], rets[efficient]
+
+    def to_dict(self, encode=encode_float32) -> Dict:
+        grid = np.where(self.counts > 0, self.max_sharpe, np.nan).reshape(self.bins, self.bins)
+        env_vols, env_rets = self.envelope()
+        return {
+            'dtype': 'float32',
+            'bins': self.bins,
+            'vol_edges': encode(self.vol_edges),
+            'return_edges': encode(self.ret_edges),
+            # Righe = bin di rendimento, colonne = bin di volatilità; NaN nelle celle vuote
+            'max_sharpe': {'shape': [self.bins, self.bins], 'data': encode(grid)},
+            'envelope': {
+                'length': int(len(env_vols)),
+                'volatility': encode(env_vols),
+                'return': encode(env_rets),
+            },
+        }
@@ -0,0 +1,89 @@
+"""
+Conversione dei prezzi in una valuta di base.
+
+La valuta di ogni ticker viene dai metadati (ticker_info.py) o, se il ticker non è
+noto, dal suffisso della borsa di Yahoo Finance. I cambi sono serie giornaliere
+di Yahoo ('EURUSD=X' = USD per 1 EUR) salvate nello stesso archivio locale dei
+prezzi (price_store.py), quindi scaricate una volta sola.
+"""
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import price_store
+from ticker_info import get_ticker_info
+
+
+# Un cambio che finisce più di tanti giorni prima della fine richiesta viene riscaricato
+FX_MAX_AGE_DAYS = 5
+# Giorni di cambi scaricati prima dell'inizio del pannello (per il riporto del primo giorno)
+FX_LOOKBACK_DAYS = 10
+# Valute quotate in centesimi da Yahoo: valuta e fattore di conversione
+MINOR_UNITS = {'GBp': ('GBP', 0.01), 'GBX': ('GBP', 0.01), 'ZAc': ('ZAR', 0.01), 'ILA': ('ILS', 0.01)}
+# Valuta dedotta dal suffisso della borsa quando i metadati non sono disponibili (nessun suffisso: USD)
+SUFFIX_CURRENCIES = {
+    'MI': 'EUR', 'DE': 'EUR', 'F': 'EUR', 'PA': 'EUR', 'AS': 'EUR', 'MC': 'EUR', 'BR': 'EUR', 'VI': 'EUR',
+    'L': 'GBp', 'SW': 'CHF', 'TO': 'CAD', 'AX': 'AUD', 'T': 'JPY', 'HK': 'HKD',
+}
+
+
+def _suffix_currency(ticker: str) -> str:
+    _, dot, suffix = ticker.rpartition('.')
+    return SUFFIX_CURRENCIES.get(suffix.upper(), 'USD') if dot else 'USD'
+
+
+def ticker_currencies(tickers: Iterable[str], fetch: bool = True) -> Dict[str, str]:
+    """Valuta di quotazione di ogni ticker (codice Yahoo, es. 'EUR' o 'GBp')."""
+    tickers = list(dict.fromkeys(tickers))
+    info = get_ticker_info(tickers, fetch=fetch)
+    currencies = {}
+    for ticker in tickers:
+        currency = (info.get(ticker.strip().upper()) or {}).get('currency')
+        currencies[ticker] = currency or _suffix_currency(ticker)
+    return currencies
+
+
+def fx_symbol(currency: str, base: str) -> Optional[Tuple[str, float]]:
+    """Ticker Yahoo del cambio e fattore per i centesimi; None se non serve conversione."""
+    currency, scale = MINOR_UNITS.get(currency, (currency.upper(), 1.0))
+    if currency == base.upper():
+        return None if scale == 1.0 else ('', scale)
+    return f'{currency}{base.upper()}=X', scale
+
+
+def fx_symbols(tickers: Iterable[str], base: str, fetch: bool = True) -> List[str]:
+    """Cambi necessari per convertire i ticker in base (da includere nei prezzi scaricati)."""
+    symbols = (fx_symbol(currency, base) for currency in ticker_currencies(tickers, fetch).values())
+    return sorted({symbol for symbol, _ in filter(None, symbols) if symbol})
+
+
+def conversion_rates(currencies: List[str], base: str, index: pd.DatetimeIndex,
+                     prices: Optional[Mapping[str, pd.Series]] = None) -> Tuple[np.ndarray, pd.Timestamp]:
+    """
+    Cambi (date x valute) allineati a index e primo giorno in cui sono tutti disponibili.
+
+    Ogni valuta di currencies vale in base il cambio di quel giorno o, se il mercato
+    dei cambi era chiuso, l'ultimo noto. I cambi presenti in prices (es. già letti
+    dall'archivio dal batch runner) non vengono cercati altrove.
+    """
+    prices = {} if prices is None else prices
+    wanted = {currency: fx_symbol(currency, base) for currency in currencies}
+    missing = [symbol for symbol, _ in wanted.values() if symbol and symbol not in prices]
+    if missing:
+        start = (index[0] - pd.Timedelta(days=FX_LOOKBACK_DAYS)).strftime('%Y-%m-%d')
+        end = (index[-1] + pd.Timedelta(days=1)).strftime('%Y-%m-%d')
+        prices = {**prices, **price_store.get_prices(missing, start, end, offline=False, max_age_days=FX_MAX_AGE_DAYS)}
+
+    rates = np.ones((len(index), len(currencies)))
+    first = index[0]
+    for j, currency in enumerate(currencies):
+        symbol, scale = wanted[currency]
+        if symbol:
+            series = prices.get(symbol)
+            if series is None or series.empty:
+                raise ValueError(f"Nessun cambio {symbol} per convertire {currency} in {base.upper()}")
+            rates[:, j] = series.reindex(index, method='ffill').to_numpy(dtype=np.float64)
+            first = max(first, series.index[0])
+        rates[:, j] *= scale
+    return rates, first
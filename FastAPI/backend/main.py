@@ -1,40 +1,41 @@
-import base64
-import io
-import json
+import asyncio
+import os
 from datetime import datetime
-from io import StringIO
-from typing import Dict, List, Optional
-
-import plotly.graph_objects as go
-import plotly.express as px
-import plotly.utils
-import numpy as np
-import pandas as pd
-from fastapi import FastAPI, HTTPException
+from typing import List, Optional
+
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse
 from pydantic import BaseModel, conlist
-import yfinance as yf
-from p1 import PortfolioAnalyzer
-from efficient_frontier import EtfInput, EfficientFrontierConfig, calculate_efficient_frontier
+import orjson
+from backtest import AdvancedPortfolioAnalyzer, PortfolioPayload
+from ticker_catalog import TICKER_CATEGORIES, all_tickers
+from efficient_frontier import EfficientFrontierPayload, calculate_efficient_frontier
+import plot_store
+from array_encoding import as_float32, encode_float32
+import renderers
+from content_negotiation import JSON, negotiate_encoding, negotiate_media_type, negotiated_response
+from export import EXPORT_FORMATS, check_format, export_columns, stream_export
+from allocation import AllocationPayload, calculate_risk_parity, calculate_min_cvar
+from correlation import CorrelationRequest, calculate_correlation
+from ticker_info import MAX_BULK_TICKERS, TickerInfoRequest, get_ticker_info
+from admission import admission, backtest_cost, frontier_cost, stress_cost
+from stress_test import SCENARIO_CATALOG, StressTestPayload, data_range, resolve_scenarios, run_stress_test
+import nightly_refresh
+import profiling
+import stage_metrics
+from stage_metrics import StageTimingMiddleware, stage
 
 
 # --- Modelli di Dati per la richiesta API ---
-class Etf(BaseModel):
-    name: str
-    weight: float
-    ter: float = 0.0  # Total Expense Ratio (%) annuale
-
-class BacktestConfig(BaseModel):
-    start_date: str = "1990-01-01"
-    end_date: str = datetime.now().strftime('%Y-%m-%d')
-    initial_investment: float = 10000
-    rebalance_frequency: str = "quarterly"  # monthly, quarterly, yearly, none
-    reinvest_dividends: bool = True
+class ExportPayload(BaseModel):
+    portfolios: conlist(PortfolioPayload, min_length=1) # type: ignore
+    format: str = "csv"  # csv, parquet, arrow
 
-class PortfolioPayload(BaseModel):
-    etfs: conlist(Etf, min_length=1) # pyright: ignore[reportInvalidTypeForm]
-    benchmark: conlist(Etf, min_length=1) # type: ignore
-    config: BacktestConfig = BacktestConfig()
+class SavePortfolioRequest(BaseModel):
+    name: str
+    portfolio: PortfolioPayload
+    compute: bool = True  # Calcola subito i risultati (altrimenti al prossimo job notturno)
 
 # --- Configurazione dell'App FastAPI ---
 app = FastAPI(
@@ -56,245 +57,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
-
-
-# --- Funzioni Helper Avanzate ---
-
-class AdvancedPortfolioAnalyzer:
-    """
-    Analizzatore di portafoglio avanzato che estende PortfolioAnalyzer
-    con funzionalità di backtesting e metriche avanzate.
-    """
-    
-    def __init__(self, etfs: List[Etf], benchmark: List[Etf], config: BacktestConfig):
-        self.etfs = etfs
-        self.benchmark = benchmark
-        self.config = config
-        
-        # Converti in formato dizionario per PortfolioAnalyzer
-        self.etf_tickers = {etf.name: etf.weight for etf in etfs}
-        self.benchmark_tickers = {b.name: b.weight for b in benchmark}
-        
-        # Calcola TER complessivi
-        self.portfolio_ter = sum(etf.weight * etf.ter for etf in etfs)
-        self.benchmark_ter = sum(b.weight * b.ter for b in benchmark)
-        
-        self.analyzer = PortfolioAnalyzer(
-            etf_tickers=self.etf_tickers,
-            benchmark_tickers=self.benchmark_tickers,
-            start_date=datetime.strptime(config.start_date, '%Y-%m-%d'),
-            end_date=datetime.strptime(config.end_date, '%Y-%m-%d')
-        )
-
-    def run_advanced_backtest(self):
-        """Esegue il backtest avanzato con tutte le metriche e grafici."""
-        try:
-            # Esegui l'analisi base
-            self.analyzer.download_data()
-            self.analyzer.calculate_portfolio()
-            
-            # Calcola metriche avanzate
-            portfolio_data = self.analyzer.my_etf_filtered
-            benchmark_data = self.analyzer.benchmark_filtered
-            
-            # Calcola rendimenti
-            portfolio_returns = portfolio_data['Portfolio'].pct_change().dropna()
-            benchmark_returns = benchmark_data['Benchmark'].pct_change().dropna()
-            
-            # Applica i costi TER
-            portfolio_returns = self._apply_ter_costs(portfolio_returns, self.portfolio_ter)
-            benchmark_returns = self._apply_ter_costs(benchmark_returns, self.benchmark_ter)
-            
-            # Calcola performance cumulativa
-            portfolio_cumulative = (1 + portfolio_returns).cumprod() * self.config.initial_investment
-            benchmark_cumulative = (1 + benchmark_returns).cumprod() * self.config.initial_investment
-            
-            # Metriche avanzate
-            portfolio_metrics = self._calculate_advanced_metrics(portfolio_returns)
-            benchmark_metrics = self._calculate_advanced_metrics(benchmark_returns)
-            
-            # Grafici interattivi
-            plots = self._create_interactive_plots(
-                portfolio_cumulative, benchmark_cumulative, 
-                portfolio_returns, benchmark_returns
-            )
-            
-            return {
-                "success": True,
-                "metrics": {
-                    "portfolio": portfolio_metrics,
-                    "benchmark": benchmark_metrics,
-                },
-                "plots": plots,
-                "config": {
-                    "start_date": self.config.start_date,
-                    "end_date": self.config.end_date,
-                    "initial_investment": self.config.initial_investment,
-                    "portfolio_ter": round(self.portfolio_ter, 4),
-                    "benchmark_ter": round(self.benchmark_ter, 4),
-                },
-                "final_values": {
-                    "portfolio": float(portfolio_cumulative.iloc[-1]),
-                    "benchmark": float(benchmark_cumulative.iloc[-1]),
-                },
-                "allocation": {
-                    "portfolio": [{"name": etf.name, "weight": etf.weight, "ter": etf.ter} for etf in self.etfs],
-                    "benchmark": [{"name": b.name, "weight": b.weight, "ter": b.ter} for b in self.benchmark]
-                }
-            }
-            
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Errore nel backtest: {str(e)}")
-    
-    def _apply_ter_costs(self, returns: pd.Series, ter: float) -> pd.Series:
-        """Applica i costi TER ai rendimenti."""
-        daily_ter = ter / 252  # TER annuale convertito in giornaliero
-        return returns - daily_ter
-    
-    def _calculate_advanced_metrics(self, returns: pd.Series) -> Dict:
-        """Calcola metriche avanzate per una serie di rendimenti."""
-        if returns.empty:
-            return {}
-        
-        # Rendimenti annualizzati
-        annual_return = (1 + returns.mean()) ** 252 - 1
-        
-        # Volatilità annualizzata
-        annual_volatility = returns.std() * np.sqrt(252)
-        
-        # Sharpe Ratio
-        risk_free_rate = 0.02
-        sharpe_ratio = (annual_return - risk_free_rate) / annual_volatility if annual_volatility > 0 else 0
-        
-        # Max Drawdown
-        cumulative = (1 + returns).cumprod()
-        running_max = cumulative.cummax()
-        drawdown = (cumulative - running_max) / running_max
-        max_drawdown = drawdown.min()
-        
-        # Sortino Ratio
-        negative_returns = returns[returns < 0]
-        downside_deviation = negative_returns.std() * np.sqrt(252) if len(negative_returns) > 0 else 0
-        sortino_ratio = (annual_return - risk_free_rate) / downside_deviation if downside_deviation > 0 else 0
-        
-        # Calmar Ratio
-        calmar_ratio = annual_return / abs(max_drawdown) if max_drawdown != 0 else 0
-        
-        # VaR (Value at Risk) al 95%
-        var_95 = np.percentile(returns, 5)
-        
-        return {
-            "annual_return": round(annual_return, 4),
-            "annual_volatility": round(annual_volatility, 4),
-            "sharpe_ratio": round(sharpe_ratio, 4),
-            "sortino_ratio": round(sortino_ratio, 4),
-            "max_drawdown": round(max_drawdown, 4),
-            "calmar_ratio": round(calmar_ratio, 4),
-            "var_95": round(var_95, 4),
-            "total_return": round((1 + returns).prod() - 1, 4)
-        }
-    
-    def _create_interactive_plots(self, portfolio_cum, benchmark_cum, portfolio_returns, benchmark_returns):
-        """Crea grafici interattivi usando Plotly."""
-        
-        # 1. Performance Cumulativa
-        performance_fig = go.Figure()
-        performance_fig.add_trace(go.Scatter(
-            x=portfolio_cum.index,
-            y=portfolio_cum.values,
-            mode='lines',
-            name='Portfolio',
-            line=dict(color='blue', width=2),
-            hovertemplate='<b>Portfolio</b><br>Data: %{x}<br>Valore: $%{y:,.2f}<extra></extra>'
-        ))
-        performance_fig.add_trace(go.Scatter(
-            x=benchmark_cum.index,
-            y=benchmark_cum.values,
-            mode='lines',
-            name='Benchmark',
-            line=dict(color='orange', width=2),
-            hovertemplate='<b>Benchmark</b><br>Data: %{x}<br>Valore: $%{y:,.2f}<extra></extra>'
-        ))
-        performance_fig.update_layout(
-            title='Performance Cumulativa: Portfolio vs Benchmark',
-            xaxis_title='Data',
-            yaxis_title='Valore ($)',
-            template='plotly_white',
-            height=500
-        )
-        
-        # 2. Drawdown
-        portfolio_cum_norm = portfolio_cum / portfolio_cum.iloc[0]
-        running_max = portfolio_cum_norm.cummax()
-        drawdown = (portfolio_cum_norm - running_max) / running_max
-        
-        drawdown_fig = go.Figure()
-        drawdown_fig.add_trace(go.Scatter(
-            x=drawdown.index,
-            y=drawdown.values * 100,
-            mode='lines',
-            fill='tonexty',
-            name='Drawdown',
-            line=dict(color='red'),
-            fillcolor='rgba(255, 0, 0, 0.3)',
-            hovertemplate='<b>Drawdown</b><br>Data: %{x}<br>Drawdown: %{y:.2f}%<extra></extra>'
-        ))
-        drawdown_fig.update_layout(
-            title='Portfolio Drawdown',
-            xaxis_title='Data',
-            yaxis_title='Drawdown (%)',
-            template='plotly_white',
-            height=400
-        )
-        
-        # 3. Distribuzione Rendimenti
-        monthly_returns = portfolio_returns.resample('M').apply(lambda x: (1 + x).prod() - 1)
-        
-        distribution_fig = go.Figure()
-        distribution_fig.add_trace(go.Histogram(
-            x=monthly_returns.values * 100,
-            nbinsx=30,
-            name='Rendimenti Mensili',
-            marker_color='steelblue',
-            opacity=0.7,
-            hovertemplate='Rendimento: %{x:.2f}%<br>Frequenza: %{y}<extra></extra>'
-        ))
-        distribution_fig.add_vline(
-            x=monthly_returns.mean() * 100,
-            line_dash="dash",
-            line_color="red",
-            annotation_text=f"Media: {monthly_returns.mean()*100:.1f}%"
-        )
-        distribution_fig.update_layout(
-            title='Distribuzione Rendimenti Mensili',
-            xaxis_title='Rendimento (%)',
-            yaxis_title='Frequenza',
-            template='plotly_white',
-            height=400
-        )
-        
-        # 4. Asset Allocation Pie Chart
-        allocation_fig = go.Figure()
-        allocation_fig.add_trace(go.Pie(
-            labels=[etf.name for etf in self.etfs],
-            values=[etf.weight for etf in self.etfs],
-            name="Allocazione",
-            hovertemplate='<b>%{label}</b><br>Peso: %{percent}<br>TER: %{customdata:.2f}%<extra></extra>',
-            customdata=[etf.ter for etf in self.etfs]
-        ))
-        allocation_fig.update_layout(
-            title='Allocazione Portfolio',
-            template='plotly_white',
-            height=400
-        )
-        
-        return {
-            "performance": json.loads(plotly.utils.PlotlyJSONEncoder().encode(performance_fig)),
-            "drawdown": json.loads(plotly.utils.PlotlyJSONEncoder().encode(drawdown_fig)),
-            "distribution": json.loads(plotly.utils.PlotlyJSONEncoder().encode(distribution_fig)),
-            "allocation": json.loads(plotly.utils.PlotlyJSONEncoder().encode(allocation_fig))
-        }
+# Tempi per stadio nell'header Server-Timing e negli istogrammi di /api/metrics
+app.add_middleware(StageTimingMiddleware)
 
 
 # --- Endpoint API ---
@@ -308,74 +74,451 @@ async def health_check():
 @app.get("/api/tickers")
 async def get_available_tickers():
     """Restituisce i ticker disponibili organizzati per categoria."""
-    tickers = {
-        "US Equity ETFs": ["VTI", "VOO", "SPY", "QQQ", "VB", "VBR", "VUG", "VTV"],
-        "International Equity ETFs": ["VXUS", "VEA", "VWO", "EFA", "EEM", "IEFA", "IEMG"],
-        "Bond ETFs": ["BND", "VGIT", "VGLT", "TIP", "LQD", "HYG", "AGG", "GOVT"],
-        "Sector ETFs": ["XLK", "XLF", "XLV", "XLE", "XLI", "XLY", "XLP", "XLRE"],
-        "Global ETFs": ["VT", "ACWI", "FTIHX", "SWTSX"],
-        "Commodity ETFs": ["GLD", "SLV", "PDBC", "DBC", "USO"]
+    return {
+        "categories": TICKER_CATEGORIES,
+        "all_tickers": all_tickers()
     }
-    
-    all_tickers = []
-    for category_tickers in tickers.values():
-        all_tickers.extend(category_tickers)
-    
+
+
+@app.get("/api/ticker-info/{ticker}")
+def get_single_ticker_info(ticker: str, refresh: bool = False):
+    """
+    Metadati di un ticker (nome, TER in % annuo, valuta, data di nascita, categoria),
+    dalla cache in memoria, dall'archivio SQLite o dal provider.
+    """
+    info = get_ticker_info([ticker], refresh=refresh).get(ticker.strip().upper())
+    if info is None:
+        raise HTTPException(status_code=404, detail=f"Ticker '{ticker}' non trovato")
+    return info
+
+
+@app.post("/api/ticker-info")
+def get_bulk_ticker_info(payload: TickerInfoRequest):
+    """Metadati di più ticker in una sola richiesta; i ticker sconosciuti sono elencati in 'not_found'."""
+    if len(payload.tickers) > MAX_BULK_TICKERS:
+        raise HTTPException(status_code=400, detail=f"Massimo {MAX_BULK_TICKERS} ticker per richiesta")
+    try:
+        found = get_ticker_info(payload.tickers, refresh=payload.refresh)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Errore nel recupero dei metadati: {str(e)}")
+    requested = list(dict.fromkeys(t.strip().upper() for t in payload.tickers if t.strip()))
     return {
-        "categories": tickers,
-        "all_tickers": sorted(all_tickers)
+        "tickers": found,
+        "not_found": [t for t in requested if t not in found],
     }
 
 
 @app.post("/api/backtest")
-async def run_portfolio_backtest(payload: PortfolioPayload):
+async def run_portfolio_backtest(payload: PortfolioPayload, request: Request, profile: Optional[str] = None,
+                                 x_admin_token: Optional[str] = Header(None)):
     """
     Esegue il backtesting avanzato di un portafoglio con grafici interattivi.
+    
+    I grafici sono prodotti dal renderer in config.renderer (plotly-json, predefinito,
+    matplotlib-png, data o auto = il più rapido disponibile, vedi /api/renderers).
+    Con Accept: application/vnd.apache.arrow.stream o application/msgpack restituisce
+    le serie giornaliere in colonne binarie al posto dei grafici; Accept-Encoding
+    gzip/zstd comprime la risposta.
+    Con ?profile=cpu|mem (solo amministratori) il profilo è indicato nell'header X-Profile.
+    Le richieste costose (ticker x giorni) passano dal controllo di ammissione (429 se saturo).
     """
-    try:
+    profile_mode = profiling.check_profile_access(profile, x_admin_token)
+    media_type = negotiate_media_type(request.headers.get("accept"))
+    coding = negotiate_encoding(request.headers.get("accept-encoding"))
+    
+    def run_backtest():
         analyzer = AdvancedPortfolioAnalyzer(
             etfs=payload.etfs,
             benchmark=payload.benchmark,
             config=payload.config
         )
-        
-        results = analyzer.run_advanced_backtest()
-        return results
-        
+        with profiling.profile_request(profile_mode, "backtest") as session:
+            results = analyzer.run_advanced_backtest(include_plots=media_type == JSON)
+            # Serializzazione diretta (orjson / Arrow / msgpack), niente jsonable_encoder sui grafici
+            with stage("serialize"):
+                response = negotiated_response(results, media_type, coding, "series")
+        if session is not None:
+            response.headers["X-Profile"] = session.url
+        return response
+    
+    try:
+        return await admission.run(_portfolio_cost(payload), run_backtest)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Errore nel backtesting: {str(e)}")
 
 
+def _portfolio_cost(payload: PortfolioPayload) -> int:
+    """Costo stimato di un backtest per il controllo di ammissione (ticker x giorni di borsa)."""
+    tickers = [etf.name for etf in payload.etfs] + [b.name for b in payload.benchmark]
+    return backtest_cost(tickers, payload.config.start_date, payload.config.end_date)
+
+
+def _sse_event(event: str, data) -> bytes:
+    """Un evento Server-Sent Events con payload JSON (orjson, array NumPy inclusi)."""
+    return b"event: " + event.encode() + b"\ndata: " + orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS) + b"\n\n"
+
+
+def _iter_backtest_stream(analyzer: "AdvancedPortfolioAnalyzer"):
+    # Generatore sincrono: Starlette lo esegue nel threadpool, senza bloccare l'event loop
+    try:
+        for event, data in analyzer.iter_backtest_events():
+            yield _sse_event(event, data)
+    except Exception as e:
+        # Lo status 200 è già stato inviato: l'errore viaggia come evento
+        detail = e.detail if isinstance(e, HTTPException) else f"Errore nel backtesting: {str(e)}"
+        yield _sse_event("error", {"detail": detail})
+
+
+@app.post("/api/backtest/stream")
+async def stream_portfolio_backtest(payload: PortfolioPayload):
+    """
+    Variante progressiva di /api/backtest in formato text/event-stream.
+    
+    Eventi nell'ordine: 'data' (dati scaricati), 'metrics' (metriche, configurazione,
+    valori finali e allocazione, come in /api/backtest), un 'plot' per grafico
+    ({name, figure}) e infine 'done'; in caso di errore un evento 'error' con 'detail'.
+    Passa dal controllo di ammissione come /api/backtest: il budget resta occupato
+    per tutta la durata dello stream.
+    """
+    # Renderer e ammissione vanno risolti prima di iniziare lo stream (dopo lo status è già 200)
+    try:
+        renderers.resolve(payload.config.renderer)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    cost = _portfolio_cost(payload)
+    await admission.acquire(cost)
+    
+    try:
+        analyzer = AdvancedPortfolioAnalyzer(
+            etfs=payload.etfs,
+            benchmark=payload.benchmark,
+            config=payload.config
+        )
+    except BaseException:
+        admission.release(cost)
+        raise
+    return admission.stream(
+        cost,
+        _iter_backtest_stream(analyzer),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def _prepare_export(portfolios: List[PortfolioPayload]) -> list:
+    """
+    Scarica i prezzi di tutti i portafogli (una volta per ticker e intervallo di date) e
+    verifica che ognuno abbia dati prima dello stream: dopo il primo blocco lo status 200
+    non si può più cambiare e un errore lascerebbe un file troncato (Parquet senza footer).
+    """
+    shared = {}  # (inizio, fine) -> prezzi per ticker
+    prices = []
+    for i, portfolio in enumerate(portfolios, start=1):
+        analyzer = AdvancedPortfolioAnalyzer(etfs=portfolio.etfs, benchmark=portfolio.benchmark, config=portfolio.config)
+        key = (analyzer.analyzer.start_date, analyzer.analyzer.end_date)
+        try:
+            analyzer.preload_prices(shared.setdefault(key, {}))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"portfolio_{i}: {str(e)}")
+        prices.append(shared[key])
+    return prices
+
+
+def _iter_backtest_series(portfolios: List[PortfolioPayload], prices: list):
+    """Calcola le serie giornaliere un portafoglio alla volta (solo quello corrente resta in memoria)."""
+    for i, (portfolio, portfolio_prices) in enumerate(zip(portfolios, prices), start=1):
+        analyzer = AdvancedPortfolioAnalyzer(
+            etfs=portfolio.etfs,
+            benchmark=portfolio.benchmark,
+            config=portfolio.config,
+            prices=portfolio_prices
+        )
+        yield f"portfolio_{i}", analyzer.compute_daily_series()
+
+
+@app.post("/api/export")
+@app.post("/api/export-csv")
+async def export_backtest(payload: ExportPayload):
+    """
+    Esporta in streaming le serie giornaliere (valore, rendimenti, drawdown e pesi per asset)
+    di uno o più portafogli in CSV, Parquet o Arrow IPC, a blocchi di righe.
+    I dati di tutti i portafogli sono verificati prima di iniziare lo stream.
+    Il costo di tutti i portafogli passa dal controllo di ammissione e resta occupato
+    dal download fino alla fine dello stream.
+    """
+    try:
+        check_format(payload.format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    cost = sum(_portfolio_cost(portfolio) for portfolio in payload.portfolios)
+    await admission.acquire(cost)
+    
+    # Download e verifica dei dati prima della risposta: un ticker senza dati è un 400, non un file troncato
+    try:
+        try:
+            prices = await asyncio.to_thread(_prepare_export, payload.portfolios)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Errore nel caricamento dei dati per l'export: {str(e)}")
+    except BaseException:
+        admission.release(cost)
+        raise
+    
+    media_type, extension = EXPORT_FORMATS[payload.format]
+    columns = export_columns(etf.name for portfolio in payload.portfolios for etf in portfolio.etfs)
+    return admission.stream(
+        cost,
+        stream_export(_iter_backtest_series(payload.portfolios, prices), columns, payload.format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="backtest_export.{extension}"'}
+    )
+
+
+@app.get("/api/plots/{result_id}/{name}")
+async def get_plot(result_id: str, name: str):
+    """
+    Restituisce un grafico PNG della frontiera efficiente, generato al primo accesso
+    in un pool di processi e poi servito dalla cache (l'id è un hash del contenuto).
+    """
+    try:
+        png = await plot_store.render_plot(result_id, name)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Grafico non trovato o scaduto: rieseguire l'analisi")
+    return Response(
+        content=png,
+        media_type="image/png",
+        headers={"Cache-Control": "public, max-age=86400, immutable", "ETag": f'"{result_id}-{name}"'}
+    )
+
+
 @app.post("/api/efficient-frontier")
-async def efficient_frontier_analysis(payload: dict):
+async def efficient_frontier_analysis(payload: EfficientFrontierPayload, request: Request, profile: Optional[str] = None,
+                                      x_admin_token: Optional[str] = Header(None)):
     """
     Esegue l'analisi della frontiera efficiente per un insieme di ETF.
-    """
-    etfs_data = payload.get('etfs', payload) if isinstance(payload.get('etfs'), list) else payload
-    config_data = payload.get('config', {})
     
-    # Convert to EtfInput objects
-    etfs = [EtfInput(name=etf['name'], weight=etf['weight']) for etf in etfs_data if etf.get('name')]
+    Supporta la stessa negoziazione di /api/backtest: in Arrow i campioni
+    (plots=data) formano la tabella, il resto viaggia nei metadati dello schema.
+    Come /api/backtest accetta ?profile=cpu|mem per gli amministratori e passa dal
+    controllo di ammissione (costo: ticker x giorni + num_portfolios x ticker).
+    """
+    profile_mode = profiling.check_profile_access(profile, x_admin_token)
+    etfs = [etf for etf in payload.etfs if etf.name]
+    config = payload.config
     
     if len(etfs) < 2:
         raise HTTPException(status_code=400, detail="Sono necessari almeno 2 ETF per l'analisi della frontiera efficiente")
     
-    # Create config object with provided values or defaults
-    config = EfficientFrontierConfig(
-        start_date=config_data.get('start_date', '2010-01-01'),
-        end_date=config_data.get('end_date', datetime.now().strftime('%Y-%m-%d')),
-        num_portfolios=config_data.get('num_portfolios', 50000),
-        risk_free_rate=config_data.get('risk_free_rate', 0.02),
-        num_efficient_portfolios=config_data.get('num_efficient_portfolios', 3)
-    )
+    media_type = negotiate_media_type(request.headers.get("accept"))
+    coding = negotiate_encoding(request.headers.get("accept-encoding"))
+    encode = encode_float32 if media_type == JSON else as_float32
+    
+    def run_frontier():
+        with profiling.profile_request(profile_mode, "efficient-frontier") as session:
+            result = calculate_efficient_frontier(etfs, config, encode=encode)
+            with stage("serialize"):
+                response = negotiated_response(result, media_type, coding, "samples")
+        if session is not None:
+            response.headers["X-Profile"] = session.url
+        return response
     
     try:
-        result = calculate_efficient_frontier(etfs, config)
-        return result
+        cost = frontier_cost([etf.name for etf in etfs], config.start_date, config.end_date, config.num_portfolios)
+        return await admission.run(cost, run_frontier)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Errore nell'analisi della frontiera efficiente: {str(e)}")
 
 
+
+@app.post("/api/allocation/risk-parity")
+async def risk_parity_allocation(payload: AllocationPayload):
+    """
+    Calcola l'allocazione a contributo di rischio uguale (o con budget di rischio).
+    I pesi restituiti in 'etfs' possono essere inviati direttamente a /api/backtest.
+    """
+    try:
+        return calculate_risk_parity(payload.etfs, payload.config)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Errore nell'allocazione risk parity: {str(e)}")
+
+
+@app.post("/api/allocation/min-cvar")
+async def min_cvar_allocation(payload: AllocationPayload):
+    """
+    Calcola l'allocazione a CVaR minimo rispettando i vincoli di peso e di gruppo.
+    I pesi restituiti in 'etfs' possono essere inviati direttamente a /api/backtest.
+    """
+    try:
+        return calculate_min_cvar(payload.etfs, payload.config)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Errore nell'allocazione min-CVaR: {str(e)}")
+
+
+@app.post("/api/correlation")
+async def correlation_analysis(payload: CorrelationRequest):
+    """
+    Restituisce le matrici di correlazione (periodo intero e mobili) per un insieme di ticker,
+    come array float32 codificati in base64, opzionalmente in ordine di clustering gerarchico.
+    """
+    try:
+        return calculate_correlation(payload)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Errore nell'analisi di correlazione: {str(e)}")
+
+@app.get("/api/stress-test/scenarios")
+async def get_stress_scenarios():
+    """Catalogo degli scenari di crisi disponibili per /api/stress-test."""
+    return {"scenarios": list(SCENARIO_CATALOG.values())}
+
+
+@app.post("/api/stress-test")
+async def stress_test_analysis(payload: StressTestPayload):
+    """
+    Valuta tutti i portafogli su tutti gli scenari di crisi richiesti (catalogo e personalizzati)
+    in un solo passaggio sullo stesso pannello di prezzi: perdita, max drawdown e tempo di recupero.
+    """
+    try:
+        scenarios = resolve_scenarios(payload)
+        start_date, end_date = data_range(payload, scenarios)
+        tickers = [etf.name for portfolio in payload.portfolios for etf in portfolio.etfs]
+        cost = stress_cost(tickers, start_date, end_date, len(payload.portfolios), len(scenarios))
+        return await admission.run(cost, lambda: run_stress_test(payload))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Errore nello stress test: {str(e)}")
+
+
+@app.post("/api/portfolios")
+async def save_portfolio(request: SavePortfolioRequest):
+    """
+    Salva (o aggiorna, per nome) un portafoglio. Con compute=true i risultati sono calcolati
+    subito, altrimenti dal prossimo job notturno; le letture successive non rieseguono il backtest.
+    Import di SQLAlchemy, creazione delle tabelle e query avvengono fuori dall'event loop.
+    """
+    def save() -> int:
+        import portfolio_store  # SQLAlchemy caricato al primo utilizzo (import lento)
+        return portfolio_store.save_portfolio(request.name, request.portfolio)
+
+    try:
+        portfolio_id = await asyncio.to_thread(save)
+        import portfolio_store  # Già caricato da save()
+        if request.compute:
+            await admission.run(_portfolio_cost(request.portfolio),
+                                lambda: portfolio_store.compute_saved_portfolio(portfolio_id))
+        return await asyncio.to_thread(portfolio_store.get_saved_portfolio, portfolio_id, False)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Errore nel salvataggio del portafoglio: {str(e)}")
+
+
+@app.get("/api/portfolios")
+def list_saved_portfolios():
+    """Portafogli salvati con le metriche precalcolate sul periodo intero."""
+    import portfolio_store
+    return {"portfolios": portfolio_store.list_portfolios()}
+
+
+@app.get("/api/portfolios/leaderboard")
+def portfolio_leaderboard(metric: str = "sharpe_ratio", horizon: str = "10y", limit: int = 10):
+    """Classifica dei portafogli salvati per metrica e orizzonte (es. Sharpe migliore a 10 anni)."""
+    import portfolio_store
+    return {"metric": metric, "horizon": horizon,
+            "portfolios": portfolio_store.leaderboard(metric, horizon, limit)}
+
+
+@app.post("/api/portfolios/refresh")
+async def refresh_saved_portfolios(force: bool = False, x_admin_token: Optional[str] = Header(None)):
+    """Esegue subito l'aggiornamento del job notturno (solo amministratori)."""
+    profiling.check_admin(x_admin_token)
+    import portfolio_store
+    try:
+        return await asyncio.to_thread(portfolio_store.refresh_all, force)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Errore nell'aggiornamento dei portafogli: {str(e)}")
+
+
+@app.get("/api/portfolios/{portfolio_id}")
+def get_saved_portfolio(portfolio_id: int, include_equity: bool = True,
+                        max_points: Optional[int] = Query(None, ge=3)):
+    """Portafoglio salvato: payload, metriche per orizzonte e curva del valore (lettura, nessun calcolo)."""
+    import portfolio_store
+    return portfolio_store.get_saved_portfolio(portfolio_id, include_equity, max_points)
+
+
+@app.delete("/api/portfolios/{portfolio_id}")
+def delete_saved_portfolio(portfolio_id: int, x_admin_token: Optional[str] = Header(None)):
+    """Elimina un portafoglio salvato con metriche e curva (solo amministratori)."""
+    profiling.check_admin(x_admin_token)
+    import portfolio_store
+    portfolio_store.delete_portfolio(portfolio_id)
+    return {"deleted": portfolio_id}
+
+
+@app.get("/api/renderers")
+async def get_renderers():
+    """Renderer dei grafici del backtest: disponibilità, tempi medi misurati e scelta di 'auto'."""
+    return renderers.renderer_stats()
+
+
+@app.get("/api/profiles/{profile_id}")
+async def get_profile(profile_id: str, format: str = "json", x_admin_token: Optional[str] = Header(None)):
+    """
+    Profilo salvato da ?profile=cpu|mem: riepilogo JSON (stadi, funzioni o allocazioni
+    principali) oppure, con format=collapsed, gli stack per flamegraph.pl / speedscope.
+    """
+    profiling.check_admin(x_admin_token)
+    try:
+        path = profiling.profile_path(profile_id, format)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Profilo non trovato")
+    media_type = "application/json" if format == "json" else "text/plain; charset=utf-8"
+    return FileResponse(path, media_type=media_type, filename=os.path.basename(path))
+
+
+@app.get("/api/metrics")
+async def get_metrics():
+    """
+    Metriche in formato Prometheus: istogrammi delle durate per stadio e per route,
+    hit/miss e hit ratio delle cache (prezzi, rendimenti, metadati, PNG).
+    """
+    if not stage_metrics.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metriche disattivate (METRICS_ENABLED=0)")
+    return Response(content=stage_metrics.render_prometheus(), media_type=stage_metrics.PROMETHEUS_CONTENT_TYPE)
+
+
+@app.on_event("startup")
+def detect_plot_backends():
+    renderers.detect_backends()
+
+
+@app.on_event("startup")
+async def start_background_jobs():
+    nightly_refresh.start()
+
+
+@app.on_event("shutdown")
+def shutdown_workers():
+    plot_store.shutdown()
+    admission.shutdown()
+    nightly_refresh.stop()
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
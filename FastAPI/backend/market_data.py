@@ -0,0 +1,94 @@
+from functools import lru_cache
+from typing import List, Tuple
+
+import pandas as pd
+
+from stage_metrics import lru_cache_collector, register_cache_collector
+
+
+# Numero di pannelli (universo + intervallo di date) tenuti in memoria
+PRICE_CACHE_SIZE = 32
+
+# Frequenze dei rendimenti: regola di resampling pandas e periodi per anno
+RETURN_FREQUENCIES = {
+    'daily': (None, 252),
+    'weekly': ('W-FRI', 52),
+    'monthly': ('ME', 12),
+}
+
+
+def _cache_key(tickers: List[str]) -> Tuple[str, ...]:
+    return tuple(sorted(set(tickers)))
+
+
+@lru_cache(maxsize=PRICE_CACHE_SIZE)
+def _download_price_panel(tickers: Tuple[str, ...], start_date: str, end_date: str) -> pd.DataFrame:
+    import yfinance as yf  # caricato al primo download (import lento)
+
+    data = yf.download(list(tickers), start=start_date, end=end_date, progress=False)
+    if data.empty:
+        raise ValueError("No data downloaded. Check tickers.")
+
+    # Handle both single and multiple ticker cases
+    if len(tickers) == 1:
+        close = data[['Close']]
+        close.columns = [tickers[0]]
+    else:
+        close = data['Close']
+    return close.dropna(how='all')
+
+
+def load_price_panel(tickers: List[str], start_date: str, end_date: str) -> pd.DataFrame:
+    """
+    Return the daily close panel (dates x tickers) for a universe.
+
+    Panels are cached per universe and date range, so repeated frontier and
+    allocation requests on the same tickers hit Yahoo Finance once. The
+    returned frame is shared: callers must not modify it in place.
+    """
+    return _download_price_panel(_cache_key(tickers), start_date, end_date)
+
+
+def periods_per_year(frequency: str) -> int:
+    """Annualization factor for a return frequency ('daily', 'weekly' or 'monthly')."""
+    if frequency not in RETURN_FREQUENCIES:
+        raise ValueError(f"Unsupported return frequency '{frequency}'. Use one of: {', '.join(RETURN_FREQUENCIES)}")
+    return RETURN_FREQUENCIES[frequency][1]
+
+
+@lru_cache(maxsize=PRICE_CACHE_SIZE)
+def _resampled_panel(tickers: Tuple[str, ...], start_date: str, end_date: str, frequency: str) -> pd.DataFrame:
+    panel = _download_price_panel(tickers, start_date, end_date)
+    rule = RETURN_FREQUENCIES[frequency][0]
+    if rule is None:
+        return panel
+    # Ultimo prezzo disponibile di ogni periodo
+    return panel.resample(rule).last().dropna(how='all')
+
+
+@lru_cache(maxsize=PRICE_CACHE_SIZE)
+def _return_matrix(tickers: Tuple[str, ...], start_date: str, end_date: str, frequency: str) -> pd.DataFrame:
+    return _resampled_panel(tickers, start_date, end_date, frequency).pct_change().dropna()
+
+
+def load_return_matrix(tickers: List[str], start_date: str, end_date: str,
+                       frequency: str = 'daily') -> pd.DataFrame:
+    """
+    Return the cached matrix of simple returns for a universe (read-only).
+
+    frequency selects daily, weekly (Friday close) or monthly (month-end
+    close) returns; annualize them with periods_per_year(frequency).
+    """
+    periods_per_year(frequency)
+    return _return_matrix(_cache_key(tickers), start_date, end_date, frequency)
+
+
+def clear_cache():
+    """Svuota le cache dei prezzi e dei rendimenti."""
+    _download_price_panel.cache_clear()
+    _resampled_panel.cache_clear()
+    _return_matrix.cache_clear()
+
+
+register_cache_collector('price_panel', lru_cache_collector(_download_price_panel))
+register_cache_collector('return_matrix', lru_cache_collector(_return_matrix))
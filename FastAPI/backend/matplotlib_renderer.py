@@ -0,0 +1,103 @@
+"""
+Grafici del backtest come PNG matplotlib in base64 (per ambienti senza Plotly).
+
+I grafici sono prodotti nei thread delle richieste, quindi senza pyplot (stato
+globale non thread-safe): ogni figura è una Figure con il proprio canvas Agg.
+matplotlib viene importato al primo grafico.
+"""
+import base64
+import io
+
+import numpy as np
+
+
+def _figure(figsize):
+    """Nuova figura con canvas Agg, indipendente da pyplot e dalle altre richieste."""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def _fig_to_base64(fig) -> str:
+    """Converte una figura matplotlib in stringa base64."""
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', dpi=150, bbox_inches='tight')
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+def performance_plot(analyzer, performance) -> str:
+    """1. Performance Cumulativa"""
+    portfolio_cum, benchmark_cum = performance.portfolio_cumulative, performance.benchmark_cumulative
+
+    fig1 = _figure((12, 8))
+    ax1 = fig1.subplots()
+    ax1.plot(portfolio_cum.index, portfolio_cum.values, label='Portfolio', color='blue', linewidth=2)
+    ax1.plot(benchmark_cum.index, benchmark_cum.values, label='Benchmark', color='orange', linewidth=2)
+    ax1.set_title('Performance Cumulativa: Portfolio vs Benchmark', fontsize=16)
+    ax1.set_xlabel('Data', fontsize=12)
+    ax1.set_ylabel('Valore ($)', fontsize=12)
+    ax1.legend()
+    ax1.grid(True, alpha=0.3)
+    fig1.tight_layout()
+    return _fig_to_base64(fig1)
+
+
+def drawdown_plot(analyzer, performance) -> str:
+    """2. Drawdown"""
+    drawdown = performance.portfolio_drawdown()
+
+    fig2 = _figure((12, 6))
+    ax2 = fig2.subplots()
+    ax2.fill_between(drawdown.index, drawdown.values * 100, 0, alpha=0.3, color='red')
+    ax2.plot(drawdown.index, drawdown.values * 100, color='darkred', linewidth=1)
+    ax2.set_title('Portfolio Drawdown', fontsize=16)
+    ax2.set_xlabel('Data', fontsize=12)
+    ax2.set_ylabel('Drawdown (%)', fontsize=12)
+    ax2.grid(True, alpha=0.3)
+    fig2.tight_layout()
+    return _fig_to_base64(fig2)
+
+
+def distribution_plot(analyzer, performance) -> str:
+    """3. Distribuzione Rendimenti"""
+    monthly_returns = performance.monthly_returns()
+
+    fig3 = _figure((10, 6))
+    ax3 = fig3.subplots()
+    ax3.hist(monthly_returns * 100, bins=30, alpha=0.7, color='steelblue', edgecolor='black')
+    ax3.axvline(monthly_returns.mean() * 100, color='red', linestyle='--', linewidth=2,
+                label=f'Media: {monthly_returns.mean()*100:.1f}%')
+    ax3.set_title('Distribuzione Rendimenti Mensili', fontsize=16)
+    ax3.set_xlabel('Rendimento (%)', fontsize=12)
+    ax3.set_ylabel('Frequenza', fontsize=12)
+    ax3.legend()
+    ax3.grid(True, alpha=0.3)
+    fig3.tight_layout()
+    return _fig_to_base64(fig3)
+
+
+def allocation_plot(analyzer, performance) -> str:
+    """4. Asset Allocation Pie Chart"""
+    from matplotlib import colormaps
+
+    labels = [etf.name for etf in analyzer.etfs]
+    sizes = [etf.weight for etf in analyzer.etfs]
+    colors = colormaps['Set3'](np.linspace(0, 1, len(labels)))
+
+    fig4 = _figure((8, 8))
+    ax4 = fig4.subplots()
+    ax4.pie(sizes, labels=labels, autopct='%1.1f%%', startangle=90, colors=colors)
+    ax4.set_title('Allocazione Portfolio', fontsize=16)
+    fig4.tight_layout()
+    return _fig_to_base64(fig4)
+
+
+MATPLOTLIB_PLOTS = {
+    "performance": performance_plot,
+    "drawdown": drawdown_plot,
+    "distribution": distribution_plot,
+    "allocation": allocation_plot,
+}
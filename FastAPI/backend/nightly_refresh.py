@@ -0,0 +1,64 @@
+"""
+Job notturno dei portafogli salvati: ogni giorno, dopo la chiusura del mercato,
+esegue portfolio_store.refresh_all() in un thread.
+
+Modulo leggero (nessun import di SQLAlchemy all'avvio): portfolio_store viene
+caricato solo quando il job parte.
+"""
+import asyncio
+import os
+from datetime import date, datetime, time as dt_time, timedelta, timezone
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+
+# Job attivo di default, eseguito ogni giorno a quest'ora (HH:MM) nel fuso del mercato
+NIGHTLY_REFRESH = os.environ.get('NIGHTLY_REFRESH', '1') != '0'
+NIGHTLY_REFRESH_TIME = os.environ.get('NIGHTLY_REFRESH_TIME', '17:30')
+MARKET_TIMEZONE = ZoneInfo('America/New_York')
+MARKET_CLOSE = dt_time(16, 0)
+
+_task: Optional[asyncio.Task] = None
+
+
+def last_market_close(now: Optional[datetime] = None) -> date:
+    """Ultima seduta chiusa (giorni feriali; dopo le 16:00 di New York conta anche oggi)."""
+    now = (now or datetime.now(timezone.utc)).astimezone(MARKET_TIMEZONE)
+    day = now.date() if now.time() >= MARKET_CLOSE else now.date() - timedelta(days=1)
+    while day.weekday() >= 5:
+        day -= timedelta(days=1)
+    return day
+
+
+def seconds_until_next_run(now: Optional[datetime] = None) -> float:
+    now = (now or datetime.now(timezone.utc)).astimezone(MARKET_TIMEZONE)
+    hour, minute = (int(part) for part in NIGHTLY_REFRESH_TIME.split(':'))
+    run = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if run <= now:
+        run += timedelta(days=1)
+    return (run - now).total_seconds()
+
+
+async def _nightly_loop():
+    while True:
+        await asyncio.sleep(seconds_until_next_run())
+        try:
+            import portfolio_store  # SQLAlchemy caricato solo qui (import lento)
+            summary = await asyncio.to_thread(portfolio_store.refresh_all)
+            print(f"Aggiornamento notturno dei portafogli: {summary}")
+        except Exception as e:
+            print(f"Aggiornamento notturno dei portafogli non riuscito: {e}")
+
+
+def start():
+    """Avvia il job nell'event loop corrente (se NIGHTLY_REFRESH non è 0)."""
+    global _task
+    if NIGHTLY_REFRESH and _task is None:
+        _task = asyncio.get_running_loop().create_task(_nightly_loop())
+
+
+def stop():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        _task = None
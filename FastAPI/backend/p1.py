@@ -1,10 +1,11 @@
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import yfinance as yf
 from datetime import datetime
 from typing import Dict, List, Tuple, Optional
 
+import fx
+import trading_calendar
+
 class PortfolioAnalyzer:
     """
     Una classe per scaricare i dati finanziari, costruire un portafoglio ETF
@@ -20,7 +21,8 @@ class PortfolioAnalyzer:
                  start_date: datetime,
                  end_date: datetime = datetime.now(),
                  my_etf_label: str = "ETF Portfolio",
-                 benchmark_label: str = "Benchmark"):
+                 benchmark_label: str = "Benchmark",
+                 base_currency: Optional[str] = None):
         """
         Inizializza l'analizzatore di portafoglio con i parametri di configurazione forniti dall'utente.
 
@@ -30,6 +32,7 @@ class PortfolioAnalyzer:
         :param end_date: Data di fine per il download dei dati.
         :param my_etf_label: Etichetta da usare per il portafoglio.
         :param benchmark_label: Etichetta da usare per il benchmark.
+        :param base_currency: Valuta in cui convertire tutti i prezzi (es. 'EUR'); None = nessuna conversione.
         """
         # I parametri etf_tickers e benchmark_tickers sono ora obbligatori al momento della creazione
         # della classe (rimosso il default nel metodo per enfasi)
@@ -39,23 +42,31 @@ class PortfolioAnalyzer:
         self.end_date = end_date
         self.my_etf_label = my_etf_label
         self.benchmark_label = benchmark_label
+        self.base_currency = base_currency
 
         # ... (il resto dell'inizializzazione rimane invariato)
-        self.individual_assets: Dict[str, pd.Series] = {}
-        self.etf_data: Dict[str, pd.Series] = {}
-        self.benchmark_data: Dict[str, pd.Series] = {}
-        self.my_etf_combined: Optional[pd.DataFrame] = None
-        self.benchmark_combined: Optional[pd.DataFrame] = None
+        # Pannello allineato dei prezzi non pesati (date x ticker, NaN prima del primo prezzo di un ticker).
+        # Prima le colonne del portafoglio, poi quelle del benchmark (un ticker presente in
+        # entrambi compare due volte): ogni gruppo è così una vista contigua del pannello.
+        self.price_index: Optional[pd.DatetimeIndex] = None
+        self.prices: Optional[np.ndarray] = None
+        self.etf_columns: List[str] = []
+        self.benchmark_columns: List[str] = []
+        self._etf_span: Optional[Tuple[pd.Timestamp, pd.Timestamp]] = None
+        self._benchmark_span: Optional[Tuple[pd.Timestamp, pd.Timestamp]] = None
+        # Righe del pannello usate dal portafoglio dopo calculate_portfolio(): (inizio, fine, righe valide)
+        self._etf_window: Optional[Tuple[int, int, object]] = None
         self.my_etf_filtered: Optional[pd.DataFrame] = None
         self.benchmark_filtered: Optional[pd.DataFrame] = None
-        self.normalized_assets: Dict[str, pd.Series] = {}
         self.common_start: Optional[datetime] = None
         self.common_end: Optional[datetime] = None
 
-    def _download_and_weight_data(self, tickers_weights: Dict[str, float], is_etf_portfolio: bool = False) -> Dict[str, pd.Series]:
-        """Funzione interna per scaricare e pesare i dati."""
+    def _download_prices(self, tickers: List[str]) -> Dict[str, pd.Series]:
+        """Funzione interna per scaricare i prezzi di chiusura (non pesati) di ogni ticker."""
+        import yfinance as yf  # caricato al primo download (import lento)
+        
         data_store = {}
-        for ticker, weight in tickers_weights.items():
+        for ticker in tickers:
             print(f"  Downloading {ticker}...")
             # progress=False per output pulito, usa .date() per yf.download
             # Nota: yfinance può dare problemi con gli oggetti datetime.datetime, 
@@ -75,12 +86,7 @@ class PortfolioAnalyzer:
                 if isinstance(prices, pd.DataFrame):
                     prices = prices.squeeze()
                 
-                # Memorizza i prezzi pesati
-                data_store[ticker] = prices * weight
-                
-                # Se è il portafoglio ETF, memorizza i prezzi non pesati per l'analisi individuale
-                if is_etf_portfolio:
-                    self.individual_assets[ticker] = prices
+                data_store[ticker] = prices
         return data_store
 
     def download_data(self):
@@ -94,64 +100,174 @@ class PortfolioAnalyzer:
              print(f"Warning: ETF weights sum to {sum(self.etf_tickers.values()):.2f}, not 1.0. Proceeding anyway.")
 
 
+        # Un ticker presente sia nel portafoglio sia nel benchmark viene scaricato una volta sola
         print("Downloading ETF data...")
-        self.etf_data = self._download_and_weight_data(self.etf_tickers, is_etf_portfolio=True)
+        prices = self._download_prices(list(self.etf_tickers))
         
         print("Downloading benchmark data...")
-        self.benchmark_data = self._download_and_weight_data(self.benchmark_tickers)
-        
-        # Combina i dati pesati in un DataFrame
-        self.my_etf_combined = pd.DataFrame(self.etf_data)
-        self.benchmark_combined = pd.DataFrame(self.benchmark_data)
+        prices.update(self._download_prices([t for t in self.benchmark_tickers if t not in prices]))
         
-        if self.my_etf_combined.empty or self.benchmark_combined.empty:
+        self.load_prices(prices)
+
+    def load_prices(self, prices):
+        """
+        Costruisce il pannello allineato dai prezzi di chiusura non pesati
+        (dizionario ticker -> Series, o DataFrame con un ticker per colonna).
+
+        I ticker senza dati vengono ignorati. È il punto d'ingresso anche per prezzi
+        già disponibili (cache, file, dati sintetici dei benchmark) senza download.
+
+        Le date sono allineate sull'indice comune dei giorni di borsa dell'universo
+        (trading_calendar.py): nei giorni in cui la borsa di un ticker è chiusa vale il
+        suo ultimo prezzo, invece di un buco che la somma pesata conterebbe come zero.
+        """
+        series, values = {}, {}
+        for ticker in dict.fromkeys([*self.etf_tickers, *self.benchmark_tickers]):
+            if ticker in prices:
+                data = prices[ticker]
+                close = data.to_numpy(dtype=np.float64)
+                # Giorni senza prezzo (o colonne di un DataFrame con calendari diversi): fuori dal calendario
+                missing = np.isnan(close)
+                if missing.any():
+                    data, close = data[~missing], close[~missing]
+                if len(close):
+                    series[ticker], values[ticker] = data, close
+        self.etf_columns = [t for t in self.etf_tickers if t in series]
+        self.benchmark_columns = [t for t in self.benchmark_tickers if t in series]
+        if not (self.etf_columns and self.benchmark_columns):
             raise ValueError("Impossibile scaricare dati sufficienti per il portafoglio o il benchmark.")
 
-    # I metodi calculate_portfolio(), plot_analysis(), e get_summary_statistics() rimangono invariati
-    # rispetto alla versione precedente, in quanto già incapsulano correttamente la logica.
-    
+        # Indice comune e posizioni di ogni ticker, in cache per universo e calendari
+        alignment = trading_calendar.align({t: data.index for t, data in series.items()})
+        index = alignment.index
+
+        # Una sola allocazione, per colonne (order='F'): ogni serie viene copiata in un blocco contiguo
+        columns = self.etf_columns + self.benchmark_columns
+        panel = np.empty((len(index), len(columns)), order='F')
+        for j, ticker in enumerate(columns):
+            panel[:, j] = alignment.take(ticker, values[ticker])
+        self.price_index, self.prices = index, panel
+
+        # Primo e ultimo giorno di ciascun gruppo (l'unione delle date dei suoi ticker)
+        span = lambda tickers: (min(series[t].index.min() for t in tickers), max(series[t].index.max() for t in tickers))
+        self._etf_span = span(self.etf_columns)
+        self._benchmark_span = span(self.benchmark_columns)
+        if self.base_currency:
+            self._convert_currency(columns, prices)
+
+    def _convert_currency(self, columns: List[str], prices):
+        """
+        Converte il pannello nella valuta di base dopo l'allineamento: i cambi delle
+        valute presenti (date x valute) vengono indicizzati per colonna e applicati con
+        una sola moltiplicazione. I cambi già presenti in prices non vengono scaricati.
+        """
+        currencies = fx.ticker_currencies(columns)
+        foreign = sorted({currencies[t] for t in columns if fx.fx_symbol(currencies[t], self.base_currency)})
+        if not foreign:
+            return
+        rates, available_from = fx.conversion_rates(foreign, self.base_currency, self.price_index, prices)
+        # Ultima colonna di 1 per i ticker già nella valuta di base
+        rates = np.column_stack([rates, np.ones(len(rates))])
+        codes = [foreign.index(currencies[t]) if currencies[t] in foreign else len(foreign) for t in columns]
+        self.prices *= rates[:, codes]
+
+        # Prima del primo cambio disponibile i prezzi convertiti sono NaN: l'intervallo comune parte da lì
+        self._etf_span = (max(self._etf_span[0], available_from), self._etf_span[1])
+        self._benchmark_span = (max(self._benchmark_span[0], available_from), self._benchmark_span[1])
+
+    @staticmethod
+    def _weighted_sum(block: np.ndarray, weights: np.ndarray):
+        """
+        Valore pesato di un gruppo di colonne: (righe, valori).
+
+        Caso tipico (nessun NaN): un solo prodotto matrice-vettore sulla vista del
+        pannello, righe = tutte. I NaN restano solo prima del primo prezzo di un ticker
+        (es. un ETF nato dopo gli altri del gruppo): valgono 0 e vengono tenuti solo i
+        giorni in cui almeno un ticker del gruppo ha un prezzo.
+        """
+        values = block @ weights
+        if not np.isnan(values).any():
+            return slice(None), values
+        missing = np.isnan(block)
+        rows = ~missing.all(axis=1)
+        return rows, np.where(missing, 0.0, block)[rows] @ weights
+
+    def etf_prices(self) -> Tuple[np.ndarray, pd.DatetimeIndex]:
+        """Prezzi non pesati degli ETF nei giorni del portafoglio (vista, se nessun ETF nasce dopo l'inizio)."""
+        start, end, rows = self._etf_window
+        return self.prices[start:end, :len(self.etf_columns)][rows], self.price_index[start:end][rows]
+
+    def common_range(self) -> Tuple[pd.Timestamp, pd.Timestamp]:
+        """Primo e ultimo giorno in comune tra portafoglio e benchmark (disponibile dopo il caricamento)."""
+        return max(self._etf_span[0], self._benchmark_span[0]), min(self._etf_span[1], self._benchmark_span[1])
+
     def calculate_portfolio(self):
         """Calcola il portafoglio combinato, il benchmark e normalizza i dati."""
-        if self.my_etf_combined is None or self.benchmark_combined is None:
+        if self.prices is None:
             raise RuntimeError("Dati non ancora scaricati. Chiamare prima download_data().")
 
-        # Trova l'intervallo di date comune
-        # Assicurati che gli indici siano di tipo datetime. In genere yf.download lo fa.
-        try:
-            self.common_start = max(self.my_etf_combined.index.min(), self.benchmark_combined.index.min())
-            self.common_end = min(self.my_etf_combined.index.max(), self.benchmark_combined.index.max())
-        except AttributeError:
-             raise RuntimeError("Gli indici dei DataFrame non sono del tipo atteso (DatetimeIndex).")
+        # Intervallo di date comune, poi una sola fetta del pannello (ricerca binaria sull'indice ordinato)
+        self.common_start, self.common_end = self.common_range()
+        start = self.price_index.searchsorted(self.common_start, side='left')
+        end = self.price_index.searchsorted(self.common_end, side='right')
+        if start >= end:
+            raise ValueError("Portafoglio e benchmark non hanno date in comune.")
+        window = self.prices[start:end]
+        dates = self.price_index[start:end]
+        n_etfs = len(self.etf_columns)
 
+        # Pesi applicati con un prodotto per gruppo, normalizzazione sul primo valore
+        etf_weights = np.array([self.etf_tickers[t] for t in self.etf_columns])
+        benchmark_weights = np.array([self.benchmark_tickers[t] for t in self.benchmark_columns])
+        etf_rows, portfolio = self._weighted_sum(window[:, :n_etfs], etf_weights)
+        benchmark_rows, benchmark = self._weighted_sum(window[:, n_etfs:], benchmark_weights)
+        self._etf_window = (start, end, etf_rows)
 
-        # Filtra sull'intervallo comune e crea COPIE per l'elaborazione
-        self.my_etf_filtered = self.my_etf_combined[(self.my_etf_combined.index >= self.common_start) &
-                                                   (self.my_etf_combined.index <= self.common_end)].copy()
-        self.benchmark_filtered = self.benchmark_combined[(self.benchmark_combined.index >= self.common_start) &
-                                                         (self.benchmark_combined.index <= self.common_end)].copy()
+        self.my_etf_filtered = pd.DataFrame({'Portfolio': portfolio, 'Normalized': portfolio / portfolio[0]},
+                                            index=dates[etf_rows])
+        self.benchmark_filtered = pd.DataFrame({'Benchmark': benchmark, 'Normalized': benchmark / benchmark[0]},
+                                               index=dates[benchmark_rows])
 
-        # Somma i componenti pesati
-        self.my_etf_filtered['Portfolio'] = self.my_etf_filtered.sum(axis=1)
-        self.benchmark_filtered['Benchmark'] = self.benchmark_filtered.sum(axis=1)
+    @property
+    def normalized_assets(self) -> Dict[str, pd.Series]:
+        """
+        Prezzi dei singoli ETF normalizzati a 1 sul loro primo valore nell'intervallo comune
+        (una divisione sull'intero blocco; NaN prima del primo prezzo di un ETF).
+        """
+        if self._etf_window is None:
+            return {}
+        block, dates = self.etf_prices()
+        first = block[0]
+        if np.isnan(first).any():
+            # ETF nati dopo l'inizio comune: primo valore disponibile di ogni colonna
+            first = block[np.isnan(block).argmin(axis=0), np.arange(block.shape[1])]
+        normalized = pd.DataFrame(block / first, index=dates, columns=self.etf_columns)
 
-        # Normalizza (Portfolio e Benchmark)
-        self.my_etf_filtered['Normalized'] = self.my_etf_filtered['Portfolio'] / self.my_etf_filtered['Portfolio'].iloc[0]
-        self.benchmark_filtered['Normalized'] = self.benchmark_filtered['Benchmark'] / self.benchmark_filtered['Benchmark'].iloc[0]
-        
-        # Normalizza gli asset individuali (non pesati)
-        for ticker, data in self.individual_assets.items():
-            asset_filtered = data[(data.index >= self.common_start) & (data.index <= self.common_end)]
+        assets = {}
+        for ticker, value in zip(self.etf_columns, first):
             # Ignora l'asset se il primo valore è NaN o 0
-            if asset_filtered.iloc[0] != 0 and not pd.isna(asset_filtered.iloc[0]):
-                self.normalized_assets[ticker] = asset_filtered / asset_filtered.iloc[0]
+            if value != 0 and not np.isnan(value):
+                assets[ticker] = normalized[ticker]
             else:
                 print(f"Warning: First value for {ticker} is non-positive or NaN, skipping normalization.")
+        return assets
 
+    def asset_weights(self) -> pd.DataFrame:
+        """Peso corrente di ogni ETF nel portafoglio (valore pesato sul totale) nei giorni del portafoglio."""
+        if self._etf_window is None:
+            raise RuntimeError("L'analisi non è stata ancora eseguita. Chiamare prima calculate_portfolio().")
+        block, dates = self.etf_prices()
+        weights = np.array([self.etf_tickers[t] for t in self.etf_columns])
+        portfolio = self.my_etf_filtered['Portfolio'].to_numpy()
+        return pd.DataFrame(block * weights / portfolio[:, None], index=dates, columns=self.etf_columns)
 
     def plot_analysis(self):
         """Genera e mostra i 3 grafici (Normalized vs Benchmark, Pie Chart, Individual Assets)."""
         if self.my_etf_filtered is None or self.benchmark_filtered is None or self.common_start is None:
             raise RuntimeError("L'analisi non è stata ancora eseguita. Chiamare prima calculate_portfolio().")
+        
+        # Solo per uso locale: pyplot viene importato qui per non pesare sull'avvio dell'API
+        import matplotlib.pyplot as plt
             
         fig = plt.figure(figsize=(20, 16))
         gs = fig.add_gridspec(2, 2)
@@ -245,7 +361,8 @@ if __name__ == "__main__":
     analyzer = PortfolioAnalyzer(
         etf_tickers=etf_cfg_utente,
         benchmark_tickers=benchmark_cfg_utente,
-        start_date=start_dt_utente
+        start_date=start_dt_utente,
+        base_currency='EUR'  # SWDA.MI quota in EUR, AGG, VT e GOVT in USD
     )
 
     # 2. Esecuzione dei Metodi
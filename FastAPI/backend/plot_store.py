@@ -0,0 +1,137 @@
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from stage_metrics import count_cache, stage
+
+
+# Sorgenti dei grafici (dati necessari al rendering) e PNG già generati
+PLOT_STORE_SIZE = 64
+PLOT_STORE_MAX_BYTES = 256 * 2**20  # Memoria massima delle sorgenti (una frontiera da 1M campioni ~24 MB)
+PNG_CACHE_SIZE = 256
+# pyplot ha stato globale non thread-safe: il rendering avviene in processi separati
+PLOT_WORKERS = 2
+
+_lock = threading.Lock()
+_sources: "OrderedDict[str, tuple]" = OrderedDict()
+_source_bytes = 0
+_png_cache: "OrderedDict[tuple, bytes]" = OrderedDict()
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=PLOT_WORKERS)
+        return _executor
+
+
+def _remember(cache: OrderedDict, key, value, max_size: int):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > max_size:
+        cache.popitem(last=False)
+
+
+def _arrays(value):
+    """Array e valori semplici che identificano una sorgente (senza serializzarla)."""
+    if value is None or isinstance(value, (str, int, float)):
+        yield value
+    elif isinstance(value, np.ndarray):
+        yield value
+    elif isinstance(value, pd.Series):
+        yield value.name
+        yield value.to_numpy()
+    elif isinstance(value, pd.DataFrame):
+        for column in value.columns:
+            yield from _arrays(value[column])
+    elif hasattr(value, '__dict__'):
+        # Oggetti con attributi array (es. FrontierDensity)
+        for name, attribute in sorted(vars(value).items()):
+            yield name
+            yield from _arrays(attribute)
+    else:
+        yield value
+
+
+def _nbytes(args) -> int:
+    return sum(value.nbytes for arg in args for value in _arrays(arg)
+               if isinstance(value, np.ndarray) and value.dtype != object)
+
+
+def _source_id(renderer: Callable, args) -> str:
+    """Hash dei buffer numerici degli argomenti (blake2b, nessun pickle delle tabelle)."""
+    digest = hashlib.blake2b(f'{renderer.__module__}.{renderer.__qualname__}'.encode(), digest_size=16)
+    for arg in args:
+        for value in _arrays(arg):
+            if isinstance(value, np.ndarray) and value.dtype != object:
+                digest.update(f'{value.dtype}{value.shape}'.encode())
+                digest.update(np.ascontiguousarray(value).data)
+            else:
+                digest.update(repr(value).encode())
+    return digest.hexdigest()
+
+
+def register_plots(renderer: Callable, names: List[str], *args) -> str:
+    """
+    Store the inputs of a set of plots and return their result_id.
+
+    Nothing is rendered here. The id hashes the numeric buffers of the
+    inputs, so identical results share one id and one set of cached PNGs.
+    Sources are evicted oldest first beyond PLOT_STORE_SIZE entries or
+    PLOT_STORE_MAX_BYTES. renderer(name, *args) must be a module-level
+    function returning PNG bytes, because it runs in a worker process.
+    """
+    global _source_bytes
+    result_id = _source_id(renderer, args)
+    size = _nbytes(args)
+    with _lock:
+        if result_id in _sources:
+            _sources.move_to_end(result_id)
+            return result_id
+        _sources[result_id] = (renderer, list(names), args, size)
+        _source_bytes += size
+        # Il più recente resta sempre, anche se da solo supera il limite
+        while len(_sources) > 1 and (len(_sources) > PLOT_STORE_SIZE or _source_bytes > PLOT_STORE_MAX_BYTES):
+            _, evicted = _sources.popitem(last=False)
+            _source_bytes -= evicted[3]
+    return result_id
+
+
+async def render_plot(result_id: str, name: str) -> bytes:
+    """Return the PNG for one plot, rendering it in the process pool on first request."""
+    key = (result_id, name)
+    with _lock:
+        if key in _png_cache:
+            _png_cache.move_to_end(key)
+            count_cache('plot_png', hits=1)
+            return _png_cache[key]
+        source = _sources.get(result_id)
+    if source is None or name not in source[1]:
+        raise KeyError(key)
+
+    count_cache('plot_png', misses=1)
+    renderer, _, args, _ = source
+    loop = asyncio.get_running_loop()
+    with stage('plots.render'):
+        png = await loop.run_in_executor(_get_executor(), renderer, name, *args)
+
+    with _lock:
+        _remember(_png_cache, key, png, PNG_CACHE_SIZE)
+    return png
+
+
+def shutdown():
+    """Termina il pool di rendering (chiamato allo shutdown dell'app)."""
+    global _executor
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
@@ -0,0 +1,158 @@
+"""
+Grafici del backtest come figure Plotly JSON.
+
+Le figure sono costruite senza dati (solo stile e layout) e le serie vengono
+inserite come array binari Plotly: date in millisecondi epoch e valori float64
+in base64, senza passare da PlotlyJSONEncoder + json.loads. Il template
+'plotly_white' viene espanso una sola volta e condiviso tra le figure.
+plotly viene importato al primo grafico.
+"""
+from functools import lru_cache
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+from array_encoding import encode_plotly_array, epoch_milliseconds
+from downsampling import lttb_indices
+
+
+@lru_cache(maxsize=None)
+def _plotly_template(name: str) -> Dict:
+    """JSON di un template Plotly, espanso una sola volta per processo (condiviso, non modificare)."""
+    import plotly.io as pio
+
+    return pio.templates[name].to_plotly_json()
+
+
+def _trace_arrays(series: pd.Series, max_points) -> Dict:
+    """
+    Array x/y binari di una traccia temporale, ridotti a max_points con LTTB.
+    Il downsampling riguarda solo il grafico: le metriche usano sempre la serie completa.
+    """
+    x = epoch_milliseconds(series.index)
+    y = series.to_numpy(dtype=np.float64)
+    keep = lttb_indices(x, y, max_points)
+    return {"x": encode_plotly_array(x[keep]), "y": encode_plotly_array(y[keep])}
+
+
+def _with_template(figure) -> Dict:
+    plot = figure.to_plotly_json()
+    plot["layout"]["template"] = _plotly_template('plotly_white')
+    return plot
+
+
+def performance_plot(analyzer, performance) -> Dict:
+    """1. Performance Cumulativa"""
+    import plotly.graph_objects as go
+
+    performance_fig = go.Figure(layout_template=None)
+    performance_fig.add_trace(go.Scatter(
+        mode='lines',
+        name='Portfolio',
+        line=dict(color='blue', width=2),
+        hovertemplate='<b>Portfolio</b><br>Data: %{x}<br>Valore: $%{y:,.2f}<extra></extra>'
+    ))
+    performance_fig.add_trace(go.Scatter(
+        mode='lines',
+        name='Benchmark',
+        line=dict(color='orange', width=2),
+        hovertemplate='<b>Benchmark</b><br>Data: %{x}<br>Valore: $%{y:,.2f}<extra></extra>'
+    ))
+    performance_fig.update_layout(
+        title='Performance Cumulativa: Portfolio vs Benchmark',
+        xaxis_title='Data',
+        xaxis_type='date',
+        yaxis_title='Valore ($)',
+        height=500
+    )
+
+    plot = _with_template(performance_fig)
+    plot["data"][0].update(_trace_arrays(performance.portfolio_cumulative, analyzer.config.max_points))
+    plot["data"][1].update(_trace_arrays(performance.benchmark_cumulative, analyzer.config.max_points))
+    return plot
+
+
+def drawdown_plot(analyzer, performance) -> Dict:
+    """2. Drawdown"""
+    import plotly.graph_objects as go
+
+    drawdown_fig = go.Figure(layout_template=None)
+    drawdown_fig.add_trace(go.Scatter(
+        mode='lines',
+        fill='tonexty',
+        name='Drawdown',
+        line=dict(color='red'),
+        fillcolor='rgba(255, 0, 0, 0.3)',
+        hovertemplate='<b>Drawdown</b><br>Data: %{x}<br>Drawdown: %{y:.2f}%<extra></extra>'
+    ))
+    drawdown_fig.update_layout(
+        title='Portfolio Drawdown',
+        xaxis_title='Data',
+        xaxis_type='date',
+        yaxis_title='Drawdown (%)',
+        height=400
+    )
+
+    plot = _with_template(drawdown_fig)
+    plot["data"][0].update(_trace_arrays(performance.portfolio_drawdown() * 100, analyzer.config.max_points))
+    return plot
+
+
+def distribution_plot(analyzer, performance) -> Dict:
+    """3. Distribuzione Rendimenti"""
+    import plotly.graph_objects as go
+
+    monthly_returns = performance.monthly_returns()
+
+    distribution_fig = go.Figure(layout_template=None)
+    distribution_fig.add_trace(go.Histogram(
+        nbinsx=30,
+        name='Rendimenti Mensili',
+        marker_color='steelblue',
+        opacity=0.7,
+        hovertemplate='Rendimento: %{x:.2f}%<br>Frequenza: %{y}<extra></extra>'
+    ))
+    distribution_fig.add_vline(
+        x=monthly_returns.mean() * 100,
+        line_dash="dash",
+        line_color="red",
+        annotation_text=f"Media: {monthly_returns.mean()*100:.1f}%"
+    )
+    distribution_fig.update_layout(
+        title='Distribuzione Rendimenti Mensili',
+        xaxis_title='Rendimento (%)',
+        yaxis_title='Frequenza',
+        height=400
+    )
+
+    plot = _with_template(distribution_fig)
+    plot["data"][0].update(x=encode_plotly_array(monthly_returns.values * 100))
+    return plot
+
+
+def allocation_plot(analyzer, performance) -> Dict:
+    """4. Asset Allocation Pie Chart"""
+    import plotly.graph_objects as go
+
+    allocation_fig = go.Figure(layout_template=None)
+    allocation_fig.add_trace(go.Pie(
+        labels=[etf.name for etf in analyzer.etfs],
+        values=[etf.weight for etf in analyzer.etfs],
+        name="Allocazione",
+        hovertemplate='<b>%{label}</b><br>Peso: %{percent}<br>TER: %{customdata:.2f}%<extra></extra>',
+        customdata=[etf.ter for etf in analyzer.etfs]
+    ))
+    allocation_fig.update_layout(
+        title='Allocazione Portfolio',
+        height=400
+    )
+    return _with_template(allocation_fig)
+
+
+PLOTLY_PLOTS = {
+    "performance": performance_plot,
+    "drawdown": drawdown_plot,
+    "distribution": distribution_plot,
+    "allocation": allocation_plot,
+}
@@ -0,0 +1,13 @@
+def pyplot():
+    """
+    matplotlib.pyplot imported on first use, on the headless Agg backend.
+
+    pyplot pulls in most of matplotlib (~0.7 s). Importing it only when a
+    PNG is actually rendered keeps it out of API worker start-up. The server
+    never opens windows, so the backend is always Agg, whatever MPLBACKEND
+    or the platform default says.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
@@ -0,0 +1,364 @@
+"""
+Portafogli salvati con risultati precalcolati (SQLAlchemy).
+
+Tabelle:
+- saved_portfolios: nome, payload del backtest (PortfolioPayload), hash del
+  payload e data dell'ultimo calcolo (as_of = ultimo giorno di borsa calcolato);
+- portfolio_metrics: metriche per orizzonte (full, 10y, 5y, 3y, 1y), con un
+  indice (orizzonte, metrica) per ogni metrica delle classifiche;
+- equity_points: curva del valore di portafoglio e benchmark, una riga per giorno.
+
+Il job notturno (nightly_refresh.py, o `python portfolio_store.py` da cron)
+ricalcola dopo la chiusura del mercato solo i portafogli modificati o, se senza
+end_date esplicita, non aggiornati all'ultima seduta, sostituendo curva e metriche salvate.
+Le letture (dettaglio, elenco, classifiche) sono query indicizzate, senza backtest.
+
+SQLAlchemy rallenta l'avvio (~0.4 s): il modulo va importato al primo utilizzo.
+"""
+import hashlib
+import json
+import os
+import threading
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from fastapi import HTTPException
+from sqlalchemy import (JSON, Date, DateTime, Float, ForeignKey, Index, Integer, String, Text, create_engine,
+                        delete, insert, select)
+from sqlalchemy.orm import DeclarativeBase, Mapped, Session, mapped_column, sessionmaker
+
+from backtest import AdvancedPortfolioAnalyzer, PortfolioPayload
+from downsampling import lttb_indices
+from nightly_refresh import last_market_close
+
+
+# Database dei portafogli salvati (qualsiasi URL SQLAlchemy, es. postgresql://...)
+PORTFOLIO_DB_URL = os.environ.get(
+    'PORTFOLIO_DB_URL',
+    'sqlite:///' + os.path.join(os.path.dirname(os.path.abspath(__file__)), 'portfolios.sqlite3')
+)
+# Orizzonti delle metriche salvate: anni di storia (None = periodo intero)
+HORIZONS = {'full': None, '10y': 10, '5y': 5, '3y': 3, '1y': 1}
+METRICS = ('annual_return', 'annual_volatility', 'sharpe_ratio', 'sortino_ratio', 'max_drawdown',
+           'calmar_ratio', 'var_95', 'total_return')
+# Metriche per cui un valore più basso è migliore (ordinamento crescente nelle classifiche)
+LOWER_IS_BETTER = {'annual_volatility'}
+MAX_LEADERBOARD = 100
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+class SavedPortfolio(Base):
+    __tablename__ = 'saved_portfolios'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    name: Mapped[str] = mapped_column(String(200), unique=True, index=True)
+    payload: Mapped[dict] = mapped_column(JSON)
+    payload_hash: Mapped[str] = mapped_column(String(64))
+    created_at: Mapped[datetime] = mapped_column(DateTime)
+    updated_at: Mapped[datetime] = mapped_column(DateTime)
+    computed_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    computed_hash: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)  # Payload dell'ultimo calcolo
+    as_of: Mapped[Optional[date]] = mapped_column(Date, nullable=True)
+    error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)  # Errore dell'ultimo calcolo
+
+
+class PortfolioMetrics(Base):
+    __tablename__ = 'portfolio_metrics'
+    __table_args__ = tuple(Index(f'ix_portfolio_metrics_horizon_{metric}', 'horizon', metric) for metric in METRICS)
+
+    portfolio_id: Mapped[int] = mapped_column(ForeignKey('saved_portfolios.id'), primary_key=True)
+    horizon: Mapped[str] = mapped_column(String(8), primary_key=True)
+    start_date: Mapped[date] = mapped_column(Date)
+    end_date: Mapped[date] = mapped_column(Date)
+    final_value: Mapped[float] = mapped_column(Float)
+    annual_return: Mapped[float] = mapped_column(Float)
+    annual_volatility: Mapped[float] = mapped_column(Float)
+    sharpe_ratio: Mapped[float] = mapped_column(Float)
+    sortino_ratio: Mapped[float] = mapped_column(Float)
+    max_drawdown: Mapped[float] = mapped_column(Float)
+    calmar_ratio: Mapped[float] = mapped_column(Float)
+    var_95: Mapped[float] = mapped_column(Float)
+    total_return: Mapped[float] = mapped_column(Float)
+
+
+class EquityPoint(Base):
+    __tablename__ = 'equity_points'
+
+    portfolio_id: Mapped[int] = mapped_column(ForeignKey('saved_portfolios.id'), primary_key=True)
+    date: Mapped[date] = mapped_column(Date, primary_key=True)
+    portfolio_value: Mapped[float] = mapped_column(Float)
+    benchmark_value: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+
+
+_engine = None
+_sessions: Optional[sessionmaker] = None
+_lock = threading.Lock()
+# Un solo refresh completo alla volta (job notturno o richiesta manuale)
+_refresh_lock = threading.Lock()
+
+
+def get_session() -> Session:
+    """Nuova sessione; al primo uso crea il motore e le tabelle mancanti."""
+    global _engine, _sessions
+    with _lock:
+        if _sessions is None:
+            _engine = create_engine(PORTFOLIO_DB_URL)
+            Base.metadata.create_all(_engine)
+            _sessions = sessionmaker(_engine, expire_on_commit=False)
+    return _sessions()
+
+
+def _stored_payload(payload: PortfolioPayload) -> Dict:
+    """
+    Payload salvato: solo i campi indicati dall'utente. Senza end_date esplicita il
+    portafoglio segue il mercato (end_date = oggi a ogni calcolo).
+    """
+    return payload.model_dump(mode='json', exclude_unset=True)
+
+
+def _payload_hash(stored: Dict) -> str:
+    return hashlib.sha256(json.dumps(stored, sort_keys=True).encode()).hexdigest()
+
+
+def _is_fresh(portfolio: SavedPortfolio, close: date) -> bool:
+    """Calcolato sul payload attuale e, se segue il mercato, aggiornato all'ultima seduta."""
+    if portfolio.error is not None or portfolio.computed_hash != portfolio.payload_hash or portfolio.as_of is None:
+        return False
+    # Con end_date esplicita il periodo è fisso: un nuovo calcolo darebbe lo stesso risultato
+    fixed_end = 'end_date' in (portfolio.payload.get('config') or {})
+    return fixed_end or portfolio.as_of >= close
+
+
+def _horizon_metrics(analyzer: AdvancedPortfolioAnalyzer, series: pd.DataFrame) -> List[Dict]:
+    """Metriche del portafoglio per ogni orizzonte coperto dalla storia disponibile."""
+    returns = series['portfolio_return'].dropna()
+    values = series['portfolio_value']
+    end = returns.index[-1]
+    rows = []
+    for horizon, years in HORIZONS.items():
+        window = returns
+        if years is not None:
+            cutoff = end - pd.DateOffset(years=years)
+            if returns.index[0] > cutoff + pd.Timedelta(days=7):
+                continue  # Storia più corta dell'orizzonte
+            window = returns[returns.index > cutoff]
+        metrics = analyzer._calculate_advanced_metrics(window)
+        rows.append({
+            'horizon': horizon,
+            'start_date': window.index[0].date(),
+            'end_date': end.date(),
+            'final_value': float(values.iloc[-1]),
+            **{metric: float(metrics[metric]) for metric in METRICS},
+        })
+    return rows
+
+
+def _write_results(session: Session, portfolio: SavedPortfolio, analyzer: AdvancedPortfolioAnalyzer,
+                   series: pd.DataFrame):
+    # Curva e metriche sostituite per intero nella stessa transazione: la curva resta
+    # quella da cui sono calcolate le metriche (revisioni dei prezzi rettificati comprese)
+    session.execute(delete(EquityPoint).where(EquityPoint.portfolio_id == portfolio.id))
+    benchmark = series['benchmark_value'].to_numpy()
+    session.execute(insert(EquityPoint), [
+        {'portfolio_id': portfolio.id, 'date': day.date(), 'portfolio_value': float(value),
+         'benchmark_value': None if np.isnan(bench) else float(bench)}
+        for day, value, bench in zip(series.index, series['portfolio_value'].to_numpy(), benchmark)
+    ])
+
+    session.execute(delete(PortfolioMetrics).where(PortfolioMetrics.portfolio_id == portfolio.id))
+    session.execute(insert(PortfolioMetrics),
+                    [{'portfolio_id': portfolio.id, **row} for row in _horizon_metrics(analyzer, series)])
+
+    portfolio.computed_at = datetime.now()
+    portfolio.computed_hash = portfolio.payload_hash
+    portfolio.as_of = series.index[-1].date()
+    portfolio.error = None
+
+
+def refresh_portfolio(session: Session, portfolio: SavedPortfolio, force: bool = False) -> bool:
+    """
+    Ricalcola un portafoglio se non è aggiornato all'ultima seduta (o se force),
+    sostituendo curva e metriche salvate in un'unica transazione. In caso di errore
+    i dati precedenti restano invariati e viene salvato solo il messaggio di errore.
+    Restituisce True se il portafoglio è stato ricalcolato.
+    """
+    if not force and _is_fresh(portfolio, last_market_close()):
+        return False
+
+    # Senza end_date: fino all'ultima seduta (la data finale del download è esclusa, quindi domani)
+    data = json.loads(json.dumps(portfolio.payload))
+    data.setdefault('config', {}).setdefault('end_date', (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d'))
+    payload = PortfolioPayload(**data)
+    analyzer = AdvancedPortfolioAnalyzer(etfs=payload.etfs, benchmark=payload.benchmark, config=payload.config)
+    try:
+        series = analyzer.compute_daily_series()
+        _write_results(session, portfolio, analyzer, series)
+        session.commit()
+    except Exception as e:
+        # Scarta le scritture parziali prima di registrare l'errore
+        session.rollback()
+        portfolio.error = str(e.detail) if isinstance(e, HTTPException) else str(e)
+        session.commit()
+        raise
+    return True
+
+
+def refresh_all(force: bool = False) -> Dict[str, int]:
+    """Ricalcola i portafogli salvati non aggiornati (tutti se force); un errore non ferma gli altri."""
+    if not _refresh_lock.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="Aggiornamento dei portafogli già in corso")
+    summary = {'refreshed': 0, 'skipped': 0, 'failed': 0}
+    try:
+        with get_session() as session:
+            for portfolio in session.scalars(select(SavedPortfolio).order_by(SavedPortfolio.id)).all():
+                try:
+                    refreshed = refresh_portfolio(session, portfolio, force)
+                except Exception:
+                    summary['failed'] += 1
+                    continue
+                summary['refreshed' if refreshed else 'skipped'] += 1
+    finally:
+        _refresh_lock.release()
+    return summary
+
+
+def save_portfolio(name: str, payload: PortfolioPayload) -> int:
+    """Crea o aggiorna (per nome) un portafoglio salvato; restituisce il suo id."""
+    name = name.strip()
+    if not name:
+        raise HTTPException(status_code=400, detail="Il nome del portafoglio non può essere vuoto")
+    stored = _stored_payload(payload)
+    now = datetime.now()
+    with get_session() as session:
+        portfolio = session.scalar(select(SavedPortfolio).where(SavedPortfolio.name == name))
+        if portfolio is None:
+            portfolio = SavedPortfolio(name=name, created_at=now)
+            session.add(portfolio)
+        portfolio.payload = stored
+        portfolio.payload_hash = _payload_hash(stored)
+        portfolio.updated_at = now
+        session.commit()
+        return portfolio.id
+
+
+def compute_saved_portfolio(portfolio_id: int):
+    """Calcola subito un portafoglio salvato (es. alla creazione)."""
+    with get_session() as session:
+        refresh_portfolio(session, _get(session, portfolio_id), force=True)
+
+
+def delete_portfolio(portfolio_id: int):
+    with get_session() as session:
+        _get(session, portfolio_id)
+        session.execute(delete(EquityPoint).where(EquityPoint.portfolio_id == portfolio_id))
+        session.execute(delete(PortfolioMetrics).where(PortfolioMetrics.portfolio_id == portfolio_id))
+        session.execute(delete(SavedPortfolio).where(SavedPortfolio.id == portfolio_id))
+        session.commit()
+
+
+def _get(session: Session, portfolio_id: int) -> SavedPortfolio:
+    portfolio = session.get(SavedPortfolio, portfolio_id)
+    if portfolio is None:
+        raise HTTPException(status_code=404, detail=f"Portafoglio {portfolio_id} non trovato")
+    return portfolio
+
+
+def _summary(portfolio: SavedPortfolio) -> Dict:
+    return {
+        'id': portfolio.id,
+        'name': portfolio.name,
+        'updated_at': portfolio.updated_at.isoformat(timespec='seconds'),
+        'computed_at': portfolio.computed_at.isoformat(timespec='seconds') if portfolio.computed_at else None,
+        'as_of': portfolio.as_of.isoformat() if portfolio.as_of else None,
+        'stale': portfolio.computed_hash != portfolio.payload_hash,
+        'error': portfolio.error,
+    }
+
+
+def _metrics_dict(row: PortfolioMetrics) -> Dict:
+    return {
+        'start_date': row.start_date.isoformat(),
+        'end_date': row.end_date.isoformat(),
+        'final_value': row.final_value,
+        **{metric: getattr(row, metric) for metric in METRICS},
+    }
+
+
+def list_portfolios() -> List[Dict]:
+    """Portafogli salvati con le metriche sul periodo intero (una query)."""
+    with get_session() as session:
+        rows = session.execute(
+            select(SavedPortfolio, PortfolioMetrics)
+            .outerjoin(PortfolioMetrics, (PortfolioMetrics.portfolio_id == SavedPortfolio.id)
+                       & (PortfolioMetrics.horizon == 'full'))
+            .order_by(SavedPortfolio.name)
+        ).all()
+    return [{**_summary(portfolio), 'metrics': _metrics_dict(metrics) if metrics else None}
+            for portfolio, metrics in rows]
+
+
+def get_saved_portfolio(portfolio_id: int, include_equity: bool = True, max_points: Optional[int] = None) -> Dict:
+    """Payload, metriche per orizzonte e curva salvata (opzionalmente ridotta a max_points con LTTB)."""
+    with get_session() as session:
+        portfolio = _get(session, portfolio_id)
+        metrics = session.scalars(select(PortfolioMetrics).where(PortfolioMetrics.portfolio_id == portfolio_id)).all()
+        result = {
+            **_summary(portfolio),
+            'portfolio': portfolio.payload,
+            'metrics': {row.horizon: _metrics_dict(row) for row in metrics},
+        }
+        if include_equity:
+            points = session.execute(
+                select(EquityPoint.date, EquityPoint.portfolio_value, EquityPoint.benchmark_value)
+                .where(EquityPoint.portfolio_id == portfolio_id).order_by(EquityPoint.date)
+            ).all()
+            result['equity'] = _equity_columns(points, max_points)
+    return result
+
+
+def _equity_columns(points, max_points: Optional[int]) -> Dict:
+    dates = [point[0].isoformat() for point in points]
+    portfolio = np.array([point[1] for point in points], dtype=float)
+    benchmark = np.array([np.nan if point[2] is None else point[2] for point in points], dtype=float)
+    if max_points is not None and len(points) > max_points:
+        keep = lttb_indices(np.arange(len(points), dtype=float), portfolio, max_points)
+        dates, portfolio, benchmark = [dates[i] for i in keep], portfolio[keep], benchmark[keep]
+    return {
+        'dates': dates,
+        'portfolio_value': portfolio.tolist(),
+        'benchmark_value': [None if np.isnan(v) else v for v in benchmark.tolist()],
+    }
+
+
+def leaderboard(metric: str = 'sharpe_ratio', horizon: str = '10y', limit: int = 10) -> List[Dict]:
+    """Migliori portafogli per una metrica su un orizzonte (indice horizon + metrica)."""
+    if metric not in METRICS:
+        raise HTTPException(status_code=400, detail=f"metric deve essere una tra: {', '.join(METRICS)}")
+    if horizon not in HORIZONS:
+        raise HTTPException(status_code=400, detail=f"horizon deve essere uno tra: {', '.join(HORIZONS)}")
+    if not 1 <= limit <= MAX_LEADERBOARD:
+        raise HTTPException(status_code=400, detail=f"limit deve essere compreso tra 1 e {MAX_LEADERBOARD}")
+
+    column = getattr(PortfolioMetrics, metric)
+    with get_session() as session:
+        rows = session.execute(
+            select(SavedPortfolio.id, SavedPortfolio.name, PortfolioMetrics)
+            .join(PortfolioMetrics, PortfolioMetrics.portfolio_id == SavedPortfolio.id)
+            .where(PortfolioMetrics.horizon == horizon)
+            .order_by(column.asc() if metric in LOWER_IS_BETTER else column.desc())
+            .limit(limit)
+        ).all()
+    return [{'rank': rank, 'id': portfolio_id, 'name': name, 'value': getattr(metrics, metric),
+             'metrics': _metrics_dict(metrics)}
+            for rank, (portfolio_id, name, metrics) in enumerate(rows, start=1)]
+
+
+if __name__ == "__main__":
+    # Uso da cron: python portfolio_store.py [--force]
+    import sys
+    print(refresh_all(force='--force' in sys.argv))
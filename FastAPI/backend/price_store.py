@@ -0,0 +1,102 @@
+"""
+Archivio locale dei prezzi di chiusura: un file CSV (date, close) per ticker
+con tutta la storia disponibile, scaricata una volta da Yahoo Finance.
+
+Usato dal batch runner (batch_runner.py): il processo principale scarica i
+ticker mancanti prima di avviare i worker, che poi leggono solo da disco.
+Contiene anche i cambi usati per la conversione in valuta di base (fx.py).
+"""
+import os
+import re
+import time
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional
+
+import pandas as pd
+
+
+# Cartella dell'archivio (sovrascrivibile con PRICE_STORE_DIR)
+PRICE_STORE_DIR = os.environ.get(
+    'PRICE_STORE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'price_store')
+)
+# Serie tenute in memoria da ogni processo
+PRICE_STORE_CACHE_SIZE = 256
+
+
+def _path(ticker: str) -> str:
+    return os.path.join(PRICE_STORE_DIR, re.sub(r'[^A-Za-z0-9._^=-]', '_', ticker) + '.csv')
+
+
+def has_prices(ticker: str) -> bool:
+    return os.path.exists(_path(ticker))
+
+
+def download(ticker: str) -> Optional[pd.Series]:
+    """Scarica tutta la storia di un ticker e la salva nell'archivio; None se Yahoo non ha dati."""
+    import yfinance as yf  # caricato solo quando serve un download (import lento)
+
+    data = yf.download(ticker, period='max', progress=False)
+    if data.empty:
+        return None
+    # Come PortfolioAnalyzer: 'Adj Close' se disponibile, altrimenti 'Close'
+    prices = data['Adj Close'] if 'Adj Close' in data.columns else data['Close']
+    if isinstance(prices, pd.DataFrame):
+        prices = prices.squeeze(axis=1)
+    prices = prices.dropna().rename('close')
+    prices.index.name = 'date'
+
+    # Scrittura atomica: un lettore concorrente vede il file vecchio o quello nuovo, mai metà
+    os.makedirs(PRICE_STORE_DIR, exist_ok=True)
+    path = _path(ticker)
+    temporary = f'{path}.{os.getpid()}.tmp'
+    prices.to_csv(temporary, date_format='%Y-%m-%d')
+    os.replace(temporary, path)
+    _load.cache_clear()
+    return prices
+
+
+@lru_cache(maxsize=PRICE_STORE_CACHE_SIZE)
+def _load(ticker: str) -> Optional[pd.Series]:
+    path = _path(ticker)
+    if not os.path.exists(path):
+        return None
+    return pd.read_csv(path, index_col='date', parse_dates=['date'])['close']
+
+
+def prefetch(tickers: Iterable[str], refresh: bool = False) -> List[str]:
+    """Scarica i ticker assenti (o tutti con refresh); restituisce quelli senza dati."""
+    missing = []
+    for ticker in dict.fromkeys(tickers):
+        if refresh or not has_prices(ticker):
+            print(f"  Downloading {ticker}...")
+            if download(ticker) is None:
+                missing.append(ticker)
+    return missing
+
+
+def _is_stale(ticker: str, series: pd.Series, end_date: str, max_age_days: int) -> bool:
+    """Serie che finisce più di max_age_days prima di end_date (o di oggi), non già riscaricata oggi."""
+    until = min(pd.Timestamp(end_date), pd.Timestamp.now().normalize())
+    if series.index[-1] >= until - pd.Timedelta(days=max_age_days):
+        return False
+    return os.path.getmtime(_path(ticker)) < time.mktime(until.timetuple())
+
+
+def get_prices(tickers: Iterable[str], start_date: str, end_date: str, offline: bool = True,
+               max_age_days: Optional[int] = None) -> Dict[str, pd.Series]:
+    """
+    Prezzi non pesati dei ticker tra start_date (inclusa) ed end_date (esclusa, come yfinance),
+    nel formato accettato da PortfolioAnalyzer.load_prices. Senza offline i ticker assenti
+    vengono scaricati, e con max_age_days anche quelli il cui ultimo prezzo è troppo vecchio;
+    i ticker senza dati sono omessi.
+    """
+    prices = {}
+    for ticker in dict.fromkeys(tickers):
+        series = _load(ticker)
+        if not offline and (series is None or (max_age_days is not None
+                                                and _is_stale(ticker, series, end_date, max_age_days))):
+            downloaded = download(ticker)
+            series = downloaded if downloaded is not None else series
+        if series is not None:
+            prices[ticker] = series[(series.index >= start_date) & (series.index < end_date)]
+    return prices
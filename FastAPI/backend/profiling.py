@@ -0,0 +1,227 @@
+"""
+Profiling su richiesta (?profile=cpu|mem) per backtest e frontiera efficiente.
+
+Riservato agli amministratori: la richiesta deve portare l'header X-Admin-Token
+uguale alla variabile d'ambiente ADMIN_TOKEN (senza ADMIN_TOKEN il profiling è
+disattivato). Un solo profilo alla volta, perché tracemalloc e il campionamento
+riguardano l'intero processo.
+
+- cpu: un thread campiona lo stack del thread che esegue la richiesta ogni
+  PROFILE_SAMPLE_INTERVAL secondi e conta gli stack in formato "collapsed"
+  (una riga 'f1;f2;f3 conteggio', da passare a flamegraph.pl o speedscope).
+- mem: tracemalloc con il picco di memoria per stadio (stadi di stage_metrics)
+  e gli stack delle allocazioni ancora vive a fine richiesta, pesati in byte.
+
+Ogni profilo è salvato in PROFILE_DIR come <id>.collapsed e <id>.json
+(riepilogo con stadi e funzioni/righe principali) e servito da /api/profiles/{id}.
+"""
+import json
+import os
+import re
+import secrets
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException
+
+from stage_metrics import observe_stages
+
+
+PROFILE_MODES = ('cpu', 'mem')
+# Token degli amministratori; se non impostato il profiling non è disponibile
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+# Cartella dei profili salvati (sovrascrivibile con PROFILE_DIR)
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles'))
+# Profili conservati: oltre questo numero vengono eliminati i più vecchi
+PROFILE_KEEP = 50
+PROFILE_SAMPLE_INTERVAL = 0.005
+# Frame conservati da tracemalloc per ogni allocazione
+PROFILE_TRACEBACK_FRAMES = 25
+PROFILE_TOP = 25
+
+_PROFILE_ID = re.compile(r'^[0-9a-f]{32}$')
+_busy = threading.Lock()
+
+
+def check_admin(admin_token: Optional[str]):
+    """403 se l'header X-Admin-Token non corrisponde ad ADMIN_TOKEN (o se ADMIN_TOKEN non è impostato)."""
+    if not ADMIN_TOKEN or not admin_token or not secrets.compare_digest(admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Operazione riservata agli amministratori")
+
+
+def check_profile_access(profile: Optional[str], admin_token: Optional[str]) -> Optional[str]:
+    """Valida ?profile e l'header X-Admin-Token; restituisce la modalità o None se non richiesto."""
+    if profile is None:
+        return None
+    if profile not in PROFILE_MODES:
+        raise HTTPException(status_code=400, detail=f"profile deve essere uno tra: {', '.join(PROFILE_MODES)}")
+    check_admin(admin_token)
+    return profile
+
+
+def _frame_label(code) -> str:
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+class StackSampler:
+    """Campiona periodicamente lo stack di un thread e conta gli stack uguali."""
+
+    def __init__(self, thread_id: int, interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            if labels:
+                self.stacks[';'.join(reversed(labels))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def top_functions(self, limit: int = PROFILE_TOP) -> List[Dict]:
+        """Funzioni con più campioni in cima allo stack (tempo 'self')."""
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        total = sum(leaves.values()) or 1
+        return [{'function': name, 'samples': count, 'share': round(count / total, 4)}
+                for name, count in leaves.most_common(limit)]
+
+
+class ProfileSession:
+    """Un profilo in corso: stadi osservati e, alla fine, i file salvati."""
+
+    def __init__(self, mode: str, label: str):
+        self.id = uuid.uuid4().hex
+        self.mode = mode
+        self.label = label
+        self.stages: List[Dict] = []
+        self.started_at = time.time()
+
+    @property
+    def url(self) -> str:
+        return f'/api/profiles/{self.id}'
+
+    def observe(self, name: str, seconds: float):
+        entry = {'stage': name, 'ms': round(seconds * 1000, 3)}
+        if self.mode == 'mem':
+            # Picco dalla chiusura dello stadio precedente, poi si riparte da zero
+            _, peak = tracemalloc.get_traced_memory()
+            entry['peak_mb'] = round(peak / 2**20, 3)
+            tracemalloc.reset_peak()
+        self.stages.append(entry)
+
+
+def _memory_profile(snapshot) -> tuple:
+    """(righe collapsed pesate in byte, allocazioni principali per riga) di uno snapshot tracemalloc."""
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+    collapsed = [
+        ';'.join(f'{os.path.basename(frame.filename)}:{frame.lineno}' for frame in reversed(stat.traceback)) + f' {stat.size}'
+        for stat in snapshot.statistics('traceback')
+    ]
+    top = [{'line': f'{stat.traceback[0].filename}:{stat.traceback[0].lineno}', 'kb': round(stat.size / 1024, 1),
+            'count': stat.count} for stat in snapshot.statistics('lineno')[:PROFILE_TOP]]
+    return collapsed, top
+
+
+def _prune(directory: str):
+    summaries = sorted((entry for entry in os.scandir(directory) if entry.name.endswith('.json')),
+                       key=lambda entry: entry.stat().st_mtime)
+    for entry in summaries[:-PROFILE_KEEP] if len(summaries) > PROFILE_KEEP else []:
+        for extension in ('.json', '.collapsed'):
+            try:
+                os.remove(os.path.join(directory, entry.name[:-5] + extension))
+            except FileNotFoundError:
+                pass
+
+
+def _save(session: ProfileSession, summary: Dict, collapsed: List[str]):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    with open(os.path.join(PROFILE_DIR, f'{session.id}.collapsed'), 'w') as f:
+        f.write('\n'.join(collapsed) + '\n')
+    with open(os.path.join(PROFILE_DIR, f'{session.id}.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+    _prune(PROFILE_DIR)
+
+
+@contextmanager
+def profile_request(mode: Optional[str], label: str):
+    """
+    Profila il blocco nella modalità richiesta (None = nessun profilo, costo nullo).
+    Restituisce la ProfileSession, il cui url va comunicato al client (header X-Profile).
+    """
+    if mode is None:
+        yield None
+        return
+    if not _busy.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="Un altro profilo è in corso, riprovare più tardi")
+
+    session = ProfileSession(mode, label)
+    sampler = StackSampler(threading.get_ident()) if mode == 'cpu' else None
+    started_tracing = mode == 'mem' and not tracemalloc.is_tracing()
+    start = time.perf_counter()
+    try:
+        if started_tracing:
+            tracemalloc.start(PROFILE_TRACEBACK_FRAMES)
+        elif mode == 'mem':
+            tracemalloc.reset_peak()
+        if sampler is not None:
+            sampler.start()
+
+        with observe_stages(session.observe):
+            yield session
+
+        duration_ms = round((time.perf_counter() - start) * 1000, 3)
+        summary = {
+            'id': session.id,
+            'mode': mode,
+            'label': label,
+            'started_at': session.started_at,
+            'duration_ms': duration_ms,
+            'stages': session.stages,
+        }
+        if sampler is not None:
+            sampler.stop()
+            collapsed = [f'{stack} {count}' for stack, count in sampler.stacks.most_common()]
+            summary.update(interval_ms=sampler.interval * 1000, samples=sum(sampler.stacks.values()),
+                           top_functions=sampler.top_functions())
+        else:
+            _, peak = tracemalloc.get_traced_memory()
+            collapsed, top = _memory_profile(tracemalloc.take_snapshot())
+            peak_mb = max([round(peak / 2**20, 3)] + [stage['peak_mb'] for stage in session.stages])
+            summary.update(peak_mb=peak_mb, top_allocations=top)
+        _save(session, summary, collapsed)
+    finally:
+        if sampler is not None and sampler._thread.is_alive():
+            sampler.stop()
+        if started_tracing:
+            tracemalloc.stop()
+        _busy.release()
+
+
+def profile_path(profile_id: str, kind: str) -> str:
+    """Percorso di un profilo salvato ('collapsed' o 'json'); KeyError se non esiste."""
+    if not _PROFILE_ID.match(profile_id) or kind not in ('collapsed', 'json'):
+        raise KeyError(profile_id)
+    path = os.path.join(PROFILE_DIR, f'{profile_id}.{kind}')
+    if not os.path.exists(path):
+        raise KeyError(profile_id)
+    return path
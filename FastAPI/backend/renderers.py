@@ -0,0 +1,148 @@
+import importlib.util
+import threading
+import time
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+from array_encoding import encode_plotly_array, epoch_milliseconds
+from matplotlib_renderer import MATPLOTLIB_PLOTS
+from plotly_renderer import PLOTLY_PLOTS
+from stage_metrics import record_stage
+
+
+# Grafici del backtest, nell'ordine in cui vengono generati (e inviati in streaming)
+PLOT_NAMES = ("performance", "drawdown", "distribution", "allocation")
+
+# Renderer usato quando la richiesta non ne indica uno (main_fallback.py lo imposta a matplotlib-png).
+# Resta fisso perché il frontend disegna solo figure Plotly; 'auto' va chiesto esplicitamente
+DEFAULT_RENDERER = "plotly-json"
+
+# Peso dell'ultima misura nella media mobile esponenziale dei tempi di rendering
+TIMING_SMOOTHING = 0.2
+
+_lock = threading.Lock()
+
+
+def _series_arrays(series) -> Dict:
+    return {"x": encode_plotly_array(epoch_milliseconds(series.index)), "y": encode_plotly_array(series.to_numpy())}
+
+
+# Renderer data-only: solo gli array per disegnare i grafici lato client, niente figure
+DATA_PLOTS = {
+    "performance": lambda analyzer, performance: {
+        "portfolio": _series_arrays(performance.portfolio_cumulative),
+        "benchmark": _series_arrays(performance.benchmark_cumulative),
+    },
+    "drawdown": lambda analyzer, performance: _series_arrays(performance.portfolio_drawdown() * 100),
+    "distribution": lambda analyzer, performance: _series_arrays(performance.monthly_returns() * 100),
+    "allocation": lambda analyzer, performance: {
+        "labels": [etf.name for etf in analyzer.etfs],
+        "values": [etf.weight for etf in analyzer.etfs],
+    },
+}
+
+
+class Renderer:
+    """
+    One way of turning a backtest result into its four plots.
+
+    backend is the module the renderer needs (checked once, without
+    importing it). The time of every complete render is folded into an
+    exponential moving average, and 'auto' picks the renderer with the
+    lowest one. Until a renderer has been measured, cost_hint_ms stands in.
+    """
+
+    def __init__(self, name: str, plots: Dict[str, Callable], backend: Optional[str], cost_hint_ms: float,
+                 draws_figures: bool = True):
+        self.name = name
+        self.plots = plots
+        self.backend = backend
+        self.cost_hint_ms = cost_hint_ms
+        self.draws_figures = draws_figures
+        self.available: Optional[bool] = None
+        self.calls = 0
+        self.mean_ms: Optional[float] = None
+        self.last_ms: Optional[float] = None
+
+    def detect(self) -> bool:
+        self.available = self.backend is None or importlib.util.find_spec(self.backend) is not None
+        return self.available
+
+    @property
+    def expected_ms(self) -> float:
+        return self.mean_ms if self.mean_ms is not None else self.cost_hint_ms
+
+    def _record(self, elapsed_ms: float):
+        record_stage('backtest.plots', elapsed_ms / 1000)
+        with _lock:
+            self.calls += 1
+            self.last_ms = elapsed_ms
+            self.mean_ms = elapsed_ms if self.mean_ms is None else \
+                (1 - TIMING_SMOOTHING) * self.mean_ms + TIMING_SMOOTHING * elapsed_ms
+
+    def iter_plots(self, analyzer, performance) -> Iterator[Tuple[str, object]]:
+        """Yield (name, plot) in PLOT_NAMES order, timing the render; the time is recorded once all plots are done."""
+        elapsed = 0.0
+        for name in PLOT_NAMES:
+            start = time.perf_counter()
+            plot = self.plots[name](analyzer, performance)
+            elapsed += time.perf_counter() - start
+            yield name, plot
+        self._record(elapsed * 1000)
+
+    def render(self, analyzer, performance) -> Dict[str, object]:
+        return dict(self.iter_plots(analyzer, performance))
+
+    def to_dict(self) -> Dict:
+        return {
+            "available": self.available,
+            "backend": self.backend,
+            "draws_figures": self.draws_figures,
+            "calls": self.calls,
+            "mean_ms": round(self.mean_ms, 2) if self.mean_ms is not None else None,
+            "last_ms": round(self.last_ms, 2) if self.last_ms is not None else None,
+            "expected_ms": round(self.expected_ms, 2),
+        }
+
+
+RENDERERS: Dict[str, Renderer] = {
+    "plotly-json": Renderer("plotly-json", PLOTLY_PLOTS, backend="plotly", cost_hint_ms=50),
+    "matplotlib-png": Renderer("matplotlib-png", MATPLOTLIB_PLOTS, backend="matplotlib", cost_hint_ms=1500),
+    "data": Renderer("data", DATA_PLOTS, backend=None, cost_hint_ms=1, draws_figures=False),
+}
+
+
+def detect_backends() -> Dict[str, bool]:
+    """Controlla quali backend sono installati (chiamato all'avvio dell'app)."""
+    return {name: renderer.detect() for name, renderer in RENDERERS.items()}
+
+
+def resolve(requested: Optional[str]) -> Renderer:
+    """
+    Renderer per una richiesta: quello indicato, oppure con 'auto' il più economico
+    tra quelli disponibili che producono figure (ripiega su 'data' se non ce ne sono).
+    Solleva ValueError per nomi sconosciuti o backend non installati.
+    """
+    name = requested or DEFAULT_RENDERER
+    if any(renderer.available is None for renderer in RENDERERS.values()):
+        detect_backends()
+
+    if name == "auto":
+        candidates = [r for r in RENDERERS.values() if r.available and r.draws_figures]
+        return min(candidates, key=lambda r: r.expected_ms) if candidates else RENDERERS["data"]
+
+    renderer = RENDERERS.get(name)
+    if renderer is None:
+        raise ValueError(f"Renderer sconosciuto '{name}'. Usare uno tra: auto, {', '.join(RENDERERS)}")
+    if not renderer.available:
+        raise ValueError(f"Il renderer '{name}' richiede {renderer.backend}, non installato")
+    return renderer
+
+
+def renderer_stats() -> Dict:
+    if any(renderer.available is None for renderer in RENDERERS.values()):
+        detect_backends()
+    return {
+        "default": DEFAULT_RENDERER,
+        "auto": resolve("auto").name,
+        "renderers": {name: renderer.to_dict() for name, renderer in RENDERERS.items()},
+    }
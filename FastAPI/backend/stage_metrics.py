@@ -0,0 +1,248 @@
+"""
+Tempi per stadio delle richieste: header Server-Timing e metriche Prometheus.
+
+Gli stadi (download, calcolo, metriche, grafici, serializzazione...) vengono
+misurati con stage() o StageClock. Ogni misura finisce:
+- nell'header Server-Timing della richiesta in corso (StageTimingMiddleware),
+- in un istogramma delle latenze per stadio, esposto da /api/metrics insieme
+  alla durata delle richieste per route e alle hit/miss delle cache.
+
+Con METRICS_ENABLED=0 gli istogrammi e i contatori non vengono aggiornati e
+una misura costa solo due perf_counter e una lettura di ContextVar.
+"""
+import os
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+# Aggregazione per /api/metrics (disattivabile se nessuno raccoglie le metriche)
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') != '0'
+
+# Limiti superiori dei bucket degli istogrammi, in secondi
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_lock = threading.Lock()
+# Stadi misurati nella richiesta corrente: (nome, secondi); None fuori da una richiesta
+_request_stages: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar('request_stages', default=None)
+# Callback opzionale chiamato alla chiusura di ogni stadio (usato dal profiling, vedi profiling.py)
+_stage_observer: ContextVar[Optional[Callable[[str, float], None]]] = ContextVar('stage_observer', default=None)
+
+
+class Histogram:
+    """Istogramma cumulativo in stile Prometheus (bucket fissi, somma e conteggio)."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # l'ultimo è +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        """(le, conteggio cumulativo) per ogni bucket, +Inf compreso."""
+        cumulative = 0
+        for bound, count in zip((*self.buckets, float('inf')), self.counts):
+            cumulative += count
+            yield ('+Inf' if bound == float('inf') else repr(bound)), cumulative
+
+
+_stage_histograms: Dict[str, Histogram] = {}
+_request_histograms: Dict[Tuple[str, str, str], Histogram] = {}
+_cache_counters: Dict[str, List[int]] = {}  # nome -> [hit, miss]
+_cache_collectors: Dict[str, Callable[[], Tuple[int, int]]] = {}
+_metrics: Dict[str, Tuple[str, str, Callable[[], float]]] = {}  # nome -> (tipo, descrizione, lettura)
+
+
+def _observe(histograms: Dict, key, value: float):
+    with _lock:
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram()
+        histogram.observe(value)
+
+
+def record_stage(name: str, seconds: float):
+    """Registra la durata di uno stadio già misurato altrove (es. dal renderer)."""
+    stages = _request_stages.get()
+    if stages is not None:
+        stages.append((name, seconds))
+    observer = _stage_observer.get()
+    if observer is not None:
+        observer(name, seconds)
+    if METRICS_ENABLED:
+        _observe(_stage_histograms, name, seconds)
+
+
+@contextmanager
+def observe_stages(observer: Callable[[str, float], None]):
+    """Chiama observer(nome, secondi) per ogni stadio chiuso all'interno del blocco."""
+    token = _stage_observer.set(observer)
+    try:
+        yield
+    finally:
+        _stage_observer.reset(token)
+
+
+@contextmanager
+def stage(name: str):
+    """Misura il blocco come stadio 'name'."""
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, perf_counter() - start)
+
+
+class StageClock:
+    """
+    Stadi consecutivi di una funzione lunga, senza re-indentarla:
+    ogni lap(nome) chiude lo stadio iniziato al lap precedente (o alla creazione).
+    """
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self._last = perf_counter()
+
+    def lap(self, name: str):
+        now = perf_counter()
+        record_stage(f'{self.prefix}.{name}', now - self._last)
+        self._last = now
+
+
+def count_cache(cache: str, hits: int = 0, misses: int = 0):
+    """Conta hit e miss di una cache gestita a mano."""
+    if not METRICS_ENABLED or not (hits or misses):
+        return
+    with _lock:
+        counters = _cache_counters.setdefault(cache, [0, 0])
+        counters[0] += hits
+        counters[1] += misses
+
+
+def register_cache_collector(cache: str, collector: Callable[[], Tuple[int, int]]):
+    """Cache che contano già da sé (es. lru_cache.cache_info): letta solo a ogni scrape."""
+    _cache_collectors[cache] = collector
+
+
+def register_metric(metric: str, metric_type: str, help_text: str, collector: Callable[[], float]):
+    """Metrica senza etichette (gauge o counter) letta da collector() a ogni scrape."""
+    _metrics[metric] = (metric_type, help_text, collector)
+
+
+def lru_cache_collector(cached_function) -> Callable[[], Tuple[int, int]]:
+    def collect():
+        info = cached_function.cache_info()
+        return info.hits, info.misses
+    return collect
+
+
+def server_timing_header(stages: List[Tuple[str, float]]) -> str:
+    """Valore dell'header Server-Timing; stadi ripetuti nella stessa richiesta vengono sommati."""
+    totals: Dict[str, float] = {}
+    for name, seconds in stages:
+        totals[name] = totals.get(name, 0.0) + seconds
+    return ', '.join(f'{name};dur={seconds * 1000:.1f}' for name, seconds in totals.items())
+
+
+class StageTimingMiddleware:
+    """
+    Middleware ASGI: raccoglie gli stadi misurati durante una richiesta e li
+    aggiunge come header Server-Timing (più 'total'). Se METRICS_ENABLED registra
+    anche la durata della richiesta per metodo, route e stato.
+
+    Le risposte in streaming inviano gli header prima del calcolo: i loro stadi
+    finiscono solo negli istogrammi.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        stages: List[Tuple[str, float]] = []
+        token = _request_stages.set(stages)
+        start = perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                header = server_timing_header([*stages, ('total', perf_counter() - start)])
+                message['headers'] = [*message.get('headers', []), (b'server-timing', header.encode('latin-1'))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_stages.reset(token)
+            if METRICS_ENABLED:
+                route = scope.get('route')
+                path = getattr(route, 'path', None) or 'unmatched'
+                _observe(_request_histograms, (scope['method'], path, str(status)), perf_counter() - start)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _histogram_lines(metric: str, histograms: Dict, labels: Callable) -> List[str]:
+    lines = [f'# TYPE {metric} histogram']
+    for key, histogram in sorted(histograms.items()):
+        label = labels(key)
+        for le, count in histogram.samples():
+            lines.append(f'{metric}_bucket{{{label},le="{le}"}} {count}')
+        lines.append(f'{metric}_sum{{{label}}} {histogram.sum:.6f}')
+        lines.append(f'{metric}_count{{{label}}} {histogram.count}')
+    return lines
+
+
+def render_prometheus() -> str:
+    """Tutte le metriche nel formato testuale di Prometheus (0.0.4)."""
+    with _lock:
+        stage_histograms = {k: _copy(h) for k, h in _stage_histograms.items()}
+        request_histograms = {k: _copy(h) for k, h in _request_histograms.items()}
+        caches = {name: tuple(counters) for name, counters in _cache_counters.items()}
+    for name, collector in _cache_collectors.items():
+        caches[name] = collector()
+
+    lines = ['# HELP portfolio_stage_duration_seconds Durata degli stadi di calcolo (backtest, frontiera, grafici).']
+    lines += _histogram_lines('portfolio_stage_duration_seconds', stage_histograms,
+                              lambda name: f'stage="{_escape(name)}"')
+    lines.append('# HELP portfolio_request_duration_seconds Durata delle richieste HTTP per route.')
+    lines += _histogram_lines('portfolio_request_duration_seconds', request_histograms,
+                              lambda key: f'method="{key[0]}",route="{_escape(key[1])}",status="{key[2]}"')
+
+    lines.append('# HELP portfolio_cache_hits_total Accessi alle cache serviti dalla cache.')
+    lines.append('# TYPE portfolio_cache_hits_total counter')
+    lines += [f'portfolio_cache_hits_total{{cache="{name}"}} {hits}' for name, (hits, _) in sorted(caches.items())]
+    lines.append('# HELP portfolio_cache_misses_total Accessi alle cache non trovati.')
+    lines.append('# TYPE portfolio_cache_misses_total counter')
+    lines += [f'portfolio_cache_misses_total{{cache="{name}"}} {misses}' for name, (_, misses) in sorted(caches.items())]
+    lines.append('# HELP portfolio_cache_hit_ratio Frazione di hit dall\'avvio del processo.')
+    lines.append('# TYPE portfolio_cache_hit_ratio gauge')
+    lines += [f'portfolio_cache_hit_ratio{{cache="{name}"}} {hits / (hits + misses):.6f}'
+              for name, (hits, misses) in sorted(caches.items()) if hits + misses]
+
+    for metric, (metric_type, help_text, collector) in sorted(_metrics.items()):
+        lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} {metric_type}', f'{metric} {collector()}']
+    return '\n'.join(lines) + '\n'
+
+
+def _copy(histogram: Histogram) -> Histogram:
+    copy = Histogram(histogram.buckets)
+    copy.counts, copy.sum, copy.count = list(histogram.counts), histogram.sum, histogram.count
+    return copy
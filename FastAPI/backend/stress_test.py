@@ -0,0 +1,222 @@
+import json
+import os
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from pydantic import BaseModel, Field, conlist
+from fastapi import HTTPException
+
+from efficient_frontier import EtfInput
+from market_data import load_price_panel
+from stage_metrics import StageClock
+
+
+class CrisisScenario(BaseModel):
+    name: str
+    label: str = ""
+    start_date: str  # Picco pre-crisi
+    end_date: str    # Fine della finestra (minimo del mercato)
+
+
+# Catalogo delle crisi storiche (finestre dal picco al minimo dell'S&P 500)
+SCENARIO_CATALOG: Dict[str, CrisisScenario] = {
+    scenario.name: scenario for scenario in [
+        CrisisScenario(name="dotcom", label="Bolla dot-com 2000-2002", start_date="2000-03-24", end_date="2002-10-09"),
+        CrisisScenario(name="gfc", label="Crisi finanziaria globale 2007-2009", start_date="2007-10-09", end_date="2009-03-09"),
+        CrisisScenario(name="covid", label="COVID-19 2020", start_date="2020-02-19", end_date="2020-03-23"),
+        CrisisScenario(name="rates_2022", label="Rialzo dei tassi 2022", start_date="2022-01-03", end_date="2022-10-12"),
+    ]
+}
+# File JSON opzionale con altri scenari ([{"name": ..., "start_date": ..., "end_date": ...}]), aggiunti al catalogo
+STRESS_SCENARIOS_FILE = os.environ.get('STRESS_SCENARIOS_FILE')
+if STRESS_SCENARIOS_FILE:
+    with open(STRESS_SCENARIOS_FILE) as f:
+        SCENARIO_CATALOG.update({s['name']: CrisisScenario(**s) for s in json.load(f)})
+MAX_STRESS_PORTFOLIOS = 500
+# Distanza massima tra l'inizio di uno scenario e il primo giorno di borsa usato
+MAX_START_GAP_DAYS = 7
+
+
+class StressPortfolio(BaseModel):
+    name: Optional[str] = None  # Default: portfolio_<n>
+    etfs: conlist(EtfInput, min_length=1)  # type: ignore
+
+
+class StressTestPayload(BaseModel):
+    portfolios: conlist(StressPortfolio, min_length=1)  # type: ignore
+    scenarios: Optional[List[str]] = None  # Nomi del catalogo; None = tutti
+    custom_scenarios: List[CrisisScenario] = []  # Finestre aggiuntive, oltre al catalogo
+    end_date: str = Field(default_factory=lambda: datetime.now().strftime('%Y-%m-%d'))  # Fine dei dati usati per misurare il recupero
+
+
+def resolve_scenarios(payload: StressTestPayload) -> List[CrisisScenario]:
+    """Scenari richiesti: quelli del catalogo (tutti se non indicati) più quelli personalizzati."""
+    names = payload.scenarios if payload.scenarios is not None else list(SCENARIO_CATALOG)
+    unknown = [name for name in names if name not in SCENARIO_CATALOG]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Scenari sconosciuti: {', '.join(unknown)}. "
+                                                    f"Disponibili: {', '.join(SCENARIO_CATALOG)}")
+    scenarios = [SCENARIO_CATALOG[name] for name in names] + list(payload.custom_scenarios)
+    if not scenarios:
+        raise HTTPException(status_code=400, detail="Nessuno scenario richiesto")
+    for scenario in scenarios:
+        if scenario.start_date >= scenario.end_date:
+            raise HTTPException(status_code=400, detail=f"Scenario {scenario.name}: start_date deve precedere end_date")
+    if len({scenario.name for scenario in scenarios}) < len(scenarios):
+        raise HTTPException(status_code=400, detail="I nomi degli scenari devono essere unici")
+    return scenarios
+
+
+def data_range(payload: StressTestPayload, scenarios: List[CrisisScenario]) -> Tuple[str, str]:
+    """Intervallo del pannello: dal primo picco alla fine dei dati (per misurare il recupero)."""
+    return min(s.start_date for s in scenarios), max(payload.end_date, *(s.end_date for s in scenarios))
+
+
+@lru_cache(maxsize=64)
+def _scenario_offsets(tickers: Tuple[str, ...], start_date: str, end_date: str,
+                      windows: Tuple[Tuple[str, str], ...]) -> Tuple[np.ndarray, np.ndarray]:
+    """Start/end row of every window on the cached panel (end inclusive; -1 when outside the data)."""
+    index = load_price_panel(list(tickers), start_date, end_date).index
+    window_starts = pd.DatetimeIndex([w[0] for w in windows])
+    starts = index.searchsorted(window_starts, side='left')
+    ends = index.searchsorted(pd.DatetimeIndex([w[1] for w in windows]), side='right') - 1
+    # Una finestra iniziata prima dei dati non ha il suo picco nel pannello (tollerate le festività)
+    late = index[np.minimum(starts, len(index) - 1)] - window_starts > pd.Timedelta(days=MAX_START_GAP_DAYS)
+    outside = (starts >= len(index)) | (ends < starts) | late
+    return np.where(outside, -1, starts), np.where(outside, -1, ends)
+
+
+def _date(index: pd.DatetimeIndex, row) -> str:
+    return index[row].strftime('%Y-%m-%d')
+
+
+def evaluate_scenarios(prices: np.ndarray, weights: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> Dict:
+    """
+    Buy-and-hold stress metrics of K portfolios over S crisis windows.
+
+    prices is the forward-filled (days x assets) panel and weights the
+    (K x assets) matrix of portfolio weights. For each window the panel is
+    rebased on its first row and every portfolio path comes from one matmul;
+    drawdown, trough and recovery are then reduced along time for all
+    portfolios at once. Recovery is searched up to the end of the panel.
+
+    Returns (S x K) arrays: loss over the window, max drawdown, trough row,
+    recovery row (-1 if not recovered) and a validity mask (every held asset
+    priced at the window start).
+    """
+    n_scenarios, n_portfolios = len(starts), len(weights)
+    loss = np.full((n_scenarios, n_portfolios), np.nan)
+    drawdown = np.full((n_scenarios, n_portfolios), np.nan)
+    trough = np.full((n_scenarios, n_portfolios), -1)
+    recovery = np.full((n_scenarios, n_portfolios), -1)
+    valid = np.zeros((n_scenarios, n_portfolios), dtype=bool)
+    held = weights > 0
+
+    for s, (start, end) in enumerate(zip(starts, ends)):
+        if start < 0:
+            continue
+        base = prices[start]
+        priced = ~np.isnan(base)
+        valid[s] = ~(held & ~priced).any(axis=1)
+        portfolios = np.flatnonzero(valid[s])
+        if not len(portfolios):
+            continue
+
+        # Valore relativo di ogni portafoglio dal picco (1 = inizio finestra); i NaN pesano 0
+        rebased = np.nan_to_num(prices[start:, priced] / base[priced])
+        paths = rebased @ weights[np.ix_(portfolios, priced)].T
+        window = paths[:end - start + 1]
+
+        peak = np.maximum.accumulate(window, axis=0)
+        underwater = window / peak - 1
+        trough_offset = underwater.argmin(axis=0)
+        columns = np.arange(len(portfolios))
+        max_drawdown = underwater[trough_offset, columns]
+        loss[s, portfolios] = window[-1] - 1
+        drawdown[s, portfolios] = max_drawdown
+        trough[s, portfolios] = start + trough_offset
+
+        # Recupero: primo giorno dopo il minimo in cui il valore torna al picco precedente
+        # (nessuna perdita dal picco: recupero immediato)
+        recovered = (paths >= peak[trough_offset, columns]) & (np.arange(len(paths))[:, None] > trough_offset)
+        first = recovered.argmax(axis=0)
+        recovery[s, portfolios] = np.where(max_drawdown < 0, np.where(recovered[first, columns], start + first, -1),
+                                           start + trough_offset)
+
+    return {'loss': loss, 'max_drawdown': drawdown, 'trough': trough, 'recovery': recovery, 'valid': valid}
+
+
+def run_stress_test(payload: StressTestPayload) -> Dict:
+    """
+    Evaluate every submitted portfolio over every requested crisis window.
+
+    All portfolios share one cached price panel (union of their tickers,
+    from the earliest window to end_date); window boundaries are looked up
+    once per panel as row offsets. A cell is None when some held ETF has
+    no price at the window start.
+    """
+    if len(payload.portfolios) > MAX_STRESS_PORTFOLIOS:
+        raise HTTPException(status_code=400, detail=f"Massimo {MAX_STRESS_PORTFOLIOS} portafogli per richiesta")
+    scenarios = resolve_scenarios(payload)
+    start_date, end_date = data_range(payload, scenarios)
+    tickers = tuple(sorted({etf.name for portfolio in payload.portfolios for etf in portfolio.etfs}))
+
+    clock = StageClock('stress')
+    panel = load_price_panel(list(tickers), start_date, end_date)
+    if panel.empty:
+        raise HTTPException(status_code=400, detail="No data available for the specified period")
+    starts, ends = _scenario_offsets(tickers, start_date, end_date,
+                                     tuple((s.start_date, s.end_date) for s in scenarios))
+    clock.lap('load')
+
+    # Matrice dei pesi (portafogli x ticker del pannello), ogni riga normalizzata a 1
+    columns = {ticker: j for j, ticker in enumerate(panel.columns)}
+    weights = np.zeros((len(payload.portfolios), len(columns)))
+    for k, portfolio in enumerate(payload.portfolios):
+        for etf in portfolio.etfs:
+            if etf.name not in columns:
+                raise HTTPException(status_code=400, detail=f"Nessun dato per {etf.name}")
+            weights[k, columns[etf.name]] += etf.weight
+    totals = weights.sum(axis=1, keepdims=True)
+    if (totals <= 0).any():
+        raise HTTPException(status_code=400, detail="I pesi di ogni portafoglio devono avere somma positiva")
+    weights /= totals
+
+    metrics = evaluate_scenarios(panel.ffill().to_numpy(), weights, starts, ends)
+    clock.lap('evaluate')
+
+    index = panel.index
+    names = [portfolio.name or f"portfolio_{k + 1}" for k, portfolio in enumerate(payload.portfolios)]
+    results = []
+    for k, name in enumerate(names):
+        cells = {}
+        for s, scenario in enumerate(scenarios):
+            if not metrics['valid'][s, k]:
+                cells[scenario.name] = None
+                continue
+            trough, recovery = metrics['trough'][s, k], metrics['recovery'][s, k]
+            cells[scenario.name] = {
+                "loss": round(float(metrics['loss'][s, k]), 4),
+                "max_drawdown": round(float(metrics['max_drawdown'][s, k]), 4),
+                "trough_date": _date(index, trough),
+                "recovery_date": _date(index, recovery) if recovery >= 0 else None,
+                "recovery_days": int(recovery - trough) if recovery >= 0 else None,  # Giorni di borsa dal minimo
+            }
+        results.append({"portfolio": name, "scenarios": cells})
+
+    return {
+        "scenarios": [
+            {
+                "name": scenario.name,
+                "label": scenario.label,
+                "start_date": _date(index, start) if start >= 0 else None,
+                "end_date": _date(index, end) if start >= 0 else None,
+            }
+            for scenario, start, end in zip(scenarios, starts, ends)
+        ],
+        "results": results,
+        "config": {"start_date": start_date, "end_date": end_date, "tickers": list(tickers)},
+    }
@@ -0,0 +1,196 @@
+import numpy as np
+import pandas as pd
+from typing import Dict, NamedTuple
+
+
+LOT_METHODS = ('fifo', 'hifo')
+# Periodo pandas del ribilanciamento: si opera il primo giorno di borsa di ogni nuovo periodo
+REBALANCE_PERIODS = {'monthly': 'M', 'quarterly': 'Q', 'yearly': 'Y', 'none': None}
+
+
+class TaxLotResult(NamedTuple):
+    """Esito della simulazione con lotti fiscali (valori nella valuta dell'investimento)."""
+    equity: pd.Series                # Valore giornaliero dopo tasse pagate e costi di transazione
+    realized_gains: Dict[int, float]  # Plusvalenze nette realizzate per anno solare
+    taxes: Dict[int, float]          # Tasse dovute per anno solare (pagate il primo giorno dell'anno dopo)
+    transaction_costs: float
+    unrealized_gain: float           # Plusvalenza latente a fine periodo
+    liquidation_value: float         # Valore finale al netto delle tasse di una vendita totale
+
+
+class TaxLotBook:
+    """
+    Purchase lots of every asset in preallocated (asset x lot) arrays.
+
+    Lots are appended in purchase order, so FIFO relief is a cumulative sum
+    along each row; HIFO reorders each row by cost basis first. Sold-out lots
+    keep quantity 0 instead of being removed, so no array is ever resized:
+    with one buy per asset per trade date, max_lots = number of trade dates.
+    """
+
+    def __init__(self, n_assets: int, max_lots: int, method: str = 'fifo'):
+        if method not in LOT_METHODS:
+            raise ValueError(f"lot_method deve essere uno tra: {', '.join(LOT_METHODS)}")
+        self.method = method
+        self.quantity = np.zeros((n_assets, max_lots))
+        self.basis = np.zeros((n_assets, max_lots))  # Costo unitario di carico (costi di acquisto compresi)
+        self.n_lots = 0
+
+    def buy(self, quantity: np.ndarray, unit_cost: np.ndarray):
+        """Un nuovo lotto per asset (quantità 0 per gli asset non acquistati)."""
+        self.quantity[:, self.n_lots] = quantity
+        self.basis[:, self.n_lots] = unit_cost
+        self.n_lots += 1
+
+    def sell(self, quantity: np.ndarray, unit_proceeds: np.ndarray) -> float:
+        """Scarica 'quantity' di ogni asset dai lotti e restituisce la plusvalenza realizzata."""
+        # Solo le righe degli asset venduti (a ogni ribilanciamento circa la metà)
+        selling = np.flatnonzero(quantity > 0)
+        if not len(selling):
+            return 0.0
+        held = self.quantity[selling, :self.n_lots]
+        basis = self.basis[selling, :self.n_lots]
+        if self.method == 'hifo':
+            order = np.argsort(-basis, axis=1, kind='stable')
+            held, basis = np.take_along_axis(held, order, axis=1), np.take_along_axis(basis, order, axis=1)
+
+        # Quantità presa da ogni lotto: quella che resta da vendere dopo i lotti precedenti, fino al lotto intero
+        before = np.cumsum(held, axis=1) - held
+        taken = np.clip(quantity[selling, None] - before, 0.0, held)
+        gain = float(np.sum(taken * (unit_proceeds[selling, None] - basis)))
+
+        if self.method == 'hifo':
+            # Riporta i lotti nell'ordine di acquisto
+            remaining = np.empty_like(held)
+            np.put_along_axis(remaining, order, held - taken, axis=1)
+        else:
+            remaining = held - taken
+        self.quantity[selling, :self.n_lots] = remaining
+        return gain
+
+    def unrealized_gain(self, prices: np.ndarray) -> float:
+        held = self.quantity[:, :self.n_lots]
+        return float(np.sum(held * (prices[:, None] - self.basis[:, :self.n_lots])))
+
+
+def _trade_rows(dates: pd.DatetimeIndex, frequency: str) -> tuple:
+    """(righe di ribilanciamento, righe di pagamento delle tasse) come array booleani."""
+    if frequency not in REBALANCE_PERIODS:
+        raise ValueError(f"rebalance_frequency deve essere uno tra: {', '.join(REBALANCE_PERIODS)}")
+
+    def first_of(period: str) -> np.ndarray:
+        codes = dates.to_period(period).asi8
+        rows = np.empty(len(codes), dtype=bool)
+        rows[0] = False
+        rows[1:] = codes[1:] != codes[:-1]
+        return rows
+
+    new_year = first_of('Y')
+    period = REBALANCE_PERIODS[frequency]
+    rebalance = first_of(period) if period else np.zeros(len(dates), dtype=bool)
+    return rebalance, new_year
+
+
+def simulate_tax_lots(prices: np.ndarray, dates: pd.DatetimeIndex, weights: np.ndarray,
+                      initial_investment: float, tax_rate: float, rebalance_frequency: str = 'quarterly',
+                      lot_method: str = 'fifo', transaction_cost: float = 0.0) -> TaxLotResult:
+    """
+    Rebalanced portfolio with capital-gains tax on realized gains.
+
+    prices is the (days x assets) panel of unweighted prices, weights the
+    target weights. On the first trading day of every rebalance period the
+    holdings are brought back to the target: overweight assets are sold
+    (lots relieved FIFO or HIFO) and the proceeds buy the underweight ones.
+    Gains realized in a calendar year, net of losses carried forward, are
+    taxed at tax_rate and paid on the first trading day of the next year
+    (selling pro-rata when that day is not also a rebalance). Transaction
+    costs are charged on every trade and included in the lot cost basis.
+
+    The simulation starts on the first day every asset has a price (an ETF
+    listed after the start of the panel delays it), so the returned equity
+    may begin later than dates. With tax_rate=0 it is the pre-tax equity of
+    the same rebalanced portfolio, costs included.
+
+    Between trade dates holdings are constant, so the equity of each segment
+    is one matrix-vector product.
+    """
+    if not 0.0 <= tax_rate <= 1.0:
+        raise ValueError("tax_rate deve essere compresa tra 0 e 1")
+    # Giorni senza prezzo (calendari diversi): vale l'ultimo prezzo noto
+    prices = pd.DataFrame(prices).ffill().to_numpy()
+    complete = np.flatnonzero(~np.isnan(prices).any(axis=1))
+    if not len(complete):
+        raise ValueError("Nessun giorno con un prezzo per ogni ETF: impossibile simulare le tasse")
+    prices, dates = prices[complete[0]:], dates[complete[0]:]
+
+    weights = np.asarray(weights, dtype=float) / np.sum(weights)
+    rebalance, new_year = _trade_rows(dates, rebalance_frequency)
+    trade_rows = np.flatnonzero(rebalance | new_year)
+    years = dates.year.to_numpy()
+
+    book = TaxLotBook(len(weights), len(trade_rows) + 1, lot_method)
+    cost = transaction_cost
+    price = prices[0]
+    shares = weights * initial_investment / (1 + cost) / price
+    book.buy(shares, price * (1 + cost))
+    costs = initial_investment - initial_investment / (1 + cost)
+
+    equity = np.empty(len(prices))
+    realized: Dict[int, float] = {}
+    taxes: Dict[int, float] = {}
+    carried_loss = 0.0
+    segment_start = 0
+    for row in (*trade_rows, len(prices)):
+        equity[segment_start:row] = prices[segment_start:row] @ shares
+        if row == len(prices):
+            break
+        price = prices[row]
+        value = price @ shares
+
+        tax_due = 0.0
+        if new_year[row]:
+            year = int(years[row - 1])
+            taxable = realized.get(year, 0.0) - carried_loss
+            carried_loss = max(-taxable, 0.0)
+            tax_due = taxes[year] = max(taxable, 0.0) * tax_rate
+
+        # Vendite verso il peso obiettivo (il valore da reinvestire è al netto delle tasse);
+        # senza ribilanciamento le tasse si pagano vendendo in proporzione a quanto detenuto
+        current = shares * price
+        if rebalance[row]:
+            target = weights * (value - tax_due)
+        elif tax_due > 0:
+            target = current * (1 - tax_due / ((1 - cost) * value))
+        else:
+            continue
+        sell_value = np.maximum(current - target, 0.0)
+        buy_value = np.maximum(target - current, 0.0)
+        sold = sell_value / price
+        gain = book.sell(sold, price * (1 - cost))
+        realized[int(years[row])] = realized.get(int(years[row]), 0.0) + gain
+
+        # Liquidità: ricavi netti meno tasse, tutta reinvestita (acquisti ridotti in proporzione ai costi)
+        cash = sell_value.sum() * (1 - cost) - tax_due
+        total_buy = buy_value.sum()
+        scale = cash / ((1 + cost) * total_buy) if total_buy > 0 else 0.0
+        bought = buy_value * max(scale, 0.0) / price
+        book.buy(bought, price * (1 + cost))
+        costs += sell_value.sum() * cost + total_buy * max(scale, 0.0) * cost
+        shares = shares - sold + bought
+        segment_start = row
+
+    # Liquidazione finale: plusvalenze dell'ultimo anno e latenti, al netto delle perdite riportate
+    last_year = int(years[-1])
+    unrealized = book.unrealized_gain(prices[-1] * (1 - cost))
+    final_value = equity[-1]
+    final_tax = max(realized.get(last_year, 0.0) + unrealized - carried_loss, 0.0) * tax_rate
+    liquidation_value = final_value * (1 - cost) - final_tax
+
+    return TaxLotResult(
+        equity=pd.Series(equity, index=dates),
+        realized_gains={year: round(gain, 2) for year, gain in sorted(realized.items())},
+        taxes={year: round(tax, 2) for year, tax in sorted(taxes.items())},
+        transaction_costs=float(costs),
+        unrealized_gain=unrealized,
+        liquidation_value=float(liquidation_value),
+    )
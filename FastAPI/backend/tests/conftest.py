@@ -0,0 +1,5 @@
+import os
+import sys
+
+# I moduli del backend sono importati per nome, come fa main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from tax_lots import TaxLotBook, simulate_tax_lots
+
+
+def _book(method):
+    book = TaxLotBook(n_assets=1, max_lots=3, method=method)
+    book.buy(np.array([10.0]), np.array([100.0]))
+    book.buy(np.array([10.0]), np.array([150.0]))
+    book.buy(np.array([10.0]), np.array([120.0]))
+    return book
+
+
+def test_fifo_relieves_oldest_lots_first():
+    book = _book('fifo')
+    gain = book.sell(np.array([15.0]), np.array([200.0]))
+    assert gain == pytest.approx(10 * 100 + 5 * 50)
+    np.testing.assert_allclose(book.quantity[0], [0.0, 5.0, 10.0])
+
+
+def test_hifo_relieves_highest_basis_first_and_keeps_purchase_order():
+    book = _book('hifo')
+    gain = book.sell(np.array([15.0]), np.array([200.0]))
+    assert gain == pytest.approx(10 * 50 + 5 * 80)
+    np.testing.assert_allclose(book.quantity[0], [10.0, 0.0, 5.0])
+
+
+def test_unknown_lot_method_is_rejected():
+    with pytest.raises(ValueError):
+        TaxLotBook(1, 1, method='lifo')
+
+
+def _two_asset_prices(dates):
+    # A perde il 20% ad aprile 2020; B crolla nello stesso giorno e recupera ad aprile 2021
+    a = np.where(dates < '2020-04-01', 100.0, 80.0)
+    b = np.select([dates < '2020-04-01', dates < '2021-04-01'], [100.0, 40.0], 120.0)
+    return np.column_stack([a, b])
+
+
+def test_losses_are_carried_forward_and_taxes_paid_on_the_first_day_of_next_year():
+    dates = pd.bdate_range('2020-01-01', '2022-06-30')
+    prices = _two_asset_prices(dates)
+    result = simulate_tax_lots(prices, dates, np.array([0.5, 0.5]), 10_000, tax_rate=0.2,
+                               rebalance_frequency='quarterly', lot_method='fifo')
+
+    # 2020: ribilanciando si vende A in perdita (12.5 quote a 80, carico 100)
+    # 2021: si vendono 25 quote di B a 120 (carico 100), compensate dalla perdita del 2020
+    assert result.realized_gains[2020] == pytest.approx(-250.0)
+    assert result.realized_gains[2021] == pytest.approx(500.0)
+    assert result.taxes[2020] == 0.0
+    assert result.taxes[2021] == pytest.approx((500.0 - 250.0) * 0.2)
+
+    # Prezzi invariati a cavallo dell'anno: il valore scende esattamente della tassa pagata
+    first_2022 = dates.get_loc(dates[dates.year == 2022][0])
+    equity = result.equity.to_numpy()
+    assert equity[first_2022 - 1] - equity[first_2022] == pytest.approx(50.0)
+
+
+def test_zero_tax_rate_gives_the_pre_tax_rebalanced_equity():
+    dates = pd.bdate_range('2020-01-01', '2022-06-30')
+    prices = _two_asset_prices(dates)
+    taxed = simulate_tax_lots(prices, dates, np.array([0.5, 0.5]), 10_000, tax_rate=0.2)
+    untaxed = simulate_tax_lots(prices, dates, np.array([0.5, 0.5]), 10_000, tax_rate=0.0)
+    assert sum(untaxed.taxes.values()) == 0.0
+    assert untaxed.equity.iloc[-1] > taxed.equity.iloc[-1]
+
+
+def test_simulation_starts_when_every_asset_has_a_price():
+    dates = pd.bdate_range('2020-01-01', '2020-12-31')
+    prices = _two_asset_prices(dates)
+    prices[:30, 1] = np.nan  # B quotato dal trentunesimo giorno
+    result = simulate_tax_lots(prices, dates, np.array([0.5, 0.5]), 10_000, tax_rate=0.26)
+    assert result.equity.index[0] == dates[30]
+    assert result.equity.iloc[0] == pytest.approx(10_000)
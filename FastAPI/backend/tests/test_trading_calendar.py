@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+
+import trading_calendar
+
+
+def _days(exclude):
+    return pd.bdate_range('2024-01-01', '2024-01-12').drop(pd.DatetimeIndex(exclude))
+
+
+def test_same_endpoints_different_holidays_are_not_confused():
+    trading_calendar.clear_cache()
+    full = pd.bdate_range('2024-01-01', '2024-01-12')
+    # Stessa lunghezza, stesso primo e ultimo giorno, festività diverse
+    first = _days(['2024-01-03'])
+    second = _days(['2024-01-09'])
+    assert len(first) == len(second) and first[0] == second[0] and first[-1] == second[-1]
+
+    values = np.arange(1.0, len(first) + 1)
+    a = trading_calendar.align({'X': first, 'Y': full})
+    b = trading_calendar.align({'X': second, 'Y': full})
+
+    expected_a = pd.Series(values, index=first).reindex(full, method='ffill').to_numpy()
+    expected_b = pd.Series(values, index=second).reindex(full, method='ffill').to_numpy()
+    assert not np.array_equal(expected_a, expected_b)
+    np.testing.assert_array_equal(a.take('X', values), expected_a)
+    np.testing.assert_array_equal(b.take('X', values), expected_b)
+
+
+def test_equal_calendars_reuse_the_alignment():
+    trading_calendar.clear_cache()
+    first = trading_calendar.align({'X': _days(['2024-01-03']), 'Y': _days([])})
+    again = trading_calendar.align({'X': _days(['2024-01-03']), 'Y': _days([])})
+    assert again is first
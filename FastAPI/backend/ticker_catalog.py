@@ -0,0 +1,29 @@
+from typing import Dict, List, Optional
+
+
+# Catalogo dei ticker disponibili organizzati per categoria.
+# Usato da /api/tickers e dai vincoli di gruppo della frontiera efficiente.
+TICKER_CATEGORIES: Dict[str, List[str]] = {
+    "US Equity ETFs": ["VTI", "VOO", "SPY", "QQQ", "VB", "VBR", "VUG", "VTV"],
+    "International Equity ETFs": ["VXUS", "VEA", "VWO", "EFA", "EEM", "IEFA", "IEMG"],
+    "Bond ETFs": ["BND", "VGIT", "VGLT", "TIP", "LQD", "HYG", "AGG", "GOVT"],
+    "Sector ETFs": ["XLK", "XLF", "XLV", "XLE", "XLI", "XLY", "XLP", "XLRE"],
+    "Global ETFs": ["VT", "ACWI", "FTIHX", "SWTSX"],
+    "Commodity ETFs": ["GLD", "SLV", "PDBC", "DBC", "USO"]
+}
+
+
+def all_tickers() -> List[str]:
+    """Restituisce tutti i ticker del catalogo in ordine alfabetico."""
+    tickers = []
+    for category_tickers in TICKER_CATEGORIES.values():
+        tickers.extend(category_tickers)
+    return sorted(tickers)
+
+
+def category_of(ticker: str) -> Optional[str]:
+    """Restituisce la categoria di un ticker, o None se non è nel catalogo."""
+    for category, category_tickers in TICKER_CATEGORIES.items():
+        if ticker in category_tickers:
+            return category
+    return None
@@ -0,0 +1,189 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional
+
+from pydantic import BaseModel
+
+from stage_metrics import count_cache
+from ticker_catalog import category_of
+
+
+# Archivio locale dei metadati (sovrascrivibile con TICKER_INFO_DB)
+TICKER_INFO_DB = os.environ.get(
+    'TICKER_INFO_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ticker_info.sqlite3')
+)
+# Dopo questo tempo un record dell'archivio viene riscaricato dal provider
+STORE_TTL_SECONDS = 7 * 24 * 3600
+# Cache in memoria davanti all'archivio (LRU: i ticker richiesti sono arbitrari, anche sconosciuti)
+MEMORY_TTL_SECONDS = 3600
+MEMORY_CACHE_SIZE = 10_000
+# Richieste parallele al provider per i ticker mancanti
+PROVIDER_WORKERS = 8
+MAX_BULK_TICKERS = 200
+
+FIELDS = ('ticker', 'name', 'ter', 'currency', 'inception_date', 'category', 'fetched_at')
+
+
+class TickerInfoRequest(BaseModel):
+    tickers: List[str]
+    refresh: bool = False  # Ignora cache e archivio e riscarica dal provider
+
+
+def yfinance_metadata(ticker: str) -> Optional[Dict]:
+    """
+    Default provider: ETF metadata from Yahoo Finance.
+
+    ter is in percent per year, like Etf.ter. Returns None for unknown symbols.
+    """
+    import yfinance as yf  # caricato solo quando serve il provider (import lento)
+
+    info = yf.Ticker(ticker).info or {}
+    if not info or info.get('quoteType') is None:
+        return None
+
+    # Yahoo riporta netExpenseRatio in percentuale (0.03 = 0.03%) e annualReportExpenseRatio come frazione
+    ter = info.get('netExpenseRatio')
+    if ter is None and info.get('annualReportExpenseRatio') is not None:
+        ter = info['annualReportExpenseRatio'] * 100
+    inception = info.get('fundInceptionDate') or info.get('firstTradeDateEpochUtc')
+    return {
+        'name': info.get('longName') or info.get('shortName'),
+        'ter': float(ter) if ter is not None else None,
+        'currency': info.get('currency'),
+        'inception_date': datetime.fromtimestamp(inception, tz=timezone.utc).strftime('%Y-%m-%d') if inception else None,
+        'category': info.get('category'),
+    }
+
+
+_provider: Callable[[str], Optional[Dict]] = yfinance_metadata
+_memory: "OrderedDict[str, tuple]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def set_provider(provider: Callable[[str], Optional[Dict]]):
+    """Sostituisce il provider dei metadati (es. un file interno o un altro data vendor)."""
+    global _provider
+    _provider = provider
+    clear_memory_cache()
+
+
+def clear_memory_cache():
+    with _lock:
+        _memory.clear()
+
+
+def _connect() -> sqlite3.Connection:
+    connection = sqlite3.connect(TICKER_INFO_DB, timeout=10)
+    connection.row_factory = sqlite3.Row
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS ticker_info ('
+        ' ticker TEXT PRIMARY KEY, name TEXT, ter REAL, currency TEXT,'
+        ' inception_date TEXT, category TEXT, fetched_at REAL NOT NULL)'
+    )
+    return connection
+
+
+def _from_memory(tickers: List[str], now: float) -> Dict[str, Optional[Dict]]:
+    """Voci valide in memoria; None indica un ticker che il provider non conosce."""
+    found = {}
+    with _lock:
+        for ticker in tickers:
+            entry = _memory.get(ticker)
+            if entry is None:
+                continue
+            if entry[1] > now:
+                found[ticker] = entry[0]
+                _memory.move_to_end(ticker)
+            else:
+                del _memory[ticker]  # Scaduta
+    return found
+
+
+def _remember(records: Iterable[Dict], now: float, unknown: Iterable[str] = ()):
+    expires = now + MEMORY_TTL_SECONDS
+    entries = [(record['ticker'], (record, expires)) for record in records]
+    entries += [(ticker, (None, expires)) for ticker in unknown]
+    with _lock:
+        for ticker, entry in entries:
+            _memory[ticker] = entry
+            _memory.move_to_end(ticker)
+        while len(_memory) > MEMORY_CACHE_SIZE:
+            _memory.popitem(last=False)
+
+
+def _from_store(tickers: List[str], now: float) -> Dict[str, Dict]:
+    if not tickers:
+        return {}
+    placeholders = ','.join('?' * len(tickers))
+    with _connect() as connection:
+        rows = connection.execute(
+            f'SELECT {", ".join(FIELDS)} FROM ticker_info WHERE ticker IN ({placeholders}) AND fetched_at > ?',
+            [*tickers, now - STORE_TTL_SECONDS]
+        ).fetchall()
+    return {row['ticker']: dict(row) for row in rows}
+
+
+def _save(records: List[Dict]):
+    if not records:
+        return
+    with _connect() as connection:
+        connection.executemany(
+            f'INSERT OR REPLACE INTO ticker_info ({", ".join(FIELDS)}) VALUES ({", ".join("?" * len(FIELDS))})',
+            [tuple(record[field] for field in FIELDS) for record in records]
+        )
+
+
+# Errore del provider (rete, rate limit): a differenza di None non viene memorizzato
+_FAILED = object()
+
+
+def _fetch(ticker: str, now: float):
+    try:
+        metadata = _provider(ticker)
+    except Exception:
+        return _FAILED
+    if metadata is None:
+        return None
+    record = {field: metadata.get(field) for field in FIELDS}
+    # La categoria del catalogo (usata dai vincoli di gruppo) prevale su quella del provider
+    record.update(ticker=ticker, category=category_of(ticker) or metadata.get('category'), fetched_at=now)
+    return record
+
+
+def get_ticker_info(tickers: Iterable[str], refresh: bool = False, fetch: bool = True) -> Dict[str, Dict]:
+    """
+    Metadata for many tickers in one call: memory cache, then SQLite, then the provider.
+
+    Only the tickers missing (or stale) at each level are passed to the next
+    one. Provider lookups run in parallel and are written back in a single
+    transaction. With fetch=False the provider is never called, so only
+    already-known tickers are returned. Unknown tickers are left out of the result.
+    """
+    tickers = list(dict.fromkeys(t.strip().upper() for t in tickers if t and t.strip()))
+    now = time.time()
+
+    found = {} if refresh else _from_memory(tickers, now)
+    missing = [t for t in tickers if t not in found]
+    if not refresh:
+        count_cache('ticker_info_memory', hits=len(found), misses=len(missing))
+        stored = _from_store(missing, now)
+        _remember(stored.values(), now)
+        found.update(stored)
+        count_cache('ticker_info_store', hits=len(stored), misses=len(missing) - len(stored))
+        missing = [t for t in missing if t not in found]
+
+    if missing and fetch:
+        with ThreadPoolExecutor(max_workers=min(PROVIDER_WORKERS, len(missing))) as pool:
+            fetched = dict(zip(missing, pool.map(lambda t: _fetch(t, now), missing)))
+        records = [record for record in fetched.values() if isinstance(record, dict)]
+        _save(records)
+        # Anche i ticker sconosciuti restano in memoria, per non interrogare il provider a ogni richiesta
+        _remember(records, now, unknown=[t for t, record in fetched.items() if record is None])
+        found.update({record['ticker']: record for record in records})
+
+    return {t: found[t] for t in tickers if found.get(t) is not None}
@@ -0,0 +1,83 @@
+import hashlib
+from functools import lru_cache
+from typing import Dict, NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+
+from stage_metrics import lru_cache_collector, register_cache_collector
+
+
+# Allineamenti (universo + calendari dei ticker) tenuti in memoria
+ALIGNMENT_CACHE_SIZE = 64
+
+
+class Calendars:
+    """
+    Giorni di quotazione dei ticker di un universo. L'hash è un digest di tutte le
+    date di ogni ticker (due calendari con gli stessi estremi ma festività diverse
+    restano distinti) e l'uguaglianza confronta le date per intero.
+    """
+
+    def __init__(self, dates: Dict[str, pd.DatetimeIndex]):
+        self.dates = dates
+        self.key = tuple((ticker, d.dtype, hashlib.blake2b(d.asi8.tobytes(), digest_size=16).digest())
+                         for ticker, d in dates.items())
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __eq__(self, other):
+        return (isinstance(other, Calendars) and self.key == other.key
+                and all(np.array_equal(d.asi8, other.dates[ticker].asi8) for ticker, d in self.dates.items()))
+
+
+class Alignment(NamedTuple):
+    """Indice comune dei giorni di borsa e, per ogni ticker, le righe da cui leggere i prezzi."""
+    index: pd.DatetimeIndex
+    # 1 + posizione nella serie del ticker dell'ultimo prezzo noto in ogni giorno di index
+    # (0 prima del primo prezzo); None se il ticker quota in tutti i giorni di index
+    positions: Dict[str, Optional[np.ndarray]]
+
+    def take(self, ticker: str, values: np.ndarray) -> np.ndarray:
+        """Prezzi del ticker su index, con l'ultimo prezzo noto nei giorni in cui la sua borsa è chiusa."""
+        positions = self.positions[ticker]
+        if positions is None:
+            return values
+        return np.concatenate(([np.nan], values))[positions]
+
+
+@lru_cache(maxsize=ALIGNMENT_CACHE_SIZE)
+def _align(calendars: Calendars) -> Alignment:
+    dates = list(calendars.dates.values())
+    first = dates[0]
+    if all(d.equals(first) for d in dates[1:]):
+        return Alignment(first, dict.fromkeys(calendars.dates))
+
+    # Unione ordinata dei giorni di tutte le borse, poi per ogni ticker una ricerca binaria
+    index = pd.DatetimeIndex(np.unique(np.concatenate([d.to_numpy() for d in dates])))
+    positions = {}
+    for ticker, d in calendars.dates.items():
+        positions[ticker] = None if len(d) == len(index) else d.searchsorted(index, side='right')
+    return Alignment(index, positions)
+
+
+def align(dates: Dict[str, pd.DatetimeIndex]) -> Alignment:
+    """
+    Master trading-day index of a universe and the integer positions that align every ticker to it.
+
+    The index is the union of the tickers' trading days (e.g. NYSE and Borsa
+    Italiana). On days when a ticker's exchange is closed its last close is
+    carried forward, so a mixed-market portfolio is never summed with a
+    missing price counted as zero. Alignments are cached per universe and
+    calendar, so repeated backtests reduce to one fancy-indexing gather per
+    ticker. Every index in dates must be sorted, without duplicates.
+    """
+    return _align(Calendars(dates))
+
+
+def clear_cache():
+    _align.cache_clear()
+
+
+register_cache_collector('calendar_alignment', lru_cache_collector(_align))